@@ -7,31 +7,44 @@ import random
 import uuid
 import threading
 import time
+import atexit
+import signal
+import glob
+import hashlib
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
 from datetime import datetime, timedelta, date
+from calendar import monthrange
 from functools import wraps
-from collections import defaultdict
+from contextlib import closing
+from xml.etree import ElementTree
+from collections import defaultdict, OrderedDict
 
 import requests
 import traceback
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
 from bs4 import BeautifulSoup
-from PIL import Image
+from PIL import Image, ImageOps, ImageFilter, ImageChops
 try:
     import pytesseract
 except ImportError:
     pytesseract = None
-try:
-    import docx
-except ImportError:
-    docx = None
 try:
     import openpyxl
 except ImportError:
     openpyxl = None
-from hijri_converter import Gregorian
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from hijri_converter import Gregorian, Hijri
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
 from werkzeug.security import generate_password_hash, check_password_hash
 from config import Config
-from models import db, User, Habit, HabitLog, Schedule, RoutineItem, ScheduleLog, PrayerLog, Dua, Day, IslamicEvent, PushSubscription
+from models import db, User, Habit, HabitLog, Schedule, RoutineItem, ScheduleLog, PrayerLog, Dua, Day, IslamicEvent, PushSubscription, ExternalCache, DaySignificance, PushOutbox, DailyRollup, HabitStreak, AppliedMutation, AuditLog, UploadJob, UploadResult
 from pywebpush import webpush, WebPushException
 import json
 
@@ -55,43 +68,146 @@ VAPID_CLAIMS = {
 
 def send_push_notification(user_id, message_body, title="Habit Tracker"):
     """
-    Sends a push notification to all subscriptions of a user.
+    Queues a push notification for all subscriptions of a user.
+    Delivery happens in push_worker.py; returns the number of queued pushes.
     """
-    subscriptions = PushSubscription.query.filter_by(user_id=user_id).all()
-    count = 0
-    
-    payload = json.dumps({
-        "title": title,
-        "body": message_body,
-        "icon": "/static/img/mylogo.png"
-    })
-    
-    for sub in subscriptions:
-        try:
-            subscription_info = {
-                "endpoint": sub.endpoint,
-                "keys": {
-                    "p256dh": sub.p256dh,
-                    "auth": sub.auth
-                }
+    return enqueue_push([user_id], message_body, title)
+
+def enqueue_push(user_ids, message_body, title="Habit Tracker", commit=True):
+    """Adds one PushOutbox row per subscription of the given users."""
+    return enqueue_pushes([(user_id, title, message_body) for user_id in user_ids], commit=commit)
+
+def enqueue_pushes(messages, commit=True):
+    """
+    Queues [(user_id, title, body), ...] with one subscription query and one
+    bulk insert. Returns the number of queued pushes.
+    """
+    user_ids = {user_id for user_id, _, _ in messages}
+    subscriptions = defaultdict(list)
+    if user_ids:
+        for sub_id, user_id in db.session.query(PushSubscription.id, PushSubscription.user_id).filter(PushSubscription.user_id.in_(user_ids)):
+            subscriptions[user_id].append(sub_id)
+
+    rows = []
+    for user_id, title, body in messages:
+        payload = json.dumps({
+            "title": title,
+            "body": body,
+            "icon": "/static/img/mylogo.png"
+        })
+        rows.extend(PushOutbox(subscription_id=sub_id, user_id=user_id, payload=payload) for sub_id in subscriptions[user_id])
+    db.session.add_all(rows)
+    if commit:
+        db.session.commit()
+    return len(rows)
+
+def _deliver_push(subscription_info, payload):
+    """Sends one push (runs on the worker's thread pool, no DB access). Returns (outcome, error)."""
+    try:
+        webpush(
+            subscription_info=subscription_info,
+            data=payload,
+            vapid_private_key=VAPID_PRIVATE_KEY,
+            vapid_claims=VAPID_CLAIMS
+        )
+        return 'sent', None
+    except WebPushException as ex:
+        status_code = ex.response.status_code if ex.response is not None else None
+        # 404/410: the subscription is gone for good
+        if status_code in (404, 410):
+            return 'gone', str(ex)
+        if status_code is None or status_code == 429 or status_code >= 500:
+            return 'retry', str(ex)
+        return 'failed', str(ex)
+    except requests.RequestException as e:
+        return 'retry', str(e)
+    except Exception as e:
+        return 'failed', str(e)
+
+def drain_push_outbox(pool, now=None):
+    """
+    Sends one batch of due pushes in parallel on `pool` and records every outcome
+    with bulk statements and a single commit: transient errors are retried with
+    exponential backoff, dead subscriptions are pruned. Returns the batch metrics.
+    """
+    now = now or datetime.utcnow()
+    started = time.monotonic()
+    query = db.session.query(PushOutbox, PushSubscription) \
+        .outerjoin(PushSubscription, PushOutbox.subscription_id == PushSubscription.id) \
+        .filter(PushOutbox.status == 'pending', PushOutbox.next_attempt_at <= now) \
+        .order_by(PushOutbox.id).limit(app.config['PUSH_BATCH_SIZE'])
+    if db.engine.dialect.name == 'postgresql':
+        # Several workers can drain side by side
+        query = query.with_for_update(skip_locked=True, of=PushOutbox)
+    rows = query.all()
+    metrics = {'claimed': len(rows), 'sent': 0, 'retried': 0, 'failed': 0, 'pruned': 0}
+    if not rows:
+        return metrics
+
+    futures = {}
+    outcomes = {}
+    for item, sub in rows:
+        if sub is None:
+            outcomes[item.id] = ('gone', 'Subscription removed')
+            continue
+        subscription_info = {
+            "endpoint": sub.endpoint,
+            "keys": {
+                "p256dh": sub.p256dh,
+                "auth": sub.auth
             }
-            webpush(
-                subscription_info=subscription_info,
-                data=payload,
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims=VAPID_CLAIMS
-            )
-            count += 1
-        except WebPushException as ex:
-            print(f"Push failed: {ex}")
-            # If 410 Gone, delete subscription
-            if ex.response and ex.response.status_code == 410:
-                db.session.delete(sub)
-                db.session.commit()
-        except Exception as e:
-            print(f"Push Error: {e}")
-            
-    print(f"Sent {count} notifications to user {user_id}")
+        }
+        futures[pool.submit(_deliver_push, subscription_info, item.payload)] = item.id
+    for future in as_completed(futures):
+        outcomes[futures[future]] = future.result()
+
+    sent_ids = []
+    changes = []
+    dead_subscriptions = set()
+    for item, sub in rows:
+        outcome, error = outcomes[item.id]
+        attempts = (item.attempts or 0) + 1
+        if outcome == 'sent':
+            sent_ids.append(item.id)
+            continue
+        change = {'id': item.id, 'attempts': attempts, 'last_error': error}
+        if outcome == 'retry' and attempts < app.config['PUSH_MAX_ATTEMPTS']:
+            change['next_attempt_at'] = now + timedelta(seconds=app.config['PUSH_RETRY_BASE'] * 2 ** (attempts - 1))
+            metrics['retried'] += 1
+        elif outcome == 'gone':
+            change['status'] = 'gone'
+            if sub is not None:
+                dead_subscriptions.add(sub.id)
+        else:
+            change['status'] = 'failed'
+            metrics['failed'] += 1
+        changes.append(change)
+
+    if sent_ids:
+        PushOutbox.query.filter(PushOutbox.id.in_(sent_ids)).update(
+            {'status': 'sent', 'sent_at': now, 'attempts': db.func.coalesce(PushOutbox.attempts, 0) + 1},
+            synchronize_session=False
+        )
+    if changes:
+        db.session.execute(db.update(PushOutbox), changes)
+    if dead_subscriptions:
+        PushOutbox.query.filter(PushOutbox.subscription_id.in_(dead_subscriptions), PushOutbox.status == 'pending').update(
+            {'status': 'gone'}, synchronize_session=False
+        )
+        PushOutbox.query.filter(PushOutbox.subscription_id.in_(dead_subscriptions)).update(
+            {'subscription_id': None}, synchronize_session=False
+        )
+        PushSubscription.query.filter(PushSubscription.id.in_(dead_subscriptions)).delete(synchronize_session=False)
+    db.session.commit()
+
+    metrics['sent'] = len(sent_ids)
+    metrics['pruned'] = len(dead_subscriptions)
+    metrics['seconds'] = round(time.monotonic() - started, 3)
+    return metrics
+
+def push_outbox_stats():
+    """Delivery counts per status, e.g. {'sent': 120, 'pending': 3}."""
+    return dict(db.session.query(PushOutbox.status, db.func.count(PushOutbox.id)).group_by(PushOutbox.status).all())
 
 
 @app.route('/api/vapid_public_key')
@@ -130,9 +246,9 @@ def subscribe():
 @app.route('/test_push', methods=['POST'])
 @login_required
 def test_push():
-    """Trigger a test notification to self"""
-    send_push_notification(current_user.id, "This is a test notification from Habit Tracker!", "Test Alert")
-    return jsonify({"status": "sent"})
+    """Queue a test notification to self"""
+    queued = send_push_notification(current_user.id, "This is a test notification from Habit Tracker!", "Test Alert")
+    return jsonify({"status": "queued", "queued": queued})
 
 # Correctly handle proxy headers (Client -> Cloudflare -> Render -> App)
 # We trust 2 proxies: Render and Cloudflare
@@ -146,9 +262,114 @@ with app.app_context():
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+class UserCache:
+    """
+    Per-worker LRU of User column values with a TTL, so the user loader doesn't
+    query on every request. Changes that must reach every worker at once (bans,
+    deletions, role and password changes) bump the mtime of a stamp file; each
+    load stats it and drops the whole cache when it moved.
+    """
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.stamp = None  # Stamp file mtime the cache was last validated against
+        self._entries = OrderedDict()  # user_id -> (expires_at, values)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id, values):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def evict(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def validate(self, stamp):
+        if stamp != self.stamp:
+            self.clear()
+            self.stamp = stamp
+
+user_cache = UserCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+# User columns whose change must log out / re-authorize the user in every worker
+USER_CACHE_SENSITIVE = ('is_banned', 'role', 'password_hash', 'username')
+
+def user_cache_stamp_path():
+    return app.config['USER_CACHE_STAMP'] or os.path.join(app.instance_path, 'user_cache.stamp')
+
+def read_user_cache_stamp():
+    try:
+        return os.stat(user_cache_stamp_path()).st_mtime_ns
+    except OSError:
+        return None
+
+def bump_user_cache_stamp():
+    """Makes every worker drop its cached users on their next request."""
+    path = user_cache_stamp_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a'):
+        pass
+    now = time.time_ns()
+    os.utime(path, ns=(now, now))
+
+@event.listens_for(Session, 'after_flush')
+def _track_user_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, User):
+            continue
+        session.info.setdefault('user_cache_evict', set()).add(obj.id)
+        state = inspect(obj)
+        if obj in session.deleted or any(state.attrs[k].history.has_changes() for k in USER_CACHE_SENSITIVE):
+            session.info['user_cache_bump'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _apply_user_changes(session):
+    # Only after commit, so no worker can re-cache the old row in between
+    for user_id in session.info.pop('user_cache_evict', ()):
+        user_cache.evict(user_id)
+    if session.info.pop('user_cache_bump', False):
+        bump_user_cache_stamp()
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_user_changes(session):
+    session.info.pop('user_cache_evict', None)
+    session.info.pop('user_cache_bump', None)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    user_cache.validate(read_user_cache_stamp())
+    values = user_cache.get(user_id)
+    if values is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        user_cache.put(user_id, {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs})
+    else:
+        # Attach a copy to this session without a SELECT; lazy relationships still load normally
+        user = User(**values)
+        make_transient_to_detached(user)
+        user = db.session.merge(user, load=False)
+    # Banned users lose their existing sessions too, not just the ability to log in
+    return None if user.is_banned else user
 
 # Helper for Local Time (GMT+6)
 def get_local_now():
@@ -160,44 +381,175 @@ def get_today():
     """Returns today's date in GMT+6."""
     return get_local_now().date()
 
-def ensure_day(user_id, target_date):
+def dialect_insert(model):
+    """INSERT construct with ON CONFLICT support for the configured database (Postgres or SQLite)."""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+def insert_or_ignore(model, values, index_elements):
+    """
+    INSERT ... ON CONFLICT DO NOTHING, so two requests creating the same row
+    can't fail each other. Doesn't commit.
+    """
+    db.session.execute(dialect_insert(model).values(**values).on_conflict_do_nothing(index_elements=index_elements))
+
+def insert_returning(model, keys, values=None):
+    """
+    INSERT ... ON CONFLICT (keys) DO NOTHING RETURNING the new row, in one
+    statement. Returns None when a row with these keys already exists.
+    `keys` must match a unique constraint/index of the model. Doesn't commit.
+    """
+    stmt = dialect_insert(model).values(**keys, **(values or {})) \
+        .on_conflict_do_nothing(index_elements=list(keys)).returning(model)
+    return db.session.scalars(stmt).first()
+
+def get_or_insert(model, keys, values=None, commit=True):
+    """
+    Fetches the row identified by `keys`, creating it with `values` if missing.
+    The common case (row exists) is one SELECT; a missing row is one upsert,
+    and losing a creation race to another request costs one more SELECT
+    instead of a failed transaction.
+    """
+    row = model.query.filter_by(**keys).first()
+    if row is None:
+        row = insert_returning(model, keys, values)
+        if row is None:
+            row = model.query.filter_by(**keys).first()
+        elif commit:
+            db.session.commit()
+    return row
+
+def ensure_day(user_id, target_date, commit=True):
     """
     Ensures a Day object exists for the given user and date.
     Returns the Day object.
     """
-    day = Day.query.filter_by(user_id=user_id, date=target_date).first()
-    if not day:
+    return get_or_insert(Day, {'user_id': user_id, 'date': target_date}, commit=commit)
+
+class BackgroundFlush:
+    """
+    Base for the write-behind buffers below: once start() is called, flush()
+    runs every app.config[interval_setting] seconds on a daemon thread, and
+    once more at interpreter exit. Subclasses set `name` and `interval_setting`.
+    """
+    name = None
+    interval_setting = None
+
+    def __init__(self):
+        self._thread = None
+        atexit.register(self._flush_at_exit)
+
+    def start(self):
+        # Threads don't survive fork(), so a worker forked after the first start gets its own here
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f'{self.name.lower()}-flush', daemon=True)
+            self._thread.start()
+
+    def background_flush(self):
+        self.flush()
+
+    def _run(self):
+        while True:
+            time.sleep(app.config[self.interval_setting])
+            try:
+                with app.app_context():
+                    self.background_flush()
+            except Exception as e:
+                print(f"{self.name} flush error: {e}")
+
+    def _flush_at_exit(self):
+        try:
+            with app.app_context():
+                self.flush()
+        except Exception as e:
+            print(f"{self.name} flush error: {e}")
+
+class TelemetryBuffer(BackgroundFlush):
+    """
+    Write-behind buffer for the device and location columns of User. Values the
+    user row already holds are dropped; changed ones are merged per user in
+    memory and written by flush() as bulk UPDATEs, every
+    TELEMETRY_FLUSH_INTERVAL seconds from a background thread (and at exit).
+    A crashed worker loses at most one interval, which clients re-send.
+    """
+    name = 'Telemetry'
+    interval_setting = 'TELEMETRY_FLUSH_INTERVAL'
+
+    def __init__(self):
+        super().__init__()
+        self._pending = {}  # user_id -> {column: value}
+        self._lock = threading.Lock()
+
+    def record(self, user, values, changed_at=None):
+        """
+        Queues the entries of `values` that differ from `user`'s columns (or
+        from what is already queued). If any did, `changed_at` names a column
+        to set to the current time as well. Returns True if anything was queued.
+        """
+        current = {k: getattr(user, k) for k in values}
+        with self._lock:
+            queued = self._pending.get(user.id, {})
+            changed = {k: v for k, v in values.items() if queued.get(k, current[k]) != v}
+            if not changed:
+                return False
+            if changed_at:
+                changed[changed_at] = datetime.utcnow()
+            self._pending.setdefault(user.id, {}).update(changed)
+            self.start()
+        return True
+
+    def flush(self):
+        """Writes everything queued, one executemany UPDATE per set of columns. Returns the users written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        groups = defaultdict(list)
+        for user_id, values in pending.items():
+            groups[tuple(sorted(values))].append({'_id': user_id, **{'_' + k: v for k, v in values.items()}})
+        table = User.__table__
         try:
-            day = Day(user_id=user_id, date=target_date)
-            db.session.add(day)
+            for columns, rows in groups.items():
+                stmt = table.update().where(table.c.id == db.bindparam('_id')) \
+                    .values({c: db.bindparam('_' + c) for c in columns})
+                db.session.execute(stmt, rows)  # Rows of deleted users simply match nothing
             db.session.commit()
-        except:
+        except Exception:
             db.session.rollback()
-            day = Day.query.filter_by(user_id=user_id, date=target_date).first()
-    return day
+            with self._lock:  # Retry next time; anything queued since is newer and wins
+                for user_id, values in pending.items():
+                    self._pending[user_id] = {**values, **self._pending.get(user_id, {})}
+            raise
+        for user_id in pending:
+            user_cache.evict(user_id)  # Bulk UPDATEs bypass the session hooks
+        return len(pending)
+
+telemetry = TelemetryBuffer()
 
 # Context Processor for current year/data
 @app.route('/api/user/sync_local_ip', methods=['POST'])
 @login_required
 def sync_local_ip():
     data = request.get_json()
-    local_ip = data.get('local_ip')
-    ipv6 = data.get('ipv6')
-    fingerprint = data.get('fingerprint')
-    
-    if local_ip:
-        current_user.local_ip = local_ip
-    if ipv6:
-        current_user.ipv6_address = ipv6
-    if fingerprint:
-        current_user.device_fingerprint = fingerprint
-        
-    if local_ip or ipv6 or fingerprint:
-        db.session.commit()
+    values = {}
+    if data.get('local_ip'):
+        values['local_ip'] = data['local_ip']
+    if data.get('ipv6'):
+        values['ipv6_address'] = data['ipv6']
+    if data.get('fingerprint'):
+        values['device_fingerprint'] = data['fingerprint']
+
+    if values:
+        telemetry.record(current_user, values)
     return jsonify({"status": "success"})
 
 @app.errorhandler(Exception)
 def handle_exception(e):
+    if isinstance(e, HTTPException):
+        return e  # 404s, 413s... keep their status
     # Log the traceback
     print(f"ERROR: {e}")
     traceback.print_exc()
@@ -295,13 +647,168 @@ def update_location_api():
     lon = data.get('longitude')
     
     if lat is not None and lon is not None:
-        current_user.latitude = lat
-        current_user.longitude = lon
-        current_user.last_location_update = datetime.utcnow()
-        db.session.commit()
+        # GPS jitter below the stored precision isn't a change worth a write
+        places = app.config['TELEMETRY_LOCATION_DECIMALS']
+        try:
+            coords = {'latitude': round(float(lat), places), 'longitude': round(float(lon), places)}
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Invalid coordinates'}), 400
+        telemetry.record(current_user, coords, changed_at='last_location_update')
         return jsonify({'success': True})
     return jsonify({'success': False, 'error': 'Missing coordinates'}), 400
 
+class AuditSpool(BackgroundFlush):
+    """
+    Crash-safe write-behind for AuditLog. record() appends one JSON line to this
+    process's spool file and fsyncs it, so an admin request pays a local fsync
+    instead of an AuditLog insert. A background thread seals the file every
+    AUDIT_FLUSH_INTERVAL seconds and bulk-inserts it. Every record carries a
+    record_id that is unique in audit_log, so replaying a spool after a crash
+    (sealed files, or the files of workers that died) inserts nothing twice.
+    The live file is flock'ed by its owner; any unlocked one belongs to a dead worker.
+    """
+    name = 'Audit'
+    interval_setting = 'AUDIT_FLUSH_INTERVAL'
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._file = None
+        self._recover = True  # Replay what crashed workers left behind once, then only our own spool
+
+    def directory(self):
+        return app.config['AUDIT_SPOOL_DIR'] or os.path.join(app.instance_path, 'audit_spool')
+
+    def record(self, values):
+        line = json.dumps(values, default=str) + '\n'
+        with self._lock:
+            if self._file is None:
+                os.makedirs(self.directory(), exist_ok=True)
+                path = os.path.join(self.directory(), f'audit-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl')
+                self._file = open(path, 'a', encoding='utf-8')
+                if fcntl:
+                    fcntl.flock(self._file, fcntl.LOCK_EX)
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.start()
+
+    def _seal(self):
+        """Renames the live file so new records start a fresh one. Returns the sealed path."""
+        with self._lock:
+            if self._file is None:
+                return None
+            sealed = self._file.name[:-len('.jsonl')] + '.sealed'
+            os.rename(self._file.name, sealed)
+            self._file.close()  # Releases the flock
+            self._file = None
+            return sealed
+
+    def _orphans(self):
+        """Sealed files, and live files whose worker is gone, from every process."""
+        paths = glob.glob(os.path.join(self.directory(), '*.sealed'))
+        for path in glob.glob(os.path.join(self.directory(), '*.jsonl')):
+            if fcntl is None or (self._file and path == self._file.name):
+                continue
+            try:
+                with open(path, 'a') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # Owned by a running worker
+            except FileNotFoundError:
+                continue
+            paths.append(path)
+        return paths
+
+    def _insert(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return 0  # Another worker replayed it first
+        rows = []
+        for line in lines:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                continue  # Torn last line of a crashed write; its request never completed
+        for row in rows:
+            row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+        # Users deleted since (e.g. by this very action) would break the foreign keys
+        user_ids = {r['admin_id'] for r in rows} | {r['target_user_id'] for r in rows if r.get('target_user_id')}
+        existing = {uid for (uid,) in db.session.query(User.id).filter(User.id.in_(user_ids))} if user_ids else set()
+        kept = []
+        for row in rows:
+            if row['admin_id'] not in existing:
+                print(f"Audit record {row['record_id']} dropped: admin {row['admin_id']} no longer exists")
+                continue
+            if row.get('target_user_id') not in existing:
+                row['target_user_id'] = None
+            kept.append(row)
+        batch = app.config['AUDIT_BATCH_SIZE']
+        stmt = dialect_insert(AuditLog).on_conflict_do_nothing(index_elements=['record_id'])
+        for start in range(0, len(kept), batch):
+            db.session.execute(stmt, kept[start:start + batch])
+        db.session.commit()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return len(kept)
+
+    def flush(self, recover=False):
+        """
+        Inserts this process's spooled records (and, with `recover`, every
+        orphaned spool file). Returns the number of records written.
+        """
+        paths = self._orphans() if recover else []
+        sealed = self._seal()
+        if sealed:
+            paths.append(sealed)
+        written = 0
+        for path in paths:
+            try:
+                written += self._insert(path)
+            except Exception:
+                db.session.rollback()
+                raise
+        return written
+
+    def background_flush(self):
+        self.flush(recover=self._recover)
+        self._recover = False
+
+audit_spool = AuditSpool()
+if glob.glob(os.path.join(audit_spool.directory(), '*')):
+    audit_spool.start()  # Leftovers from before a restart
+
+def record_audit(action, target_user_id=None, reason=None):
+    """
+    Queues an AuditLog entry for the current admin. It is spooled (see
+    AuditSpool) only when the session next commits, so an action whose
+    commit fails leaves no record; audit-only calls commit themselves.
+    """
+    db.session.info.setdefault('audit_records', []).append({
+        'record_id': str(uuid.uuid4()),
+        'admin_id': current_user.id,
+        'action': action,
+        'target_user_id': target_user_id,
+        'reason': reason,
+        'ip_address': get_client_ip(),
+        'ipv6_address': current_user.ipv6_address,
+        'local_ip': current_user.local_ip,
+        'timestamp': datetime.utcnow().isoformat(),
+    })
+
+@event.listens_for(Session, 'after_commit')
+def _spool_audit_records(session):
+    for values in session.info.pop('audit_records', ()):
+        audit_spool.record(values)
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_audit_records(session):
+    session.info.pop('audit_records', None)
+
 # --- Admin Routes ---
 # --- Admin Decorators ---
 
@@ -325,12 +832,75 @@ def admin_dashboard():
     stats = {
         'users': User.query.count(),
         'habits': Habit.query.count(),
-        'prayers_logged': PrayerLog.query.count(),
+        'prayers_logged': db.session.query(db.func.coalesce(db.func.sum(DailyRollup.prayers_done), 0)).scalar(),
         'guests': User.query.filter_by(role='guest').count()
     }
     users = User.query.order_by(User.join_date.desc()).limit(10).all()
     return render_template('admin_dashboard.html', stats=stats, users=users, active_tab='overview')
 
+@app.route('/admin/api/activity')
+@login_required
+@admin_required
+def admin_activity_data():
+    """Platform-wide daily totals for the admin charts, one grouped query over the rollup."""
+    days = request.args.get('days', 30, type=int)
+    days = max(1, min(days, ANALYTICS_MAX_DAYS))
+    end_date = get_today()
+    start_date = end_date - timedelta(days=days-1)
+
+    rows = db.session.query(DailyRollup.date,
+                            db.func.sum(DailyRollup.habit_points + DailyRollup.prayer_points + DailyRollup.schedule_points),
+                            db.func.sum(DailyRollup.completed_habits),
+                            db.func.sum(DailyRollup.prayers_done),
+                            db.func.count(DailyRollup.user_id)) \
+        .filter(DailyRollup.date >= start_date, DailyRollup.date <= end_date) \
+        .group_by(DailyRollup.date).all()
+
+    return jsonify({
+        'labels': [(start_date + timedelta(days=i)).strftime('%b %d') for i in range(days)],
+        'total_scores': dense_daily_series([(r[0], r[1]) for r in rows], start_date, days),
+        'completed_habits': dense_daily_series([(r[0], r[2]) for r in rows], start_date, days),
+        'prayers_done': dense_daily_series([(r[0], r[3]) for r in rows], start_date, days),
+        'active_users': dense_daily_series([(r[0], r[4]) for r in rows], start_date, days)
+    })
+
+# Admin user list: sortable (all unique, so a single column is a keyset cursor) and paged
+ADMIN_USER_SORTS = {'id': User.id, 'username': User.username, 'email': User.email}
+ADMIN_USERS_PAGE_SIZE = 50
+ADMIN_USERS_COUNT_CAP = 1000  # Counted exactly up to here, estimated beyond
+
+def escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def user_search_ready():
+    """Whether migration 010's FTS5 table and its sync triggers exist (SQLite only)."""
+    return db.session.execute(db.text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'user_search_ai'")).first() is not None
+
+def user_search_filter(q):
+    """
+    Substring match on username or email that an index can serve: pg_trgm GIN
+    indexes make ILIKE indexed on Postgres, and SQLite uses the FTS5 trigram
+    table (trigrams need 3+ characters; shorter terms scan).
+    """
+    if db.engine.dialect.name == 'sqlite' and len(q) >= 3 and user_search_ready():
+        phrase = '"' + q.replace('"', '""') + '"'
+        matches = db.select(db.literal_column('rowid')).select_from(db.text('user_search')) \
+            .where(db.text('user_search MATCH :phrase').bindparams(phrase=phrase))
+        return User.id.in_(matches)
+    pattern = f'%{escape_like(q)}%'
+    return User.username.ilike(pattern, escape='\\') | User.email.ilike(pattern, escape='\\')
+
+def count_capped(query, cap):
+    """Returns (count, approximate). Counting stops after `cap` rows; an unfiltered Postgres list uses the planner's estimate."""
+    n = db.session.query(db.func.count()).select_from(query.order_by(None).limit(cap + 1).subquery()).scalar()
+    if n <= cap:
+        return n, False
+    if db.engine.dialect.name == 'postgresql' and query.whereclause is None:
+        estimate = db.session.execute(db.text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'user'")).scalar()
+        return max(int(estimate or 0), n), True
+    return cap, True
+
 @app.route('/admin/users')
 @login_required
 @admin_required
@@ -338,27 +908,65 @@ def admin_users():
     search_query = request.args.get('q', '').strip()
     role_filter = request.args.get('role', '')
     status_filter = request.args.get('status', '')
-    
+    sort = request.args.get('sort', 'id')
+    if sort not in ADMIN_USER_SORTS:
+        sort = 'id'
+    direction = 'asc' if request.args.get('dir') == 'asc' else 'desc'  # Newest first by default
+    after, before = request.args.get('after'), request.args.get('before')
+
     query = User.query
-    
-    if search_query:
-        query = query.filter(
-            (User.username.ilike(f'%{search_query}%')) | 
-            (User.email.ilike(f'%{search_query}%')) |
-            (db.cast(User.id, db.String).ilike(f'%{search_query}%'))
-        )
-    
     if role_filter:
         query = query.filter_by(role=role_filter)
-        
     if status_filter:
         if status_filter == 'active':
-            query = query.filter_by(is_banned=False)
+            query = query.filter(User.is_banned.isnot(True))
         elif status_filter == 'banned':
             query = query.filter_by(is_banned=True)
-            
-    users = query.all()
-    return render_template('admin_dashboard.html', users=users, active_tab='users', 
+
+    exact = None
+    if search_query:
+        # Fast paths: an ID or a full email is a single index lookup
+        if search_query.isdigit():
+            exact = query.filter(User.id == int(search_query)).all()
+        elif '@' in search_query:
+            exact = query.filter(User.email.in_({search_query, search_query.lower()})).all()
+        if not exact:
+            exact = None
+            query = query.filter(user_search_filter(search_query))
+
+    col = ADMIN_USER_SORTS[sort]
+    cursor_value = lambda raw: int(raw) if sort == 'id' else raw
+    if exact is not None:
+        users, has_next, has_prev = exact, False, False
+        total, approximate = len(exact), False
+    else:
+        total, approximate = count_capped(query, ADMIN_USERS_COUNT_CAP)
+        forward = before is None
+        page = query
+        try:
+            if after is not None:
+                page = page.filter(col < cursor_value(after) if direction == 'desc' else col > cursor_value(after))
+            elif before is not None:
+                page = page.filter(col > cursor_value(before) if direction == 'desc' else col < cursor_value(before))
+        except ValueError:
+            return redirect(url_for('admin_users', q=search_query, role=role_filter, status=status_filter, sort=sort, dir=direction))
+        # Walking back reads the previous page in reverse order
+        descending = (direction == 'desc') == forward
+        users = page.order_by(col.desc() if descending else col.asc()).limit(ADMIN_USERS_PAGE_SIZE + 1).all()
+        more = len(users) > ADMIN_USERS_PAGE_SIZE
+        users = users[:ADMIN_USERS_PAGE_SIZE]
+        if forward:
+            has_next, has_prev = more, after is not None
+        else:
+            users.reverse()
+            has_next, has_prev = True, more
+
+    pager = {
+        'total': total, 'approximate': approximate, 'sort': sort, 'dir': direction,
+        'next': getattr(users[-1], sort) if users and has_next else None,
+        'prev': getattr(users[0], sort) if users and has_prev else None,
+    }
+    return render_template('admin_dashboard.html', users=users, active_tab='users', pager=pager,
                            search_query=search_query, role_filter=role_filter, status_filter=status_filter)
 
 @app.route('/admin/user/<int:user_id>/ban', methods=['POST'])
@@ -369,17 +977,11 @@ def admin_ban_user(user_id):
     if user.id == current_user.id:
         flash("You cannot ban yourself!", "danger")
     else:
+        record_audit('ban_user', user.id)
         user.is_banned = not user.is_banned
         db.session.commit()
         status = "banned" if user.is_banned else "unbanned"
         flash(f"User {user.username} has been {status}.", "success")
-        # Audit log
-        from models import AuditLog
-        audit = AuditLog(admin_id=current_user.id, action='ban_user', target_user_id=user.id, 
-                         reason=None, ip_address=get_client_ip(), ipv6_address=current_user.ipv6_address,
-                         local_ip=current_user.local_ip)
-        db.session.add(audit)
-        db.session.commit()
     return redirect(url_for('admin_users'))
 
 @app.route('/admin/user/<int:user_id>/delete', methods=['POST'])
@@ -390,46 +992,123 @@ def admin_delete_user(user_id):
     if user.id == current_user.id:
         flash("You cannot delete yourself!", "danger")
     else:
-        # Audit log BEFORE deletion to keep record of who was deleted
-        from models import AuditLog
-        audit = AuditLog(admin_id=current_user.id, action='delete_user', target_user_id=user.id, 
-                         reason="Admin manual deletion", ip_address=get_client_ip(), 
-                         ipv6_address=current_user.ipv6_address, local_ip=current_user.local_ip)
-        db.session.add(audit)
-        
+        # Recorded before the delete; the row will be gone, so the record names who it was
+        record_audit('delete_user', user.id, f"Admin manual deletion of {user.username} (#{user.id})")
         db.session.delete(user)
         db.session.commit()
         flash(f"User {user.username} deleted.", "success")
     return redirect(url_for('admin_users'))
 
 # --- Admin User Detail View ---
+# The detail page is a summary shell; history tabs page through the JSON endpoints below
+ADMIN_HISTORY_PAGE_SIZE = 50
+
+def history_page(query, date_col, id_col, key_of=lambda row: (row.date, row.id)):
+    """Applies the (date, id) keyset cursor in ?after= and returns (rows, next_cursor), newest first.
+
+    Raises ValueError on a malformed cursor.
+    """
+    after = request.args.get('after')
+    if after:
+        raw_date, _, raw_id = after.partition(':')
+        key = (datetime.strptime(raw_date, '%Y-%m-%d').date(), int(raw_id))
+        query = query.filter(db.tuple_(date_col, id_col) < key)
+    rows = query.order_by(date_col.desc(), id_col.desc()).limit(ADMIN_HISTORY_PAGE_SIZE + 1).all()
+    more = len(rows) > ADMIN_HISTORY_PAGE_SIZE
+    rows = rows[:ADMIN_HISTORY_PAGE_SIZE]
+    if not more:
+        return rows, None
+    last_date, last_id = key_of(rows[-1])
+    return rows, f'{last_date.isoformat()}:{last_id}'
+
+def history_response(query, date_col, id_col, serialize):
+    try:
+        rows, next_cursor = history_page(query, date_col, id_col)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    return jsonify({'success': True, 'items': [serialize(r) for r in rows], 'next': next_cursor})
+
 @app.route('/admin/user/<int:user_id>', methods=['GET'])
 @login_required
 @admin_required
 def admin_user_detail(user_id):
     user = User.query.get_or_404(user_id)
     # Audit log for view action
-    from models import AuditLog
-    audit = AuditLog(admin_id=current_user.id, action='view_user', target_user_id=user.id, 
-                     reason=None, ip_address=get_client_ip(), ipv6_address=current_user.ipv6_address,
-                     local_ip=current_user.local_ip)
-    db.session.add(audit)
+    record_audit('view_user', user.id)
     db.session.commit()
-    # Gather related data
     habits = Habit.query.filter_by(user_id=user.id).all()
-    habit_logs = HabitLog.query.join(Habit).filter(Habit.user_id == user.id).all()
-    prayer_logs = PrayerLog.query.filter_by(user_id=user.id).all()
-    schedule_logs = ScheduleLog.query.filter_by(user_id=user.id).all()
-    days = Day.query.filter_by(user_id=user.id).order_by(Day.date.desc()).limit(100).all()
-    
-    # [NEW] Fetch User's Active Schedule
-    from models import Schedule
     active_schedule = Schedule.query.filter_by(user_id=user.id, is_active=True).first()
-    
-    return render_template('admin_user_detail.html', user=user, habits=habits, habit_logs=habit_logs,
-                           prayer_logs=prayer_logs, schedule_logs=schedule_logs, days=days, 
+
+    # Tab badges: one round trip of scalar counts
+    count_of = lambda model: db.select(db.func.count(model.id)).where(model.user_id == user.id).scalar_subquery()
+    counts = db.session.execute(db.select(
+        count_of(PrayerLog).label('prayers'),
+        count_of(ScheduleLog).label('schedule'),
+        count_of(Day).label('days'),
+    )).one()._asdict()
+
+    return render_template('admin_user_detail.html', user=user, habits=habits, counts=counts,
                            active_schedule=active_schedule, active_tab='users')
 
+@app.route('/admin/api/user/<int:user_id>/prayers')
+@login_required
+@admin_required
+def admin_user_prayers(user_id):
+    query = PrayerLog.query.filter_by(user_id=user_id)
+    return history_response(query, PrayerLog.date, PrayerLog.id, lambda p: {
+        'id': p.id, 'date': p.date.isoformat(), 'spiritual_score': p.spiritual_score,
+        **{name: bool(getattr(p, name)) for name in PRAYERS},
+    })
+
+@app.route('/admin/api/user/<int:user_id>/schedule_logs')
+@login_required
+@admin_required
+def admin_user_schedule_logs(user_id):
+    query = db.session.query(
+        ScheduleLog.id, ScheduleLog.date, ScheduleLog.task, ScheduleLog.time, ScheduleLog.status, ScheduleLog.points,
+        RoutineItem.title, RoutineItem.start_time, RoutineItem.end_time, RoutineItem.location,
+    ).outerjoin(RoutineItem, ScheduleLog.routine_id == RoutineItem.id).filter(ScheduleLog.user_id == user_id)
+
+    def serialize(s):
+        if s.title is not None:
+            time_range = f"{s.start_time.strftime('%I:%M %p')} - {s.end_time.strftime('%I:%M %p')}"
+        else:
+            time_range = s.time or '-'
+        return {'id': s.id, 'date': s.date.isoformat(), 'task': s.title if s.title is not None else s.task,
+                'time': time_range, 'location': s.location or '-', 'status': bool(s.status), 'points': s.points}
+    return history_response(query, ScheduleLog.date, ScheduleLog.id, serialize)
+
+@app.route('/admin/api/user/<int:user_id>/days')
+@login_required
+@admin_required
+def admin_user_days(user_id):
+    query = db.session.query(Day, PrayerLog).outerjoin(PrayerLog, PrayerLog.day_id == Day.id).filter(Day.user_id == user_id)
+    try:
+        rows, next_cursor = history_page(query, Day.date, Day.id, key_of=lambda row: (row.Day.date, row.Day.id))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+    # Habit and schedule completion for the whole page in one grouped query
+    day_ids = [d.id for d, _ in rows]
+    tally = defaultdict(lambda: {'habits': [0, 0], 'schedule': [0, 0]})
+    if day_ids:
+        grouped = lambda kind, model: db.select(
+            model.day_id, db.literal(kind), db.func.count(model.id),
+            db.func.coalesce(db.func.sum(db.case((model.status.is_(True), 1), else_=0)), 0),
+        ).where(model.day_id.in_(day_ids)).group_by(model.day_id)
+        for day_id, kind, total, done in db.session.execute(db.union_all(grouped('habits', HabitLog), grouped('schedule', ScheduleLog))):
+            tally[day_id][kind] = [int(done), int(total)]
+
+    items = []
+    for d, p in rows:
+        items.append({
+            'id': d.id, 'date': d.date.isoformat(), 'intention': d.intention, 'reflection': d.reflection,
+            'mood': d.mood, 'energy_level': d.energy_level, 'total_score': d.total_score,
+            'habits': tally[d.id]['habits'], 'schedule': tally[d.id]['schedule'],
+            'prayers': {name: bool(getattr(p, name)) for name in PRAYERS} if p else None,
+        })
+    return jsonify({'success': True, 'items': items, 'next': next_cursor})
+
 @app.route('/admin/content/duas')
 @login_required
 @admin_required
@@ -462,14 +1141,7 @@ def admin_add_dua():
             user_id=None # Global dua
         )
         db.session.add(new_dua)
-        
-        # Audit log
-        from models import AuditLog
-        audit = AuditLog(admin_id=current_user.id, action='add_dua', target_user_id=None, 
-                         reason=f"Added global dua: {title}", ip_address=get_client_ip(), 
-                         ipv6_address=current_user.ipv6_address, local_ip=current_user.local_ip)
-        db.session.add(audit)
-        
+        record_audit('add_dua', reason=f"Added global dua: {title}")
         db.session.commit()
         flash(f"Dua '{title}' added successfully!", "success")
         return redirect(url_for('admin_duas'))
@@ -489,17 +1161,13 @@ def admin_add_event():
         new_event = IslamicEvent(
             title=title,
             date=event_date,
-            color=color
+            color=color,
+            is_recurring_hijri=bool(request.form.get('is_recurring_hijri'))
         )
         db.session.add(new_event)
-        
-        # Audit log
-        from models import AuditLog
-        audit = AuditLog(admin_id=current_user.id, action='add_event', target_user_id=None, 
-                         reason=f"Added global event: {title}", ip_address=get_client_ip(), 
-                         ipv6_address=current_user.ipv6_address, local_ip=current_user.local_ip)
-        db.session.add(audit)
-        
+        if new_event.is_recurring_hijri:
+            reindex_recurring_event(new_event)
+        record_audit('add_event', reason=f"Added global event: {title}")
         db.session.commit()
         flash(f"Event '{title}' added to global calendar!", "success")
         return redirect(url_for('admin_events'))
@@ -512,14 +1180,8 @@ def admin_add_event():
 def admin_delete_dua(dua_id):
     dua = Dua.query.get_or_404(dua_id)
     title = dua.title
-    
-    # Audit log
-    from models import AuditLog
-    audit = AuditLog(admin_id=current_user.id, action='delete_dua', target_user_id=None, 
-                     reason=f"Deleted global dua: {title}", ip_address=get_client_ip(), 
-                     ipv6_address=current_user.ipv6_address, local_ip=current_user.local_ip)
-    db.session.add(audit)
-    
+
+    record_audit('delete_dua', reason=f"Deleted global dua: {title}")
     db.session.delete(dua)
     db.session.commit()
     flash("Dua deleted.", "success")
@@ -531,15 +1193,11 @@ def admin_delete_dua(dua_id):
 def admin_delete_event(event_id):
     event = IslamicEvent.query.get_or_404(event_id)
     title = event.title
-    
-    # Audit log
-    from models import AuditLog
-    audit = AuditLog(admin_id=current_user.id, action='delete_event', target_user_id=None, 
-                     reason=f"Deleted global event: {title}", ip_address=get_client_ip(), 
-                     ipv6_address=current_user.ipv6_address, local_ip=current_user.local_ip)
-    db.session.add(audit)
-    
+
+    record_audit('delete_event', reason=f"Deleted global event: {title}")
     db.session.delete(event)
+    if event.is_recurring_hijri:
+        reindex_recurring_event(event, removed=True)
     db.session.commit()
     flash("Event deleted.", "success")
     return redirect(url_for('admin_events'))
@@ -548,7 +1206,7 @@ def admin_delete_event(event_id):
 @login_required
 @admin_required
 def admin_logs():
-    from models import AuditLog
+    audit_spool.flush()  # Show this worker's latest actions too
     logs = AuditLog.query.order_by(AuditLog.timestamp.desc()).limit(100).all()
     return render_template('admin_dashboard.html', logs=logs, active_tab='system_logs')
 
@@ -560,18 +1218,16 @@ def admin_log_action():
     action = data.get('action')
     target_user_id = data.get('target_user_id')
     reason = data.get('reason')
+    # Pages send the id as read from a data- attribute, i.e. a string
+    if target_user_id is not None:
+        try:
+            if isinstance(target_user_id, bool) or not isinstance(target_user_id, (int, str)):
+                raise ValueError
+            target_user_id = int(target_user_id)
+        except ValueError:
+            return jsonify({"status": "error", "error": "Invalid target_user_id"}), 400
     
-    from models import AuditLog
-    audit = AuditLog(
-        admin_id=current_user.id,
-        action=action,
-        target_user_id=target_user_id,
-        reason=reason,
-        ip_address=get_client_ip(),
-        ipv6_address=current_user.ipv6_address,
-        local_ip=current_user.local_ip
-    )
-    db.session.add(audit)
+    record_audit(action, target_user_id, reason)
     db.session.commit()
     return jsonify({"status": "success"})
 
@@ -605,6 +1261,8 @@ def index():
 def recalculate_day_score(day_id):
     """
     Sum up all points for a given day (Habits, Prayers, Schedule).
+    Toggles keep Day.total_score current with add_day_score(); this full
+    re-aggregation is only needed for repairs (see reconcile_day_scores).
     """
     from models import HabitLog, PrayerLog, ScheduleLog, Day
     day = Day.query.get(day_id)
@@ -618,6 +1276,349 @@ def recalculate_day_score(day_id):
     db.session.commit()
     return day.total_score
 
+def add_day_score(day_id, delta):
+    """
+    Applies a score change to Day.total_score as a single atomic UPDATE in the
+    current transaction. The caller commits together with the log change.
+    """
+    if delta:
+        Day.query.filter_by(id=day_id).update(
+            {Day.total_score: db.func.coalesce(Day.total_score, 0) + delta},
+            synchronize_session=False
+        )
+
+def reconcile_day_scores(fix=True):
+    """
+    Recomputes every Day.total_score in bulk (one grouped query per log table)
+    and reports the days whose stored score has drifted.
+    Returns a list of (day_id, stored, expected); corrects them when fix=True.
+    """
+    habit_sums = dict(db.session.query(HabitLog.day_id, db.func.sum(HabitLog.points))
+                      .filter(HabitLog.day_id != None).group_by(HabitLog.day_id).all())
+    prayer_sums = dict(db.session.query(PrayerLog.day_id, db.func.sum(PrayerLog.spiritual_score))
+                       .filter(PrayerLog.day_id != None).group_by(PrayerLog.day_id).all())
+    schedule_sums = dict(db.session.query(ScheduleLog.day_id, db.func.sum(ScheduleLog.points))
+                         .filter(ScheduleLog.day_id != None, ScheduleLog.status == True).group_by(ScheduleLog.day_id).all())
+
+    drift = []
+    for day_id, stored in db.session.query(Day.id, Day.total_score).all():
+        expected = int((habit_sums.get(day_id) or 0) + (prayer_sums.get(day_id) or 0) + (schedule_sums.get(day_id) or 0))
+        if (stored or 0) != expected:
+            drift.append((day_id, stored, expected))
+
+    if fix and drift:
+        db.session.execute(db.update(Day), [{'id': day_id, 'total_score': expected} for day_id, _, expected in drift])
+        db.session.commit()
+    return drift
+
+ROLLUP_COLUMNS = ('habit_points', 'prayer_points', 'schedule_points', 'completed_habits', 'prayers_done')
+
+def add_rollup(user_id, day, **deltas):
+    """
+    Adds deltas (e.g. habit_points=10, completed_habits=1) to the user's
+    DailyRollup row for `day` with one atomic UPDATE, creating the row first if
+    needed. Runs in the caller's transaction, like add_day_score.
+    """
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    values = {getattr(DailyRollup, k): db.func.coalesce(getattr(DailyRollup, k), 0) + v for k, v in deltas.items()}
+    rollup = DailyRollup.query.filter_by(user_id=user_id, date=day)
+    if not rollup.update(values, synchronize_session=False):
+        insert_or_ignore(DailyRollup, dict({c: 0 for c in ROLLUP_COLUMNS}, user_id=user_id, date=day), ['user_id', 'date'])
+        rollup.update(values, synchronize_session=False)
+
+class ScoreDeltas:
+    """
+    Collects Day.total_score and DailyRollup changes from one or more
+    mutations so a request writes each of them once (see flush).
+    """
+
+    def __init__(self, day):
+        self.day = day
+        self.score = 0
+        self.rollup = defaultdict(int)
+
+    def add(self, score=0, **rollup):
+        self.score += score
+        for column, delta in rollup.items():
+            self.rollup[column] += delta
+
+    def flush(self):
+        """Issues the atomic UPDATEs in the current transaction (the caller commits)."""
+        add_day_score(self.day.id, self.score)
+        add_rollup(self.day.user_id, self.day.date, **self.rollup)
+        self.score = 0
+        self.rollup.clear()
+
+def backfill_rollups(user_id=None):
+    """
+    Rebuilds DailyRollup from the raw log tables with one grouped query per
+    table (per user and date). Returns the number of rollup rows written.
+    """
+    totals = defaultdict(lambda: dict.fromkeys(ROLLUP_COLUMNS, 0))
+
+    habit_q = db.session.query(Habit.user_id, HabitLog.date, db.func.sum(db.func.coalesce(HabitLog.points, 0)), db.func.count(HabitLog.id)) \
+        .join(Habit, HabitLog.habit_id == Habit.id).filter(HabitLog.status == True)
+    prayer_done = sum(db.case((getattr(PrayerLog, p) == True, 1), else_=0) for p in ['fajr', 'dhuhr', 'asr', 'maghrib', 'isha'])
+    prayer_q = db.session.query(PrayerLog.user_id, PrayerLog.date, db.func.sum(db.func.coalesce(PrayerLog.spiritual_score, 0)), db.func.sum(prayer_done))
+    schedule_q = db.session.query(ScheduleLog.user_id, ScheduleLog.date, db.func.sum(db.func.coalesce(ScheduleLog.points, 0))) \
+        .filter(ScheduleLog.status == True)
+    if user_id is not None:
+        habit_q = habit_q.filter(Habit.user_id == user_id)
+        prayer_q = prayer_q.filter(PrayerLog.user_id == user_id)
+        schedule_q = schedule_q.filter(ScheduleLog.user_id == user_id)
+
+    for uid, day, points, done in habit_q.group_by(Habit.user_id, HabitLog.date).all():
+        totals[(uid, day)].update(habit_points=int(points or 0), completed_habits=int(done or 0))
+    for uid, day, points, done in prayer_q.group_by(PrayerLog.user_id, PrayerLog.date).all():
+        totals[(uid, day)].update(prayer_points=int(points or 0), prayers_done=int(done or 0))
+    for uid, day, points in schedule_q.group_by(ScheduleLog.user_id, ScheduleLog.date).all():
+        totals[(uid, day)]['schedule_points'] = int(points or 0)
+
+    stale = DailyRollup.query
+    if user_id is not None:
+        stale = stale.filter_by(user_id=user_id)
+    stale.delete(synchronize_session=False)
+    rows = [dict(values, user_id=uid, date=day) for (uid, day), values in totals.items()]
+    if rows:
+        db.session.execute(db.insert(DailyRollup), rows)
+    db.session.commit()
+    return len(rows)
+
+# Periods (days or weeks) remembered in HabitStreak.history for the completion rates
+STREAK_WINDOW = 30
+STREAK_MASK = (1 << STREAK_WINDOW) - 1
+
+def streak_frequency(habit_frequency):
+    return 'Weekly' if habit_frequency == 'Weekly' else 'Daily'
+
+def habit_period(frequency, day):
+    """Start of the streak period holding `day`: the day itself, or its Monday for weekly habits."""
+    if frequency == 'Weekly':
+        return day - timedelta(days=day.weekday())
+    return day
+
+def period_gap(frequency, earlier, later):
+    """Number of periods between two period starts."""
+    days = (later - earlier).days
+    return days // 7 if frequency == 'Weekly' else days
+
+def apply_streak_period(state, period, done):
+    """
+    Records that `period` is now done / not done on a HabitStreak, in O(1).
+    Only the latest completed period can be undone this way; returns False
+    when an older period changed and the habit needs rebuild_habit_streaks.
+    """
+    freq = state.frequency
+    last = state.last_period
+    if last is not None and period < last:
+        return False
+    if done and period == last:
+        return True
+    if not done and (last is None or period > last):
+        return True
+
+    history = state.history or 0
+    if state.anchor is None or period > state.anchor:
+        shift = period_gap(freq, state.anchor, period) if state.anchor else STREAK_WINDOW
+        history = (history << shift) & STREAK_MASK if shift < STREAK_WINDOW else 0
+        state.anchor = period
+    bit = 1 << period_gap(freq, period, state.anchor)
+    if bit <= STREAK_MASK:
+        history = history | bit if done else history & ~bit
+    state.history = history
+
+    current = state.current_streak or 0
+    if done:
+        if last is not None and period_gap(freq, last, period) == 1:
+            current += 1
+        else:
+            state.prior_longest = max(state.prior_longest or 0, current)
+            current = 1
+        state.last_period = period
+    else:
+        # Undoing the newest period of the run
+        current -= 1
+        state.last_period = period - timedelta(days=7 if freq == 'Weekly' else 1) if current else None
+    state.current_streak = current
+    state.longest_streak = max(state.prior_longest or 0, current)
+    return True
+
+def new_habit_streak(habit_id, frequency):
+    return HabitStreak(habit_id=habit_id, frequency=frequency, current_streak=0, longest_streak=0,
+                       prior_longest=0, last_period=None, anchor=None, history=0)
+
+def rebuild_habit_streaks(habit_ids=None, commit=True):
+    """
+    Replays completed HabitLogs (oldest first, streamed) into fresh HabitStreak
+    rows. Used for the initial backfill, after a habit's frequency changes and
+    when an older period is toggled. Returns the number of habits rebuilt.
+    """
+    habits = db.session.query(Habit.id, Habit.frequency)
+    logs = db.session.query(HabitLog.habit_id, HabitLog.date).filter(HabitLog.status == True)
+    stale = HabitStreak.query
+    if habit_ids is not None:
+        habits = habits.filter(Habit.id.in_(habit_ids))
+        logs = logs.filter(HabitLog.habit_id.in_(habit_ids))
+        stale = stale.filter(HabitStreak.habit_id.in_(habit_ids))
+
+    states = {hid: new_habit_streak(hid, streak_frequency(freq)) for hid, freq in habits.all()}
+    for hid, day in logs.order_by(HabitLog.habit_id, HabitLog.date).yield_per(5000):
+        state = states.get(hid)
+        if state:
+            apply_streak_period(state, habit_period(state.frequency, day), True)
+
+    stale.delete(synchronize_session=False)
+    db.session.add_all(states.values())
+    if commit:
+        db.session.commit()
+    return len(states)
+
+def update_habit_streak(habit, day):
+    """
+    Brings the habit's streak up to date after its log for `day` changed.
+    Runs in the caller's transaction; the log change must already be in the session.
+    """
+    freq = streak_frequency(habit.frequency)
+    period = habit_period(freq, day)
+    done_q = HabitLog.query.filter(HabitLog.habit_id == habit.id, HabitLog.status == True)
+    if freq == 'Weekly':
+        # A week counts once any of its days is completed
+        done_q = done_q.filter(HabitLog.date >= period, HabitLog.date <= period + timedelta(days=6))
+    else:
+        done_q = done_q.filter(HabitLog.date == day)
+    done = db.session.query(done_q.exists()).scalar()
+
+    state = HabitStreak.query.filter_by(habit_id=habit.id).first()
+    if state is None or state.frequency != freq or not apply_streak_period(state, period, done):
+        rebuild_habit_streaks([habit.id], commit=False)
+
+def streak_summary(state, habit, today):
+    """Current and longest streak plus 7/30-day completion rates, computed from the cached state only."""
+    freq = streak_frequency(habit.frequency)
+    summary = {'current_streak': 0, 'longest_streak': 0, 'rate_7': 0.0, 'rate_30': 0.0}
+    if state is None or state.frequency != freq:
+        return summary
+    period = habit_period(freq, today)
+    current = state.current_streak or 0
+    # A run survives until a whole period is missed; paused habits keep theirs frozen
+    if current and not habit.is_paused and period_gap(freq, state.last_period, period) > 1:
+        current = 0
+
+    history = 0
+    if state.anchor is not None:
+        shift = period_gap(freq, state.anchor, period)
+        history = ((state.history or 0) << shift) & STREAK_MASK if shift < STREAK_WINDOW else 0
+    age = period_gap(freq, habit_period(freq, habit.created_at.date()), period) + 1 if habit.created_at else STREAK_WINDOW
+
+    def rate(days):
+        periods = max(1, min(days // 7 if freq == 'Weekly' else days, age))
+        return round(bin(history & ((1 << periods) - 1)).count('1') / periods, 2)
+
+    summary.update(current_streak=current, longest_streak=state.longest_streak or 0,
+                   rate_7=rate(7), rate_30=rate(30))
+    return summary
+
+def load_habit_streaks(habits, today):
+    """Streak summaries for a list of habits with one query, keyed by habit id."""
+    states = {}
+    if habits:
+        rows = HabitStreak.query.filter(HabitStreak.habit_id.in_([h.id for h in habits])).all()
+        states = {s.habit_id: s for s in rows}
+    return {h.id: streak_summary(states.get(h.id), h, today) for h in habits}
+
+def rollover_day(target_date, active_days=None):
+    """
+    Pre-creates `target_date`'s Day and PrayerLog rows (already linked) for
+    every user active in the last `active_days` days, with one multi-row
+    INSERT ... SELECT per table, and builds any missing HabitStreak state for
+    their habits. Safe to re-run: existing rows are left alone.
+    Returns how many rows of each kind were created.
+    """
+    active_days = active_days or app.config['ROLLOVER_ACTIVE_DAYS']
+    active = db.session.query(Day.user_id) \
+        .filter(Day.date >= target_date - timedelta(days=active_days), Day.date < target_date).distinct()
+
+    days = db.session.execute(
+        dialect_insert(Day).from_select(['user_id', 'date'], db.select(User.id, db.literal(target_date, db.Date)).where(User.id.in_(active)))
+        .on_conflict_do_nothing(index_elements=['user_id', 'date'])).rowcount
+    prayers = db.session.execute(
+        dialect_insert(PrayerLog).from_select(['user_id', 'date', 'day_id'], db.select(Day.user_id, Day.date, Day.id).where(Day.date == target_date))
+        .on_conflict_do_nothing(index_elements=['user_id', 'date'])).rowcount
+
+    # So the first toggle of the day doesn't have to replay a habit's history
+    missing = [hid for (hid,) in db.session.query(Habit.id)
+               .outerjoin(HabitStreak, HabitStreak.habit_id == Habit.id)
+               .filter(HabitStreak.id == None, Habit.user_id.in_(active)).all()]
+    if missing:
+        rebuild_habit_streaks(missing, commit=False)
+    db.session.commit()
+    return {'days': days, 'prayer_logs': prayers, 'streaks': len(missing)}
+
+def _query_dashboard_rows(user_id, today):
+    """Set-based loads for the dashboard: one query per table, never one per habit/routine."""
+    habits = Habit.query.filter_by(user_id=user_id, is_paused=False).all()
+    habit_ids = [h.id for h in habits]
+    habit_logs = {}
+    if habit_ids:
+        logs = HabitLog.query.filter(HabitLog.habit_id.in_(habit_ids), HabitLog.date == today).all()
+        habit_logs = {log.habit_id: log for log in logs}
+
+    # Assuming one active schedule for simplicity
+    active_schedule = Schedule.query.filter_by(user_id=user_id, is_active=True).first()
+    todays_routines = []
+    schedule_logs = {}
+    if active_schedule:
+        todays_routines = RoutineItem.query.filter_by(schedule_id=active_schedule.id, day_of_week=today.strftime('%A')).order_by(RoutineItem.start_time).all()
+        routine_ids = [r.id for r in todays_routines]
+        if routine_ids:
+            s_logs = ScheduleLog.query.filter(ScheduleLog.routine_id.in_(routine_ids), ScheduleLog.date == today).all()
+            schedule_logs = {s.routine_id: s for s in s_logs}
+    return habits, habit_logs, active_schedule, todays_routines, schedule_logs
+
+def load_dashboard_data(user_id, today, current_day):
+    """
+    Loads everything the dashboard shows in a fixed number of queries, no matter
+    how many habits or routines the user has. Logs still missing their day_id are
+    linked with one bulk UPDATE per table and a single commit.
+    """
+    # Get Prayer status (created first so its commit doesn't expire the rows loaded below)
+    prayer_log = get_or_insert(PrayerLog, {'user_id': user_id, 'date': today}, {'day_id': current_day.id})
+
+    habits, habit_logs, active_schedule, todays_routines, schedule_logs = _query_dashboard_rows(user_id, today)
+
+    # Link orphaned logs to today's Day row in bulk
+    unlinked_habit_logs = [log.id for log in habit_logs.values() if log.day_id is None]
+    unlinked_schedule_logs = [s.id for s in schedule_logs.values() if s.day_id is None]
+    if unlinked_habit_logs or unlinked_schedule_logs or prayer_log.day_id is None:
+        # Newly linked logs start counting towards today's score
+        linked_points = sum(log.points or 0 for log in habit_logs.values() if log.day_id is None)
+        linked_points += sum(s.points or 0 for s in schedule_logs.values() if s.day_id is None and s.status)
+        if unlinked_habit_logs:
+            HabitLog.query.filter(HabitLog.id.in_(unlinked_habit_logs)).update({'day_id': current_day.id}, synchronize_session=False)
+        if unlinked_schedule_logs:
+            ScheduleLog.query.filter(ScheduleLog.id.in_(unlinked_schedule_logs)).update({'day_id': current_day.id}, synchronize_session=False)
+        if prayer_log.day_id is None:
+            prayer_log.day_id = current_day.id
+            linked_points += prayer_log.spiritual_score or 0
+        add_day_score(current_day.id, linked_points)
+        db.session.commit()
+        # The commit expired everything; reload with the same set-based queries
+        # rather than letting the template refresh each row one by one.
+        habits, habit_logs, active_schedule, todays_routines, schedule_logs = _query_dashboard_rows(user_id, today)
+
+    schedule_status = {r.id: (schedule_logs[r.id].status if r.id in schedule_logs else False) for r in todays_routines}
+    return {
+        'habits': habits,
+        'habit_logs': habit_logs,
+        'streaks': load_habit_streaks(habits, today),
+        'prayer_log': prayer_log,
+        'active_schedule': active_schedule,
+        'routines': todays_routines,
+        'schedule_status': schedule_status
+    }
+
 @app.route('/dashboard', methods=['GET', 'POST'])
 @login_required
 def dashboard():
@@ -636,54 +1637,15 @@ def dashboard():
             flash('Day updated!', 'success')
             return redirect(url_for('dashboard'))
 
-    # Get habits for today
-    habits = Habit.query.filter_by(user_id=current_user.id, is_paused=False).all()
-    habit_logs = {}
-    for h in habits:
-        log = HabitLog.query.filter_by(habit_id=h.id, date=today).first()
-        # Ensure log is linked to day
-        if log and log.day_id is None:
-            log.day_id = current_day.id
-            db.session.commit()
-            
-        habit_logs[h.id] = log
-
-    # Get Prayer status
-    prayer_log = PrayerLog.query.filter_by(user_id=current_user.id, date=today).first()
-    if not prayer_log:
-        try:
-            prayer_log = PrayerLog(user_id=current_user.id, date=today, day_id=current_day.id)
-            db.session.add(prayer_log)
-            db.session.commit()
-        except:
-            db.session.rollback()
-            prayer_log = PrayerLog.query.filter_by(user_id=current_user.id, date=today).first()
-    elif prayer_log.day_id is None:
-        prayer_log.day_id = current_day.id
-        db.session.commit()
-
-    # Get Today's Schedule
-    day_name = today.strftime('%A')
-    # Assuming one active schedule for simplicity
-    active_schedule = Schedule.query.filter_by(user_id=current_user.id, is_active=True).first()
-    todays_routines = []
-    schedule_status = {}
-    if active_schedule:
-        todays_routines = RoutineItem.query.filter_by(schedule_id=active_schedule.id, day_of_week=day_name).order_by(RoutineItem.start_time).all()
-        for r in todays_routines:
-            s_log = ScheduleLog.query.filter_by(routine_id=r.id, date=today).first()
-            if s_log and s_log.day_id is None:
-                s_log.day_id = current_day.id
-                db.session.commit()
-                
-            schedule_status[r.id] = s_log.status if s_log else False
+    data = load_dashboard_data(current_user.id, today, current_day)
 
     return render_template('dashboard.html', 
-                           habits=habits, 
-                           habit_logs=habit_logs, 
-                           prayer_log=prayer_log,
-                           routines=todays_routines,
-                           schedule_status=schedule_status,
+                           habits=data['habits'], 
+                           habit_logs=data['habit_logs'], 
+                           streaks=data['streaks'],
+                           prayer_log=data['prayer_log'],
+                           routines=data['routines'],
+                           schedule_status=data['schedule_status'],
                            today=today,
                            day=current_day)
 
@@ -693,19 +1655,211 @@ def update_day_api():
     today = get_today()
     current_day = ensure_day(current_user.id, today)
     
-    data = request.json
-    if 'intention' in data:
-        current_day.intention = data.get('intention')
-    if 'energy_level' in data:
-        current_day.energy_level = data.get('energy_level')
-    if 'mood' in data:
-        current_day.mood = data.get('mood')
-    if 'reflection' in data:
-        current_day.reflection = data.get('reflection')
-        
+    apply_day_fields(current_day, request.json)
     db.session.commit()
     return jsonify({'success': True, 'score': current_day.total_score})
 
+DAY_FIELDS = ['intention', 'energy_level', 'mood', 'reflection']
+
+def apply_day_fields(day, data):
+    """Copies the editable day fields present in `data` onto the Day (no commit)."""
+    for field in DAY_FIELDS:
+        if field in data:
+            setattr(day, field, data.get(field))
+
+# Most mutations one /api/batch or /api/sync request may carry
+BATCH_MAX_OPS = 100
+
+class BatchError(Exception):
+    def __init__(self, index, message, status=400):
+        super().__init__(message)
+        self.index = index
+        self.status = status
+
+def op_target_id(op):
+    """The integer id an op refers to, or None (ids come from client JSON and can be anything)."""
+    target_id = op.get('id')
+    return target_id if isinstance(target_id, int) and not isinstance(target_id, bool) else None
+
+def load_op_targets(ops, user_id):
+    """The user's habits and routines that batch/sync ops refer to, by id, with one query each."""
+    def ids_of(kind):
+        return {op_target_id(op) for op in ops if isinstance(op, dict) and op.get('type') == kind} - {None}
+    habit_ids, routine_ids = ids_of('habit'), ids_of('routine')
+    habits = {h.id: h for h in Habit.query.filter(Habit.id.in_(habit_ids), Habit.user_id == user_id)} if habit_ids else {}
+    routines = {}
+    if routine_ids:
+        routines = {r.id: r for r in RoutineItem.query.join(Schedule, RoutineItem.schedule_id == Schedule.id)
+                    .filter(RoutineItem.id.in_(routine_ids), Schedule.user_id == user_id)}
+    return habits, routines
+
+def has_prayer_op(ops):
+    return any(isinstance(op, dict) and op.get('type') == 'prayer' for op in ops)
+
+def apply_op(op, index, habits, routines, current_day, deltas, prayer_log):
+    """
+    Applies one batch/sync op to `current_day` (no commit). Raises BatchError
+    before changing anything when the op can't be applied.
+    """
+    kind = op.get('type') if isinstance(op, dict) else None
+    if kind == 'habit':
+        habit = habits.get(op_target_id(op))
+        if habit is None:
+            raise BatchError(index, 'Unknown habit', 403)
+        try:
+            mode, amount = parse_habit_progress(op)
+        except (TypeError, ValueError):
+            raise BatchError(index, 'delta/set must be integers')
+        result = apply_habit_progress(habit, current_day.date, current_day, deltas, mode, amount)
+        if result is None:
+            raise BatchError(index, 'Conflicting update, please retry', 409)
+    elif kind == 'routine':
+        item = routines.get(op_target_id(op))
+        if item is None:
+            raise BatchError(index, 'Unknown routine', 403)
+        result = apply_routine_toggle(item, current_day.date, current_day, deltas)
+    elif kind == 'prayer':
+        if op.get('prayer') not in PRAYERS:
+            raise BatchError(index, 'Unknown prayer')
+        result = {'prayer': op['prayer'], 'score': apply_prayer(prayer_log, op['prayer'], bool(op.get('status')), deltas)}
+    elif kind == 'day':
+        apply_day_fields(current_day, op)
+        result = {}
+    else:
+        raise BatchError(index, 'Unknown op type')
+    return dict(result, success=True)
+
+@app.route('/api/batch', methods=['POST'])
+@login_required
+def batch_mutations():
+    """
+    Applies an ordered list of today's mutations in one transaction:
+      {"ops": [{"type": "habit", "id": 3},                  # tap, or "delta"/"set" like /habit/toggle
+               {"type": "routine", "id": 7},
+               {"type": "prayer", "prayer": "fajr", "status": true},
+               {"type": "day", "mood": 4}]}
+    The Day score and rollup are written once at the end. Any invalid op
+    rejects the whole batch. Returns one result per op plus the final score.
+    """
+    ops = (request.get_json(silent=True) or {}).get('ops')
+    if not isinstance(ops, list) or not ops:
+        return jsonify({'success': False, 'error': 'ops must be a non-empty list'}), 400
+    if len(ops) > BATCH_MAX_OPS:
+        return jsonify({'success': False, 'error': f'At most {BATCH_MAX_OPS} ops per batch'}), 400
+
+    habits, routines = load_op_targets(ops, current_user.id)
+    current_day = ensure_day(current_user.id, get_today())
+    deltas = ScoreDeltas(current_day)
+    # Bootstrapping rows may commit, so it happens before any op is applied
+    prayer_log = todays_prayer_log(current_day) if has_prayer_op(ops) else None
+    try:
+        results = [apply_op(op, index, habits, routines, current_day, deltas, prayer_log) for index, op in enumerate(ops)]
+    except BatchError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e), 'index': e.index}), e.status
+
+    deltas.flush()
+    db.session.commit()
+    score = db.session.query(Day.total_score).filter(Day.id == current_day.id).scalar()
+    return jsonify({'success': True, 'results': results, 'score': score})
+
+def mutation_date(at, today):
+    """Local (GMT+6) date of a client timestamp in ms, never after today. None if unusable."""
+    if at is None:
+        return today
+    try:
+        local = datetime.utcfromtimestamp(int(at) / 1000) + timedelta(hours=6)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    return min(local.date(), today)
+
+@app.route('/api/sync', methods=['POST'])
+@login_required
+def sync_mutations():
+    """
+    Replays mutations the service worker queued while offline, in order:
+      {"mutations": [{"id": "<client uuid>", "at": <ms timestamp>, "op": {...as in /api/batch}}]}
+    Each op applies to the local day it was made on, up to SYNC_MAX_AGE_DAYS
+    back. Mutation ids are recorded in the same transaction as their effects,
+    so a mutation sent again (lost response, replayed queue, second tab) is not
+    re-applied and gets its original result with status "duplicate". Ops that
+    can't apply are recorded as "rejected" instead of failing the rest, so one
+    bad entry can't wedge the client's queue.
+    """
+    mutations = (request.get_json(silent=True) or {}).get('mutations')
+    if not isinstance(mutations, list) or not mutations:
+        return jsonify({'success': False, 'error': 'mutations must be a non-empty list'}), 400
+    if len(mutations) > BATCH_MAX_OPS:
+        return jsonify({'success': False, 'error': f'At most {BATCH_MAX_OPS} mutations per request'}), 400
+    for m in mutations:
+        if not isinstance(m, dict) or not isinstance(m.get('id'), str) or not 0 < len(m['id']) <= 64:
+            return jsonify({'success': False, 'error': 'Every mutation needs a string id'}), 400
+
+    user_id = current_user.id
+    seen = {r.mutation_id: r for r in AppliedMutation.query.filter(
+        AppliedMutation.user_id == user_id, AppliedMutation.mutation_id.in_({m['id'] for m in mutations}))}
+    fresh = [m for m in mutations if m['id'] not in seen]
+    habits, routines = load_op_targets([m.get('op') for m in fresh], user_id)
+
+    today = get_today()
+    oldest = today - timedelta(days=app.config['SYNC_MAX_AGE_DAYS'])
+    # Bootstrap every day the ops touch before applying any of them (bootstrapping may commit)
+    days = {}
+    for m in fresh:
+        when = mutation_date(m.get('at'), today)
+        if when is None or when < oldest:
+            continue
+        if when not in days:
+            current_day = ensure_day(user_id, when)
+            days[when] = [current_day, ScoreDeltas(current_day), None]
+        if has_prayer_op([m.get('op')]) and days[when][2] is None:
+            days[when][2] = todays_prayer_log(days[when][0])
+
+    results = []
+    try:
+        for index, m in enumerate(mutations):
+            record = seen.get(m['id'])
+            if record is None:
+                record = insert_returning(AppliedMutation, {'user_id': user_id, 'mutation_id': m['id']})
+                if record is not None:
+                    when = mutation_date(m.get('at'), today)
+                    try:
+                        if when is None or when < oldest:
+                            raise BatchError(index, 'Too old to sync' if when else 'Invalid timestamp')
+                        current_day, deltas, prayer_log = days[when]
+                        result = apply_op(m.get('op'), index, habits, routines, current_day, deltas, prayer_log)
+                        record.status = 'applied'
+                    except BatchError as e:
+                        if e.status == 409:
+                            raise
+                        result = {'success': False, 'error': str(e)}
+                        record.status = 'rejected'
+                    record.result = json.dumps(result)
+                    results.append({'id': m['id'], 'status': record.status, 'result': result})
+                    continue
+                # Repeated in this request, or a concurrent replay committed it first
+                record = AppliedMutation.query.filter_by(user_id=user_id, mutation_id=m['id']).first()
+            results.append({'id': m['id'], 'status': 'duplicate', 'result': json.loads(record.result or '{}')})
+    except BatchError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e), 'index': e.index}), e.status
+
+    for _, deltas, _ in days.values():
+        deltas.flush()
+    db.session.commit()
+    score = db.session.query(Day.total_score).filter(Day.user_id == user_id, Day.date == today).scalar()
+    return jsonify({'success': True, 'results': results, 'score': score or 0})
+
+def prune_applied_mutations(now=None):
+    """
+    Forgets mutation ids older than any op /api/sync would still apply, so the
+    table stays small. Run by rollover_worker.py. Returns the rows deleted.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=app.config['SYNC_MAX_AGE_DAYS'] + 1)
+    deleted = AppliedMutation.query.filter(AppliedMutation.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
 # --- Habit Routes ---
 @app.route('/habits')
 @login_required
@@ -760,6 +1914,7 @@ def edit_habit(habit_id):
         return redirect(url_for('dashboard'))
         
     if request.method == 'POST':
+        old_frequency = streak_frequency(habit.frequency)
         habit.name = request.form.get('name')
         habit.category = request.form.get('category')
         habit.frequency = request.form.get('frequency')
@@ -773,6 +1928,9 @@ def edit_habit(habit_id):
         
         # Recalculate points
         habit.points = int(10 * habit.difficulty * ((habit.priority + 1) / 2))
+        if streak_frequency(habit.frequency) != old_frequency:
+            # Streak periods changed between days and weeks
+            rebuild_habit_streaks([habit.id], commit=False)
         
         db.session.commit()
         flash('Habit updated!', 'success')
@@ -793,89 +1951,128 @@ def delete_habit(habit_id):
     flash('Habit deleted.', 'success')
     return redirect(url_for('habits_list'))
 
+# Attempts at the compare-and-swap progress update before giving up with 409
+HABIT_UPDATE_RETRIES = 10
+
+def habit_progress_points(habit, value_done):
+    """Full points at the target, otherwise pro-rated by the steps done."""
+    target = habit.target_value or 1
+    if value_done >= target:
+        return habit.points or 0
+    return (habit.points or 0) * value_done // target
+
+def _clamp_progress(habit, value):
+    return max(0, min(habit.target_value or 1, value))
+
+def _progress_expr(habit, mode, amount):
+    """SQL for the new value_done, computed from the stored row rather than a value read into Python."""
+    target = habit.target_value or 1
+    current = db.func.coalesce(HabitLog.value_done, 0)
+    if mode == 'set':
+        return db.literal(_clamp_progress(habit, amount))
+    if mode == 'delta':
+        raw = current + amount
+        return db.case((raw < 0, 0), (raw > target, target), else_=raw)
+    if target > 1:
+        # Increment until the target, then one more tap resets to 0 (easy correction)
+        return db.case((current >= target, 0), else_=current + 1)
+    # Simple toggle (binary)
+    return db.case((HabitLog.status == True, 0), else_=target)
+
+def apply_habit_progress(habit, today, current_day, deltas, mode='tap', amount=None):
+    """
+    Applies one tap / delta / set to the habit's log for `today`. The change is a
+    single conditional UPDATE ... RETURNING guarded by the values it replaces,
+    so parallel requests never lose a step and the score deltas are exact.
+    Score and rollup changes go to `deltas`; the streak is updated in the
+    caller's transaction (no commit).
+    Returns the new log state, or None if it kept losing to concurrent updates.
+    """
+    target = habit.target_value or 1
+    log = HabitLog.query.filter_by(habit_id=habit.id, date=today).first()
+    new = None
+    if not log:
+        # First interaction: multistep starts at 1, binary at the target
+        if mode == 'tap':
+            initial_value = 1 if target > 1 else target
+        else:
+            initial_value = _clamp_progress(habit, amount)
+        created = insert_returning(HabitLog, {'habit_id': habit.id, 'date': today}, {
+            'status': initial_value >= target,
+            'day_id': current_day.id,
+            'value_done': initial_value,
+            'points': habit_progress_points(habit, initial_value)
+        })
+        if created:
+            old = (0, False, 0, current_day.id)
+            new = (created.value_done, created.status, created.points)
+        else:
+            # A concurrent request created today's log first; update that one
+            log = HabitLog.query.filter_by(habit_id=habit.id, date=today).first()
+
+    if new is None:
+        value_expr = _progress_expr(habit, mode, amount)
+        for _ in range(HABIT_UPDATE_RETRIES):
+            old = (log.value_done or 0, bool(log.status), log.points or 0, log.day_id)
+            stmt = db.update(HabitLog).where(
+                HabitLog.id == log.id,
+                db.func.coalesce(HabitLog.value_done, 0) == old[0],
+                db.func.coalesce(HabitLog.status, False) == old[1]
+            ).values(
+                value_done=value_expr,
+                status=value_expr >= target,
+                points=db.case((value_expr >= target, habit.points or 0), else_=value_expr * (habit.points or 0) // target),
+                day_id=db.func.coalesce(HabitLog.day_id, current_day.id)
+            ).returning(HabitLog.value_done, HabitLog.status, HabitLog.points)
+            new = db.session.execute(stmt, execution_options={'synchronize_session': False}).first()
+            if new:
+                break
+            # Changed since we read it: re-read and try again
+            db.session.refresh(log)
+        else:
+            return None
+
+    old_value, old_status, old_points, old_day_id = old
+    new_value, new_status, new_points = new[0], bool(new[1]), new[2] or 0
+    # Points this log already contributed to today's score
+    deltas.add(score=new_points - (old_points if old_day_id == current_day.id else 0),
+               habit_points=(new_points if new_status else 0) - (old_points if old_status else 0),
+               completed_habits=int(new_status) - int(old_status))
+    update_habit_streak(habit, today)
+    return {'habit_id': habit.id, 'new_status': new_status, 'value_done': new_value, 'target_value': habit.target_value}
+
+def parse_habit_progress(data):
+    """('tap', None), ('delta', n) or ('set', n) from request data; raises ValueError on bad input."""
+    for mode in ('set', 'delta'):
+        if data.get(mode) not in (None, ''):
+            return mode, int(data.get(mode))
+    return 'tap', None
+
 @app.route('/habit/toggle/<int:habit_id>', methods=['POST'])
 @login_required
 def toggle_habit(habit_id):
     habit = Habit.query.get_or_404(habit_id)
     if habit.owner != current_user:
         return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    # Optional {"delta": n} or {"set": n} (JSON or form) instead of a single tap
+    try:
+        mode, amount = parse_habit_progress(request.get_json(silent=True) or request.form)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'delta/set must be integers'}), 400
         
     today = get_today()
     current_day = ensure_day(current_user.id, today)
 
-    log = HabitLog.query.filter_by(habit_id=habit.id, date=today).first()
-    
-    # Check if this is a simple toggle or increment
-    is_multistep = habit.target_value > 1
-    
-    if log:
-        if is_multistep:
-            # Increment logic
-            # If already at target, reset to 0 (Looping behavior for easy correction)
-            # OR allow explicit undo. Let's do: Increment until target, then one more click resets to 0.
-            if log.value_done >= habit.target_value:
-                log.value_done = 0
-                log.status = False
-                log.points = 0
-            else:
-                log.value_done += 1
-                # Check if now complete
-                if log.value_done >= habit.target_value:
-                    log.status = True
-                    log.points = habit.points
-                else:
-                    log.status = False
-                    # Pro-rated points? (TotalPoints * (Current / Target))
-                    # Let's keep points simple: Only on completion? 
-                    # User asked for "points for repeating".
-                    # So we calculate fractional points.
-                    points_per_unit = habit.points / habit.target_value
-                    log.points = int(points_per_unit * log.value_done)
-        else:
-            # Simple Toggle (Binary)
-            if log.status:
-                log.status = False
-                log.value_done = 0
-                log.points = 0
-            else:
-                log.status = True
-                log.value_done = habit.target_value
-                log.points = habit.points
-
-        if log.day_id is None: log.day_id = current_day.id
-            
-    else:
-        # First interaction
-        # If multistep, start at 1. Else start at target.
-        initial_value = 1 if is_multistep else habit.target_value
-        initial_status = (initial_value >= habit.target_value)
-        
-        # Points
-        points = 0
-        if initial_status:
-            points = habit.points
-        elif is_multistep:
-             points = int((habit.points / habit.target_value) * 1)
-
-        log = HabitLog(
-            habit_id=habit.id, 
-            date=today, 
-            status=initial_status, 
-            day_id=current_day.id,
-            value_done=initial_value,
-            points=points
-        )
-        db.session.add(log)
-    
+    deltas = ScoreDeltas(current_day)
+    result = apply_habit_progress(habit, today, current_day, deltas, mode, amount)
+    if result is None:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': 'Conflicting update, please retry'}), 409
+    deltas.flush()
     db.session.commit()
-    recalculate_day_score(current_day.id)
     
-    return jsonify({
-        'success': True, 
-        'new_status': log.status, 
-        'value_done': log.value_done, 
-        'target_value': habit.target_value
-    })
+    return jsonify(dict(result, success=True))
 
 # --- Schedule Routes ---
 @app.route('/schedule', methods=['GET', 'POST'])
@@ -914,6 +2111,30 @@ def schedule_view():
 
     return render_template('schedules.html', schedule=active_schedule)
 
+def apply_routine_toggle(item, today, current_day, deltas):
+    """Flips today's ScheduleLog for a routine (creating it done). Score changes go to `deltas`; no commit."""
+    log = ScheduleLog.query.filter_by(routine_id=item.id, date=today).first()
+    created = None
+    if not log:
+        created = log = insert_returning(ScheduleLog, {'routine_id': item.id, 'date': today},
+                                         {'user_id': current_day.user_id, 'status': True, 'day_id': current_day.id})
+        if not created:
+            # A concurrent request created today's log first; toggle that one
+            log = ScheduleLog.query.filter_by(routine_id=item.id, date=today).first()
+    
+    if created:
+        old_points = old_completed_points = 0
+    else:
+        # Points this log already contributes to today's score
+        old_points = (log.points or 0) if log.status and log.day_id == current_day.id else 0
+        old_completed_points = (log.points or 0) if log.status else 0
+        log.status = not log.status
+        if log.day_id is None: log.day_id = current_day.id
+    
+    new_points = (log.points or 0) if log.status else 0
+    deltas.add(score=new_points - old_points, schedule_points=new_points - old_completed_points)
+    return {'routine_id': item.id, 'new_status': log.status}
+
 @app.route('/schedule/toggle/<int:id>', methods=['POST'])
 @login_required
 def toggle_routine(id):
@@ -925,18 +2146,11 @@ def toggle_routine(id):
     today = get_today()
     current_day = ensure_day(current_user.id, today)
 
-    log = ScheduleLog.query.filter_by(routine_id=item.id, date=today).first()
-    
-    if log:
-        log.status = not log.status
-        if log.day_id is None: log.day_id = current_day.id
-    else:
-        log = ScheduleLog(routine_id=item.id, user_id=current_user.id, date=today, status=True, day_id=current_day.id)
-        db.session.add(log)
-    
+    deltas = ScoreDeltas(current_day)
+    result = apply_routine_toggle(item, today, current_day, deltas)
+    deltas.flush()
     db.session.commit()
-    recalculate_day_score(current_day.id)
-    return jsonify({'success': True, 'new_status': log.status})
+    return jsonify(dict(result, success=True))
 
 @app.route('/schedule/delete/<int:id>', methods=['POST'])
 @login_required
@@ -991,42 +2205,52 @@ def delete_schedule(id):
     return redirect(url_for('schedule_view'))
 
 # --- Islamic/Prayer Routes ---
+PRAYERS = ['fajr', 'dhuhr', 'asr', 'maghrib', 'isha']
+
+def todays_prayer_log(current_day):
+    """Today's PrayerLog, created (or linked to the Day) if needed."""
+    log = get_or_insert(PrayerLog, {'user_id': current_day.user_id, 'date': current_day.date}, {'day_id': current_day.id})
+    if log.day_id is None:
+        log.day_id = current_day.id
+        add_day_score(current_day.id, log.spiritual_score or 0)
+        db.session.commit()
+    return log
+
+def apply_prayer(log, prayer_name, status, deltas):
+    """Marks one prayer done/undone and rescores the log. Score changes go to `deltas`; no commit."""
+    old_score = log.spiritual_score or 0
+    was_done = bool(getattr(log, prayer_name))
+    setattr(log, prayer_name, status)
+    
+    # Recalculate Score (Basic Logic)
+    score = 0
+    for p in PRAYERS:
+        if getattr(log, p):
+            score += 100 # 100 * 5 = 500 base
+    log.spiritual_score = score
+    
+    deltas.add(score=score - old_score, prayer_points=score - old_score,
+               prayers_done=int(bool(status)) - int(was_done))
+    return score
+
 @app.route('/prayers', methods=['GET', 'POST'])
 @login_required
 def prayers():
     today = get_today()
     current_day = ensure_day(current_user.id, today)
 
-    log = PrayerLog.query.filter_by(user_id=current_user.id, date=today).first()
-    if not log:
-        try:
-            log = PrayerLog(user_id=current_user.id, date=today, day_id=current_day.id)
-            db.session.add(log)
-            db.session.commit()
-        except:
-            db.session.rollback()
-            log = PrayerLog.query.filter_by(user_id=current_user.id, date=today).first()
-    elif log.day_id is None:
-        log.day_id = current_day.id
-        db.session.commit()
+    log = todays_prayer_log(current_day)
         
     if request.method == 'POST':
         data = request.json
         prayer_name = data.get('prayer') # fajr, dhuhr...
         status = data.get('status') # boolean
         
-        if hasattr(log, prayer_name):
-            setattr(log, prayer_name, status)
-            
-            # Recalculate Score (Basic Logic)
-            score = 0
-            for p in ['fajr', 'dhuhr', 'asr', 'maghrib', 'isha']:
-                if getattr(log, p):
-                    score += 100 # 100 * 5 = 500 base
-            log.spiritual_score = score
-            
+        if prayer_name in PRAYERS:
+            deltas = ScoreDeltas(current_day)
+            score = apply_prayer(log, prayer_name, status, deltas)
+            deltas.flush()
             db.session.commit()
-            recalculate_day_score(log.day_id)
             return jsonify({'success': True, 'score': score})
             
     return render_template('prayers.html', log=log)
@@ -1217,6 +2441,327 @@ def get_calendar_events():
     
     return jsonify(events)
 
+SCRAPER_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+
+class ExternalLookupError(Exception):
+    """An external source could not be reached or returned an error (possibly cached)."""
+
+# Bounded pool shared by all requests of this worker for day-details lookups
+day_details_pool = ThreadPoolExecutor(max_workers=app.config['DAY_DETAILS_MAX_WORKERS'], thread_name_prefix='day-details')
+
+def fetch_and_cache(source, key, fetch):
+    """
+    Runs fetch() and stores its parsed result in ExternalCache for
+    DAY_DETAILS_CACHE_TTL, or a negative entry for DAY_DETAILS_NEGATIVE_TTL.
+    Raises ExternalLookupError on failure.
+    """
+    now = datetime.utcnow()
+    try:
+        result = fetch()
+        payload, is_error, ttl = json.dumps(result), False, app.config['DAY_DETAILS_CACHE_TTL']
+    except Exception as e:
+        print(f"Lookup Error ({source} {key}): {e}")
+        result = None
+        payload, is_error, ttl = str(e), True, app.config['DAY_DETAILS_NEGATIVE_TTL']
+
+    entry = ExternalCache.query.filter_by(source=source, key=key).first()
+    if not entry:
+        entry = ExternalCache(source=source, key=key)
+        db.session.add(entry)
+    entry.payload = payload
+    entry.is_error = is_error
+    entry.fetched_at = now
+    entry.expires_at = now + timedelta(seconds=ttl)
+    try:
+        db.session.commit()
+    except:
+        # Another worker stored the same key first
+        db.session.rollback()
+
+    if is_error:
+        raise ExternalLookupError(payload)
+    return result
+
+def _fetch_in_pool(source, key, fetch):
+    # Pool threads get their own app context (and so their own DB session)
+    with app.app_context():
+        return fetch_and_cache(source, key, fetch)
+
+def run_lookups(lookups, deadline):
+    """
+    Resolves {name: (source, key, fetch)} from ExternalCache with one query and
+    fetches the misses concurrently on day_details_pool, waiting no later than
+    `deadline` (a time.monotonic() value). Returns {name: (status, value)} where
+    status is 'cached', 'ok', 'error' or 'timeout' and value is the parsed
+    result or the error message. Lookups that miss the deadline keep running
+    and still fill the cache for the next request.
+    """
+    outcomes = {}
+    wanted = [(source, key) for source, key, _ in lookups.values()]
+    entries = {}
+    if wanted:
+        rows = ExternalCache.query.filter(
+            db.tuple_(ExternalCache.source, ExternalCache.key).in_(wanted),
+            ExternalCache.expires_at > datetime.utcnow()
+        ).all()
+        entries = {(e.source, e.key): e for e in rows}
+
+    futures = {}
+    for name, (source, key, fetch) in lookups.items():
+        entry = entries.get((source, key))
+        if entry and entry.is_error:
+            outcomes[name] = ('error', entry.payload)
+        elif entry:
+            outcomes[name] = ('cached', json.loads(entry.payload))
+        else:
+            futures[name] = day_details_pool.submit(_fetch_in_pool, source, key, fetch)
+
+    if futures:
+        wait(futures.values(), timeout=max(0, deadline - time.monotonic()))
+        for name, future in futures.items():
+            if not future.done():
+                outcomes[name] = ('timeout', None)
+            elif future.exception():
+                outcomes[name] = ('error', str(future.exception()))
+            else:
+                outcomes[name] = ('ok', future.result())
+    return outcomes
+
+# hijri_converter's spelling of each month, used for the source URLs
+HIJRI_MONTHS = [Hijri(1445, m, 1).month_name() for m in range(1, 13)]
+
+def fetch_page_soup(url, timeout=10):
+    resp = requests.get(url, headers=SCRAPER_HEADERS, timeout=timeout)
+    if resp.status_code != 200:
+        raise ExternalLookupError(f"Status: {resp.status_code}")
+    return BeautifulSoup(resp.content, 'html.parser')
+
+def wiki_month_events(soup, h_day, h_month_name):
+    """Lines about the given day on a Hijri month page (e.g. wiki/Rajab)."""
+    # Look for day pattern: "15 Rajab" or "15th" or just "15 " at start
+    day_patterns = [
+        f"{h_day} {h_month_name}", 
+        f"{h_day}th {h_month_name}",
+        f"{h_day}st {h_month_name}",
+        f"{h_day}nd {h_month_name}",
+        f"{h_day}rd {h_month_name}",
+        f"{h_day} " # Simple day number check (risky but getting hit is better)
+    ]
+    events = []
+    content_div = soup.find('div', {'id': 'mw-content-text'})
+    if content_div:
+        for li in content_div.find_all('li'):
+            text = li.get_text(strip=True)
+            # e.g. "27 Rajab – Isra..." or "27 – Isra..."
+            if any(text.lower().startswith(p.lower()) for p in day_patterns) or text.startswith(f"{h_day} –") or text.startswith(f"{h_day} -"):
+                # Avoid huge paragraphs, just take the line
+                if len(text) > 10 and len(text) < 300:
+                    # Clean citations [1]
+                    clean_text = re.sub(r'\[\d+\]', '', text)
+                    events.append(f"📜 {clean_text}")
+    return events
+
+def wiki_date_events(soup):
+    """First lines of each section on a specific Hijri date page (e.g. wiki/15_Rajab)."""
+    events = []
+    for section_header in ['Events', 'Observances', 'Births', 'Deaths']:
+        s_h = soup.find('span', {'id': section_header})
+        if s_h:
+            ul = s_h.parent.find_next_sibling('ul') or s_h.parent.find_next('ul')
+            if ul:
+                for li in ul.find_all('li')[:3]:
+                    events.append(f"🏷️ {li.get_text(strip=True)}")
+    return events
+
+def wikishia_events(soup, h_day, h_month_name):
+    events = []
+    for li in soup.find_all('li'):
+        text = li.get_text(strip=True)
+        if text.startswith(f"{h_day} {h_month_name}") or text.startswith(f"{h_day}th {h_month_name}"):
+            events.append(f"🕌 {text}")
+    return events
+
+def onthisday_events(soup):
+    """Top events from an onthisday.com day page."""
+    return [item.get_text(strip=True) for item in soup.select('li.event')[:5]]
+
+def fetch_quran_ayah(ayah_num):
+    """Fetch an Ayah with its English translation from alquran.cloud."""
+    resp = requests.get(f'https://api.alquran.cloud/v1/ayah/{ayah_num}/editions/quran-uthmani,en.sahih', timeout=5)
+    if not resp.ok:
+        raise ExternalLookupError(f"Status: {resp.status_code}")
+    data = resp.json()
+    if not data.get('data') or len(data['data']) < 2:
+        raise ExternalLookupError("Unexpected response")
+    arabic = data['data'][0]
+    english = data['data'][1]
+    return {
+        'reference': f"Quran {arabic['surah']['englishName']}:{arabic['numberInSurah']}",
+        'arabic': arabic['text'],
+        'english': english['text']
+    }
+
+def fetch_hadith_book(book):
+    """Fetch the first 100 hadiths of a book (English); a random one is picked per request."""
+    resp = requests.get(f"https://hadith-api.vercel.app/api/books/{book}?range=1-100", timeout=5)
+    if not resp.ok:
+        raise ExternalLookupError(f"Status: {resp.status_code}")
+    data = resp.json()
+    hadiths = []
+    if data.get('data') and data['data'].get('hadiths'):
+        for h in data['data']['hadiths']:
+            hadiths.append({
+                'text': h.get('english', 'Description not available'),
+                'source': f"{book.capitalize()} - Hadith {h.get('hadithNumber', '?')}"
+            })
+    return hadiths
+
+def static_hijri_events(month, day):
+    """Events from ISLAMIC_EVENTS for a Hijri month number and day."""
+    # ISLAMIC_EVENTS is written in calendar order; match by position since its
+    # month spellings differ from hijri_converter's (e.g. 'Shaban' vs 'Sha’ban')
+    month_events = list(ISLAMIC_EVENTS.values())[month - 1]
+    day_data = month_events.get(day)
+    if not day_data:
+        return []
+    if isinstance(day_data, list):
+        return [f"🕌 {event}" for event in day_data]
+    return [f"🕌 {day_data}"]
+
+def recurring_hijri_events():
+    """Admin-added IslamicEvent rows that recur on their Hijri date, as {(month, day): [titles]}."""
+    recurring = defaultdict(list)
+    for event in IslamicEvent.query.filter_by(is_recurring_hijri=True).all():
+        h = Gregorian(event.date.year, event.date.month, event.date.day).to_hijri()
+        recurring[(h.month, h.day)].append(f"🕌 {event.title}")
+    return recurring
+
+def _page_reader(get_soup, pause=0):
+    """Wraps get_soup(url) so each page is fetched at most once and failures become None."""
+    pages = {}
+    def read(url):
+        if url not in pages:
+            try:
+                pages[url] = get_soup(url)
+            except Exception as e:
+                print(f"Index Fetch Error ({url}): {e}")
+                pages[url] = None
+            if pause:
+                time.sleep(pause)
+        return pages[url]
+    return read
+
+def hijri_significance(month, day, read, recurring=None):
+    """All known events for a Hijri (month, day), in display order without duplicates."""
+    name = HIJRI_MONTHS[month - 1]
+    safe_month = name.replace(' ', '_')
+    events = static_hijri_events(month, day)
+    events += (recurring or {}).get((month, day), [])
+
+    month_soup = read(f"https://en.wikipedia.org/wiki/{safe_month}")
+    if month_soup:
+        events += wiki_month_events(month_soup, day, name)
+    date_soup = read(f"https://en.wikipedia.org/wiki/{day}_{safe_month}")
+    if date_soup:
+        events += wiki_date_events(date_soup)
+
+    # Fallback for events: WikiShia
+    if not events:
+        wikishia_soup = read(f"https://en.wikishia.net/view/{name}")
+        if wikishia_soup:
+            events += wikishia_events(wikishia_soup, day, name)
+    return list(dict.fromkeys(events))
+
+def gregorian_significance(month, day, read):
+    month_name = date(2024, month, 1).strftime('%B').lower()
+    soup = read(f"https://www.onthisday.com/day/{month_name}/{day}")
+    return onthisday_events(soup) if soup else None
+
+def save_significance(calendar, month, day, events):
+    entry = DaySignificance.query.filter_by(calendar=calendar, month=month, day=day).first()
+    if not entry:
+        entry = DaySignificance(calendar=calendar, month=month, day=day)
+        db.session.add(entry)
+    entry.events = json.dumps(events)
+    entry.updated_at = datetime.utcnow()
+    return entry
+
+def reindex_recurring_event(event, removed=False):
+    """
+    Updates the Hijri index entry for a recurring IslamicEvent that was just
+    added or deleted (pending in the session), without refetching: the
+    ISLAMIC_EVENTS and recurring events are recomputed and the entry's
+    Wikipedia/WikiShia events are kept. The caller commits.
+    """
+    h = Gregorian(event.date.year, event.date.month, event.date.day).to_hijri()
+    entry = DaySignificance.query.filter_by(calendar='hijri', month=h.month, day=h.day).first()
+    fetched = json.loads(entry.events) if entry else []
+    if removed:
+        fetched = [e for e in fetched if e != f"🕌 {event.title}"]
+    local = hijri_significance(h.month, h.day, lambda url: None, recurring_hijri_events())
+    return save_significance('hijri', h.month, h.day, list(dict.fromkeys(local + fetched)))
+
+def build_significance_index(get_soup=fetch_page_soup, pause=0):
+    """
+    Builds the DaySignificance index once: every Hijri (month, day) from
+    ISLAMIC_EVENTS, recurring IslamicEvent rows, Wikipedia and WikiShia, and
+    every Gregorian (month, day) from onthisday.com. get_soup(url) can be
+    swapped for saved HTML fixtures. Returns the number of entries written.
+    """
+    recurring = recurring_hijri_events()
+    count = 0
+    for month in range(1, 13):
+        read = _page_reader(get_soup, pause)  # month pages are shared by its 30 days
+        for day in range(1, 31):
+            save_significance('hijri', month, day, hijri_significance(month, day, read, recurring))
+            count += 1
+        db.session.commit()
+
+    for month in range(1, 13):
+        read = _page_reader(get_soup, pause)
+        for day in range(1, monthrange(2024, month)[1] + 1):
+            events = gregorian_significance(month, day, read)
+            if events is not None:
+                save_significance('gregorian', month, day, events)
+                count += 1
+        db.session.commit()
+    return count
+
+def refresh_significance(calendar, month, day, get_soup=fetch_page_soup):
+    """Rebuilds a single index entry (keeps the old one if the source is unreachable)."""
+    read = _page_reader(get_soup)
+    if calendar == 'hijri':
+        events = hijri_significance(month, day, read, recurring_hijri_events())
+    else:
+        events = gregorian_significance(month, day, read)
+    if events is not None:
+        save_significance(calendar, month, day, events)
+        db.session.commit()
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def _refresh_in_pool(key):
+    try:
+        with app.app_context():
+            refresh_significance(*key)
+    except Exception as e:
+        print(f"Index Refresh Error {key}: {e}")
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+def schedule_significance_refresh(calendar, month, day):
+    """Refreshes an index entry on day_details_pool, at most once at a time per entry."""
+    if not app.config['SIGNIFICANCE_BACKGROUND_REFRESH']:
+        return
+    key = (calendar, month, day)
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    day_details_pool.submit(_refresh_in_pool, key)
+
 @app.route('/api/day_details')
 @login_required
 def get_day_details():
@@ -1228,164 +2773,80 @@ def get_day_details():
         dt = datetime.strptime(date_str, '%Y-%m-%d')
         month_name = dt.strftime('%B').lower()
         day_num = dt.day
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
         
         events = []
+        reflection = "Remember: Verily, with hardship comes ease."
+        hadith = None
+        sources = {}
+        deadline = time.monotonic() + app.config['DAY_DETAILS_DEADLINE']
+        lookups = {}
         
-        # 0. Islamic Date and Dynamic Significance
+        # 0. Islamic Date
         try:
             h_date = Gregorian(dt.year, dt.month, dt.day).to_hijri()
             h_month_name = h_date.month_name()
             h_day_str = h_day_suffix(h_date.day)
-            
+
+            # Ayah and hadith book are fixed per calendar day so warm clicks stay cached
+            day_rng = random.Random(dt.strftime('%m-%d'))
+            ayah_num = day_rng.randint(1, 6236)
+            book = day_rng.choice(['bukhari', 'muslim'])
+            lookups['quran'] = ('quran_ayah', str(ayah_num), lambda: fetch_quran_ayah(ayah_num))
+            lookups['hadith'] = ('hadith_book', book, lambda: fetch_hadith_book(book))
+        except Exception as e:
+            print(f"Hijri Error: {e}")
+            h_date = None
+
+        # Significance comes only from the pre-built index (build_index.py)
+        wanted = [db.and_(DaySignificance.calendar == 'gregorian', DaySignificance.month == dt.month, DaySignificance.day == day_num)]
+        if h_date:
+            wanted.append(db.and_(DaySignificance.calendar == 'hijri', DaySignificance.month == h_date.month, DaySignificance.day == h_date.day))
+        index = {e.calendar: e for e in DaySignificance.query.filter(db.or_(*wanted)).all()}
+        stale_before = datetime.utcnow() - timedelta(seconds=app.config['SIGNIFICANCE_REFRESH_AFTER'])
+        for calendar, month, day in [('gregorian', dt.month, day_num)] + ([('hijri', h_date.month, h_date.day)] if h_date else []):
+            entry = index.get(calendar)
+            if not entry:
+                sources[f'{calendar}_index'] = 'missing'
+            elif entry.updated_at < stale_before:
+                sources[f'{calendar}_index'] = 'stale'
+            else:
+                sources[f'{calendar}_index'] = 'ok'
+                continue
+            schedule_significance_refresh(calendar, month, day)
+
+        # Independent Daily Reflection (Quran/Hadith)
+        outcomes = run_lookups(lookups, deadline)
+        sources.update({name: status for name, (status, _) in outcomes.items()})
+
+        if h_date:
             islamic_date_str = f"{h_day_str} {h_month_name}"
             events.append(f"📅 Islamic Date: {islamic_date_str}, {h_date.year} AH")
-            
-            # Lookup in Static Events
-            month_events = ISLAMIC_EVENTS.get(h_month_name, {})
-            day_data = month_events.get(h_date.day)
-            
-            if day_data:
-                if isinstance(day_data, list):
-                    for event in day_data:
-                        events.append(f"🕌 {event}")
-                else:
-                    events.append(f"🕌 {day_data}")
-            
-            # Dynamic Fallback: Wikipedia Scrape (Month Page)
-            # Scrape the month page (e.g. wiki/Rajab) and look for the specific day
-            try:
-                # wiki/Rajab
-                safe_month = h_month_name.replace(' ', '_')
-                wiki_url = f"https://en.wikipedia.org/wiki/{safe_month}"
-                
-                resp = requests.get(wiki_url, headers=headers, timeout=3)
-                if resp.status_code == 200:
-                    soup = BeautifulSoup(resp.content, 'html.parser')
-                    # Find all list items
-                    # Look for day pattern: "15 Rajab" or "15th" or just "15 " at start
-                    day_patterns = [
-                        f"{h_date.day} {h_month_name}", 
-                        f"{h_date.day}th {h_month_name}",
-                        f"{h_date.day}st {h_month_name}",
-                        f"{h_date.day}nd {h_month_name}",
-                        f"{h_date.day}rd {h_month_name}",
-                        f"{h_date.day} " # Simple day number check (risky but getting hit is better)
-                    ]
-                    
-                    content_div = soup.find('div', {'id': 'mw-content-text'})
-                    if content_div:
-                        for li in content_div.find_all('li'):
-                            text = li.get_text(strip=True)
-                            # Check if line starts with day number
-                            # e.g. "27 Rajab – Isra..." or "27 – Isra..."
-                            if any(text.lower().startswith(p.lower()) for p in day_patterns) or text.startswith(f"{h_date.day} –") or text.startswith(f"{h_date.day} -"):
-                                # Avoid huge paragraphs, just take the line
-                                if len(text) > 10 and len(text) < 300:
-                                     # Clean citations [1]
-                                    import re
-                                    clean_text = re.sub(r'\[\d+\]', '', text)
-                                    events.append(f"📜 {clean_text}")
-                
-                # Try specific Date page (e.g. wiki/15_Rajab)
-                date_page_url = f"https://en.wikipedia.org/wiki/{h_date.day}_{safe_month}"
-                d_resp = requests.get(date_page_url, headers=headers, timeout=3)
-                if d_resp.status_code == 200:
-                    d_soup = BeautifulSoup(d_resp.content, 'html.parser')
-                    for section_header in ['Events', 'Observances', 'Births', 'Deaths']:
-                        s_h = d_soup.find('span', {'id': section_header})
-                        if s_h:
-                            ul = s_h.parent.find_next_sibling('ul') or s_h.parent.find_next('ul')
-                            if ul:
-                                for li in ul.find_all('li')[:3]:
-                                    events.append(f"🏷️ {li.get_text(strip=True)}")
-            except Exception as w_e:
-                 # Silently fail
-                 print(f"Wiki Search Error: {w_e}")
-
-            # Fallback for events: WikiShia
-            if len(events) <= 1: # Only header exists
-                 try:
-                     wikishia_url = f"https://en.wikishia.net/view/{h_month_name}"
-                     w_resp = requests.get(wikishia_url, headers=headers, timeout=3)
-                     if w_resp.status_code == 200:
-                         w_soup = BeautifulSoup(w_resp.content, 'html.parser')
-                         for li in w_soup.find_all('li'):
-                             text = li.get_text(strip=True)
-                             if text.startswith(f"{h_date.day} {h_month_name}") or text.startswith(f"{h_date.day}th {h_month_name}"):
-                                 events.append(f"🕌 {text}")
-                 except Exception as ws_e:
-                     print(f"WikiShia Error: {ws_e}")
+            if 'hijri' in index:
+                events.extend(json.loads(index['hijri'].events))
+            else:
+                events.extend(static_hijri_events(h_date.month, h_date.day))
 
             if len(events) <= 1:
                 events.append("No major historical events recorded for this date.")
 
-            # Independent Daily Reflection (Quran/Hadith)
-            hadith = None
-            try:
-                # 1. Fetch random Ayah with translation
-                # Ayah number between 1 and 6236
-                ayah_num = random.randint(1, 6236)
-                q_res = requests.get(f'https://api.alquran.cloud/v1/ayah/{ayah_num}/editions/quran-uthmani,en.sahih', timeout=5)
-                if q_res.ok:
-                    q_data = q_res.json()
-                    if q_data.get('data') and len(q_data['data']) >= 2:
-                        arabic = q_data['data'][0]
-                        english = q_data['data'][1]
-                        
-                        surah = arabic['surah']['englishName']
-                        number = arabic['numberInSurah']
-                        
-                        reflection = {
-                            'reference': f"Quran {surah}:{number}",
-                            'arabic': arabic['text'],
-                            'english': english['text']
-                        }
-                else:
-                    reflection = "Remember: Verily, with hardship comes ease."
-                
-                # 2. Fetch random Hadith (English)
-                # Using a more reliable English Hadith source
-                books = ['bukhari', 'muslim']
-                book = random.choice(books)
-                h_url = f"https://hadith-api.vercel.app/api/books/{book}?range=1-100"
-                h_res = requests.get(h_url, timeout=5)
-                if h_res.ok:
-                    h_json = h_res.json()
-                    if h_json.get('data') and h_json['data'].get('hadiths'):
-                        selected = random.choice(h_json['data']['hadiths'])
-                        hadith = {
-                            'text': selected.get('english', 'Description not available'),
-                            'source': f"{book.capitalize()} - Hadith {selected.get('hadithNumber', '?')}"
-                        }
-            except Exception as q_e:
-                print(f"Reflection Fetch Error: {q_e}")
-                reflection = "Remember to take a moment for Dhikr today."
-
-        except Exception as e:
-            print(f"Hijri Error: {e}")
+            status, value = outcomes['quran']
+            if status in ('ok', 'cached'):
+                reflection = value
+            status, value = outcomes['hadith']
+            if status in ('ok', 'cached') and value:
+                hadith = random.choice(value)
+        else:
             events.append(f"Could not calculate Islamic date.")
             reflection = "Error fetching reflection."
         
-        # 1. Scrape OnThisDay.com for "Significance"
-        url = f"https://www.onthisday.com/day/{month_name}/{day_num}"
-        try:
-            headers = {'User-Agent': 'Mozilla/5.0'}
-            # print(f"Fetching: {url}") # Reduced interaction logging
-            resp = requests.get(url, headers=headers, timeout=10)
-            if resp.status_code == 200:
-                soup = BeautifulSoup(resp.content, 'html.parser')
-                event_items = soup.select('li.event')
-                for item in event_items[:5]: 
-                    events.append(item.get_text(strip=True))
-                
-                if not soup.select('li.event'):
-                     events.append("Historical events could not be fetched.")
-            else:
-                events.append(f"Could not connect to history source. Status: {resp.status_code}")
-        except Exception as e:
-            print(f"Scraping Exception: {e}")
-            events.append(f"External search failed: {str(e)}")
+        # 1. On this day in history
+        if 'gregorian' in index:
+            history = json.loads(index['gregorian'].events)
+            events.extend(history)
+            if not history:
+                events.append("Historical events could not be fetched.")
+        else:
+            events.append("Historical events are not available for this date yet.")
             
         # 2. Recommended Dua (Random with Fallback)
         dua_data = None
@@ -1444,7 +2905,8 @@ def get_day_details():
             'hadith': hadith,
             'dua': dua_data,
             'day_overview': day_overview,
-            'schedule': schedule_info
+            'schedule': schedule_info,
+            'sources': sources
         })
         
     except Exception as e:
@@ -1465,53 +2927,60 @@ def h_day_suffix(day):
 def analytics_view():
     return render_template('analytics.html')
 
+# Longest range the analytics charts can request (about 5 years)
+ANALYTICS_MAX_DAYS = 5 * 366
+
+def dense_daily_series(rows, start_date, length):
+    """Turns grouped (date, value) rows into a list with one slot per day, 0 where missing."""
+    series = [0] * length
+    for day, value in rows:
+        series[(day - start_date).days] = int(value or 0)
+    return series
+
+def habit_streak(user_id, today):
+    """
+    Consecutive days up to today with at least one completed habit, read from
+    the rollup. Today still counts as in progress if nothing is done yet.
+    """
+    done_days = db.session.query(DailyRollup.date) \
+        .filter(DailyRollup.user_id == user_id, DailyRollup.date <= today, DailyRollup.completed_habits > 0) \
+        .order_by(DailyRollup.date.desc()).limit(ANALYTICS_MAX_DAYS).all()
+    dates = [day for (day,) in done_days]
+    expected = today if dates and dates[0] == today else today - timedelta(days=1)
+    streak = 0
+    for day in dates:
+        if day != expected:
+            break
+        streak += 1
+        expected -= timedelta(days=1)
+    return streak
+
+def habit_streak_rows(user_id, today):
+    """Per-habit streaks and completion rates for the analytics page (one join, no log scans)."""
+    rows = db.session.query(Habit, HabitStreak).outerjoin(HabitStreak, HabitStreak.habit_id == Habit.id) \
+        .filter(Habit.user_id == user_id).order_by(Habit.id).all()
+    return [dict(streak_summary(state, habit, today), id=habit.id, name=habit.name, paused=bool(habit.is_paused))
+            for habit, state in rows]
+
 @app.route('/api/analytics_data')
 @login_required
 def analytics_data():
     days = request.args.get('days', 30, type=int)
+    days = max(1, min(days, ANALYTICS_MAX_DAYS))
     end_date = get_today()
     start_date = end_date - timedelta(days=days-1)
     
-    # 1. Initialize data structure
-    date_labels = []
-    total_scores = []
-    habit_scores = []
-    prayer_scores = []
-    
-    # Efficient querying:
-    # Fetch all logs in range
-    h_logs = HabitLog.query.join(Habit).filter(Habit.user_id == current_user.id, HabitLog.date >= start_date, HabitLog.date <= end_date, HabitLog.status == True).all()
-    p_logs = PrayerLog.query.filter_by(user_id=current_user.id).filter(PrayerLog.date >= start_date, PrayerLog.date <= end_date).all()
-    s_logs = ScheduleLog.query.filter_by(user_id=current_user.id, status=True).filter(ScheduleLog.date >= start_date, ScheduleLog.date <= end_date).all()
-    
-    # Process into dictionary by date
-    from collections import defaultdict
-    data_map = defaultdict(lambda: {'habit': 0, 'prayer': 0, 'schedule': 0})
-    
-    for log in h_logs:
-        points = getattr(log.habit, 'points', 10)
-        data_map[log.date]['habit'] += points
-        
-    for log in p_logs:
-        data_map[log.date]['prayer'] += log.spiritual_score
-
-    for log in s_logs:
-        data_map[log.date]['schedule'] += log.points
-
-    # Flatten for Charts
-    current = start_date
-    while current <= end_date:
-        date_labels.append(current.strftime('%b %d'))
-        h_score = data_map[current]['habit']
-        p_score = data_map[current]['prayer']
-        s_score = data_map[current]['schedule']
-        
-        habit_scores.append(h_score)
-        prayer_scores.append(p_score)
-        # We can add a separate array or just merge schedule into habits for simplicity in current charts
-        # But 'total_scores' MUST include it.
-        total_scores.append(h_score + p_score + s_score)
-        current += timedelta(days=1)
+    # One row per day from the rollup table, never the raw logs
+    rows = db.session.query(DailyRollup.date, DailyRollup.habit_points, DailyRollup.prayer_points, DailyRollup.schedule_points) \
+        .filter(DailyRollup.user_id == current_user.id, DailyRollup.date >= start_date, DailyRollup.date <= end_date).all()
+
+    # Densify into one slot per day for the charts
+    habit_scores = dense_daily_series([(r[0], r[1]) for r in rows], start_date, days)
+    prayer_scores = dense_daily_series([(r[0], r[2]) for r in rows], start_date, days)
+    schedule_scores = dense_daily_series([(r[0], r[3]) for r in rows], start_date, days)
+    # Schedule points are only shown as part of the total
+    total_scores = [h + p + s for h, p, s in zip(habit_scores, prayer_scores, schedule_scores)]
+    date_labels = [(start_date + timedelta(days=i)).strftime('%b %d') for i in range(days)]
         
     return jsonify({
         'labels': date_labels,
@@ -1521,84 +2990,514 @@ def analytics_data():
         'summary': {
             'total_all_time': sum(total_scores), # rough approx for range
             'avg_daily': int(sum(total_scores) / days) if days else 0,
-            'best_day': max(total_scores) if total_scores else 0
-        }
+            'best_day': max(total_scores) if total_scores else 0,
+            'current_streak': habit_streak(current_user.id, end_date)
+        },
+        'habits': habit_streak_rows(current_user.id, end_date)
     })
+
+# --- Schedule Upload Jobs ---
+# upload_schedule() only stores the file; upload_worker.py extracts and parses it in a process pool
+UPLOAD_EXTENSIONS = ('.txt', '.doc', '.docx', '.xls', '.xlsx', '.jpg', '.jpeg', '.png')
+UPLOAD_BUSY_STATUSES = ('running', 'cancelling')  # Holding a pool process
+UPLOAD_ACTIVE_STATUSES = ('queued',) + UPLOAD_BUSY_STATUSES  # Counted against UPLOAD_MAX_ACTIVE
+UPLOAD_FORM_SLACK = 64 * 1024  # Multipart headers and the other form fields
+UPLOAD_TIMEOUT_MESSAGE = "Processing took too long. Try a smaller or clearer file."
+UPLOAD_TOO_LARGE_MESSAGE = "File is too large (limit {mb} MB)."
+UPLOAD_STORED_NAME = re.compile(r'^[0-9a-f]{64}\.\w+$')  # What store_upload() writes; the sweeper deletes nothing else
+
+class UploadError(Exception):
+    """An upload that cannot be processed; the message is shown to the user."""
+
+def _upload_timed_out(signum, frame):
+    raise UploadError(UPLOAD_TIMEOUT_MESSAGE)
+
+# OCR preprocessing: Tesseract time grows with pixel count, and shadows, screen
+# glare and menus around a timetable photo cost accuracy
+OCR_PAGE_INCHES = 11.7  # A timetable photo spans at most an A4 page's long edge
+OCR_DESKEW_DEGREES = 5  # Searched each way
+OCR_DESKEW_STEP = 0.5
+OCR_TEXT_GRID = 48  # Cells per side when looking for the table's block of text
+
+def otsu_threshold(histogram):
+    """Gray level that best separates ink from paper in a 256-bin histogram."""
+    total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    weight_bg = sum_bg = 0
+    best, threshold = -1, 127
+    for i, count in enumerate(histogram):
+        weight_bg += count
+        if not weight_bg:
+            continue
+        weight_fg = total - weight_bg
+        if not weight_fg:
+            break
+        sum_bg += i * count
+        between = weight_bg * weight_fg * (sum_bg / weight_bg - (sum_all - sum_bg) / weight_fg) ** 2
+        if between > best:
+            best, threshold = between, i
+    return threshold
+
+def ink_profile(binary):
+    """Fraction of dark pixels in each row of a binarized image."""
+    return [1 - v / 255 for v in binary.resize((1, binary.height), Image.BOX).tobytes()]
+
+def deskew_angle(binary):
+    """Rotation (degrees) that lines text rows up best: the one with the sharpest row profile."""
+    small = binary.copy()
+    small.thumbnail((800, 800))
+    steps = int(OCR_DESKEW_DEGREES / OCR_DESKEW_STEP)
+    best_score, best_angle = -1, 0
+    for k in range(-steps, steps + 1):
+        rows = ink_profile(small.rotate(k * OCR_DESKEW_STEP, fillcolor=255))
+        mean = sum(rows) / len(rows)
+        score = sum((r - mean) ** 2 for r in rows)
+        if score > best_score:
+            best_score, best_angle = score, k * OCR_DESKEW_STEP
+    return best_angle
+
+def text_block_box(binary):
+    """Bounding box of the largest connected block of text-like cells (not blank, not solid), or None."""
+    cols, rows = min(OCR_TEXT_GRID, binary.width), min(OCR_TEXT_GRID, binary.height)
+    data = binary.resize((cols, rows), Image.BOX).tobytes()
+    texty = {(x, y) for y in range(rows) for x in range(cols) if 0.02 < 1 - data[y * cols + x] / 255 < 0.45}
+    best, seen = [], set()
+    for start in texty:
+        if start in seen:
+            continue
+        seen.add(start)
+        block, stack = [], [start]
+        while stack:
+            x, y = stack.pop()
+            block.append((x, y))
+            for nx in (x - 1, x, x + 1):
+                for ny in (y - 1, y, y + 1):
+                    if (nx, ny) in texty and (nx, ny) not in seen:
+                        seen.add((nx, ny))
+                        stack.append((nx, ny))
+        if len(block) > len(best):
+            best = block
+    if not best:
+        return None
+    sx, sy = binary.width / cols, binary.height / rows
+    return (int(min(x for x, _ in best) * sx), int(min(y for _, y in best) * sy),
+            int((max(x for x, _ in best) + 1) * sx), int((max(y for _, y in best) + 1) * sy))
+
+def preprocess_for_ocr(image, target_dpi):
+    """Downscales, grayscales, binarizes, deskews and crops a schedule photo to its table. Returns an 'L' image of 0/255."""
+    image = ImageOps.exif_transpose(image)
+    max_side = int(target_dpi * OCR_PAGE_INCHES)
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    gray = ImageOps.grayscale(image)
+
+    # Flatten uneven lighting: subtract a blurred estimate of the paper; large dark areas (menus, bars) fade out
+    factor = max(2, max(gray.size) // 128)
+    background = gray.reduce(factor).filter(ImageFilter.MaxFilter(3)).filter(ImageFilter.GaussianBlur(1)) \
+        .resize(gray.size, Image.BILINEAR)
+    flat = ImageOps.autocontrast(ImageChops.subtract(gray, background, offset=255), cutoff=1)
+    threshold = otsu_threshold(flat.histogram())
+    binarize = lambda img: img.point(lambda v: 255 if v > threshold else 0)
+    binary = binarize(flat)
+
+    angle = deskew_angle(binary)
+    if angle:
+        binary = binarize(flat.rotate(angle, Image.BICUBIC, expand=True, fillcolor=255))
+
+    box = text_block_box(binary)
+    if box:
+        pad = max(binary.size) // 50
+        binary = binary.crop((max(box[0] - pad, 0), max(box[1] - pad, 0),
+                              min(box[2] + pad, binary.width), min(box[3] + pad, binary.height)))
+    return binary
+
+def ocr_image(image, timeout=None, preprocess=None):
+    """Tesseract text of a schedule photo; preprocessed with table-friendly settings unless OCR_PREPROCESS is off."""
+    if preprocess is None:
+        preprocess = app.config['OCR_PREPROCESS']
+    config = ''
+    if preprocess:
+        image = preprocess_for_ocr(image, app.config['OCR_TARGET_DPI'])
+        config = app.config['OCR_TESSERACT_CONFIG']
+    return pytesseract.image_to_string(image, config=config, timeout=timeout or 0)
+
+# Extraction streams lines straight into parse_schedule_items and stops at the
+# row/byte budget, so memory stays bounded however large (or compressed) the file is
+UPLOAD_MAX_LINE_CHARS = 64 * 1024  # Longer lines, paragraphs and cells are cut
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+def _iter_text_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in iter(lambda: f.readline(UPLOAD_MAX_LINE_CHARS), ''):
+            yield line.rstrip('\n')
+
+def _iter_docx_lines(path):
+    """Paragraphs, and table rows as 'cell | cell', in document order, from an incremental parse of document.xml."""
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise UploadError("Could not read this Word file. Please save it as .docx.")
+    with archive, archive.open('word/document.xml') as xml:
+        rows = []  # Open table rows (nested tables stack), each a list of cells, each a list of paragraph texts
+        parts, size, depth, body = [], 0, 0, None
+        for event, elem in ElementTree.iterparse(xml, events=('start', 'end')):
+            tag = elem.tag
+            if event == 'start':
+                depth += 1
+                if tag == W_NS + 'body':
+                    body = elem
+                elif tag == W_NS + 'tr':
+                    rows.append([])
+                elif tag == W_NS + 'tc' and rows:
+                    rows[-1].append([])
+                continue
+            depth -= 1
+            if tag == W_NS + 't':
+                if size < UPLOAD_MAX_LINE_CHARS:
+                    parts.append(elem.text or '')
+                    size += len(elem.text or '')
+            elif tag == W_NS + 'tab':
+                parts.append('\t')
+            elif tag == W_NS + 'p':
+                text = ''.join(parts)[:UPLOAD_MAX_LINE_CHARS]
+                parts, size = [], 0
+                elem.clear()
+                if rows and rows[-1]:
+                    rows[-1][-1].append(text)
+                else:
+                    yield text
+            elif tag == W_NS + 'tr' and rows:
+                cells = (' '.join(p for p in cell if p.strip()) for cell in rows.pop())
+                elem.clear()
+                yield " | ".join(c for c in cells if c.strip())
+            if depth == 2 and body is not None:
+                body.clear()  # Drop each finished top-level block
+
+def _iter_xlsx_lines(path):
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)  # Rows are parsed as they are read
+    try:
+        for ws in wb.worksheets:
+            yield f"--- Sheet: {ws.title} ---"
+            for row in ws.iter_rows(values_only=True):
+                yield " | ".join(str(cell) for cell in row if cell is not None)
+    finally:
+        wb.close()
+
+def iter_upload_lines(path, timeout=None, max_pixels=None):
+    """Yields the text lines of an uploaded schedule file, by extension. Raises UploadError."""
+    ext = os.path.splitext(path)[1].lower()
+    # 1. Text Files
+    if ext == '.txt':
+        yield from _iter_text_lines(path)
+
+    # 2. Word Documents
+    elif ext in ['.doc', '.docx']:
+        yield from _iter_docx_lines(path)
+
+    # 3. Excel Files
+    elif ext in ['.xls', '.xlsx']:
+        if not openpyxl:
+            raise UploadError("Excel processing not available.")
+        yield from _iter_xlsx_lines(path)
+
+    # 4. Images (OCR)
+    elif ext in ['.jpg', '.jpeg', '.png']:
+        if not pytesseract:
+            raise UploadError("Tesseract OCR not installed.")
+        image = Image.open(path)
+        if max_pixels and image.width * image.height > max_pixels:
+            raise UploadError("Image is too large to process. Please upload a smaller photo.")
+        try:
+            text = ocr_image(image, timeout)
+        except RuntimeError as e:
+            if 'timeout' in str(e).lower():  # Tesseract was killed
+                raise UploadError(UPLOAD_TIMEOUT_MESSAGE) from e
+            raise
+        yield from text.split('\n')
+
+    else:
+        raise UploadError("Unsupported file type.")
+
+def budgeted_lines(lines, max_rows, max_bytes):
+    """Passes `lines` through until max_rows lines or max_bytes of text, then notes the cut and stops reading."""
+    with closing(lines):
+        rows = size = 0
+        for line in lines:
+            rows += 1
+            size += len(line.encode('utf-8')) + 1
+            if rows > max_rows or size > max_bytes:
+                yield f"[Stopped reading after {rows - 1} rows]"
+                return
+            yield line
+
+def upload_limits():
+    """Limits for run_upload_job, read here since it runs in the worker's pool processes."""
+    return {
+        'timeout': app.config['UPLOAD_JOB_TIMEOUT'],
+        'max_pixels': app.config['UPLOAD_MAX_PIXELS'],
+        'max_rows': app.config['UPLOAD_MAX_ROWS'],
+        'max_text_bytes': app.config['UPLOAD_MAX_TEXT_BYTES'],
+    }
+
+def run_upload_job(path, limits):
+    """
+    Extracts and parses one upload (runs on upload_worker.py's process pool, no DB access).
+    Returns the UploadJob columns to set. SIGALRM bounds the whole job in a pool process.
+    """
+    timeout = limits['timeout']
+    alarm = bool(timeout) and hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+    if alarm:
+        previous = signal.signal(signal.SIGALRM, _upload_timed_out)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        kept = []  # Non-blank lines for the review page; bounded by the budget
+
+        def lines():
+            for line in budgeted_lines(iter_upload_lines(path, timeout, limits['max_pixels']),
+                                       limits['max_rows'], limits['max_text_bytes']):
+                if line.strip():
+                    kept.append(line)
+                yield line
+        items = parse_schedule_items(lines())
+        text = "\n".join(kept)
+        if not text.strip():
+            return {'status': 'failed', 'error': "No text could be read from this file."}
+        return {'status': 'done', 'text': text, 'items': items}
+    except UploadError as e:
+        return {'status': 'failed', 'error': str(e)}
+    except Exception as e:
+        return {'status': 'failed', 'error': f"Processing Error: {str(e)}"}
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+def store_upload(stream, ext):
+    """
+    Streams an upload into UPLOAD_FOLDER named by its SHA-256, so the same file
+    is stored once. Returns (content_hash, path); raises UploadError past UPLOAD_MAX_BYTES.
+    """
+    folder = app.config['UPLOAD_FOLDER']
+    max_bytes = app.config['UPLOAD_MAX_BYTES']
+    os.makedirs(folder, exist_ok=True)
+    digest, size = hashlib.sha256(), 0
+    fd, partial = tempfile.mkstemp(dir=folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: stream.read(64 * 1024), b''):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadError(UPLOAD_TOO_LARGE_MESSAGE.format(mb=max_bytes // (1024 * 1024)))
+                digest.update(chunk)
+                out.write(chunk)
+        content_hash = digest.hexdigest()
+        path = os.path.join(folder, content_hash + ext)
+        try:
+            os.utime(path)  # Already stored: keep it as recently used
+            os.remove(partial)
+        except FileNotFoundError:
+            os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return content_hash, path
+
+def complete_cached_upload_jobs(now=None):
+    """Finishes queued jobs whose file content already has an UploadResult. Returns how many."""
+    now = now or datetime.utcnow()
+    rows = db.session.query(UploadJob, UploadResult) \
+        .join(UploadResult, UploadJob.content_hash == UploadResult.content_hash) \
+        .filter(UploadJob.status == 'queued').all()
+    for job, result in rows:
+        job.status, job.text, job.items, job.finished_at = 'done', result.text, result.items, now
+        result.last_used_at = now
+    if rows:
+        db.session.commit()
+    return len(rows)
+
+def claim_upload_jobs(limit, now=None):
+    """
+    Marks up to `limit` queued jobs running, oldest first. Only one job per file
+    content runs at a time; duplicates stay queued and are completed from its
+    cached result. Returns [(job_id, path, content_hash)].
+    """
+    if limit <= 0:
+        return []
+    busy = {h for (h,) in db.session.query(UploadJob.content_hash).filter(UploadJob.status.in_(UPLOAD_BUSY_STATUSES)) if h}
+    query = UploadJob.query.filter_by(status='queued').order_by(UploadJob.id).limit(limit)
+    if db.engine.dialect.name == 'postgresql':
+        # Another upload_worker.py skips the jobs this one is claiming
+        query = query.with_for_update(skip_locked=True)
+    claimed = []
+    for job in query.all():
+        if job.content_hash in busy:
+            continue
+        if job.content_hash:
+            busy.add(job.content_hash)
+        claimed.append((job.id, job.path, job.content_hash))
+        job.status = 'running'
+        job.started_at = now or datetime.utcnow()
+    db.session.commit()
+    return claimed
+
+def drain_upload_jobs(pool, inflight, now=None):
+    """
+    Records the jobs in `inflight` (future -> (job id, content hash), kept by the
+    caller between calls) that have finished and caches their results, then
+    starts queued jobs while `pool` has free workers. A job cancelled while it
+    ran only becomes cancelled here, once its pool process is free again, and
+    its output is discarded. Returns the metrics.
+    """
+    now = now or datetime.utcnow()
+    metrics = {'finished': 0, 'cancelled': 0, 'cached': 0, 'started': 0}
+    for future in [f for f in inflight if f.done()]:
+        job_id, content_hash = inflight.pop(future)
+        try:
+            outcome = future.result()
+        except Exception as e:  # The pool process died, e.g. out of memory
+            outcome = {'status': 'failed', 'error': f"Processing Error: {str(e)}"}
+        if 'items' in outcome:
+            outcome['items'] = json.dumps(outcome['items'])
+        recorded = UploadJob.query.filter_by(id=job_id, status='running') \
+            .update({**outcome, 'finished_at': now}, synchronize_session=False)
+        if not recorded:
+            metrics['cancelled'] += UploadJob.query.filter_by(id=job_id, status='cancelling') \
+                .update({'status': 'cancelled', 'finished_at': now}, synchronize_session=False)
+            continue
+        if outcome['status'] == 'done' and content_hash:
+            insert_or_ignore(UploadResult, {'content_hash': content_hash, 'text': outcome['text'], 'items': outcome['items'],
+                                            'created_at': now, 'last_used_at': now}, ['content_hash'])
+        metrics['finished'] += 1
+    if metrics['finished'] or metrics['cancelled']:
+        db.session.commit()
+
+    metrics['cached'] = complete_cached_upload_jobs(now)
+    claimed = claim_upload_jobs(app.config['UPLOAD_WORKERS'] - len(inflight), now)
+    for i, (job_id, path, content_hash) in enumerate(claimed):
+        try:
+            future = pool.submit(run_upload_job, path, upload_limits())
+        except Exception:
+            # Broken pool: hand the rest back to the queue for the next pool
+            UploadJob.query.filter(UploadJob.id.in_([c[0] for c in claimed[i:]])) \
+                .update({'status': 'queued', 'started_at': None}, synchronize_session=False)
+            db.session.commit()
+            raise
+        inflight[future] = (job_id, content_hash)
+        metrics['started'] += 1
+    return metrics
+
+def expire_upload_jobs(now=None):
+    """Fails jobs whose worker died mid-run and deletes jobs older than UPLOAD_JOB_RETENTION. Returns (failed, deleted)."""
+    now = now or datetime.utcnow()
+    stale_before = now - timedelta(seconds=2 * app.config['UPLOAD_JOB_TIMEOUT'] + 60)
+    failed = UploadJob.query.filter(UploadJob.status == 'running', UploadJob.started_at < stale_before) \
+        .update({'status': 'failed', 'error': "Processing was interrupted. Please upload the file again.",
+                 'finished_at': now}, synchronize_session=False)
+    UploadJob.query.filter(UploadJob.status == 'cancelling', UploadJob.started_at < stale_before) \
+        .update({'status': 'cancelled', 'finished_at': now}, synchronize_session=False)
+    deleted = UploadJob.query.filter(
+        UploadJob.status.notin_(UPLOAD_BUSY_STATUSES),
+        UploadJob.created_at < now - timedelta(hours=app.config['UPLOAD_JOB_RETENTION'])
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return failed, deleted
+
+def sweep_uploads(now=None):
+    """
+    Bounds UPLOAD_FOLDER: deletes stored uploads not uploaded again for
+    UPLOAD_FILE_RETENTION hours, then the least recently uploaded ones while the
+    folder is over UPLOAD_FOLDER_MAX_BYTES, and abandoned partial writes. Files of
+    queued or running jobs and files not named by content hash are left alone.
+    Also drops cached results unused for UPLOAD_RESULT_TTL days. Returns the metrics.
+    """
+    now = now or datetime.utcnow()
+    folder = app.config['UPLOAD_FOLDER']
+    metrics = {'files': 0, 'bytes': 0, 'results': 0}
+    active = {os.path.basename(path) for (path,) in
+              db.session.query(UploadJob.path).filter(UploadJob.status.in_(UPLOAD_ACTIVE_STATUSES))}
+    try:
+        entries = [entry for entry in os.scandir(folder) if entry.is_file()]
+    except FileNotFoundError:
+        entries = []
+
+    stored = []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        if entry.name.endswith('.part'):
+            if stat.st_mtime < time.time() - 3600:
+                stored.append((0, stat.st_size, entry.path))  # Swept first
+        elif UPLOAD_STORED_NAME.match(entry.name) and entry.name not in active:
+            stored.append((stat.st_mtime, stat.st_size, entry.path))
+    stored.sort()
+    total = sum(size for _, size, _ in stored)
+    cutoff = time.time() - app.config['UPLOAD_FILE_RETENTION'] * 3600
+    for mtime, size, path in stored:
+        if mtime >= cutoff and total <= app.config['UPLOAD_FOLDER_MAX_BYTES']:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        metrics['files'] += 1
+        metrics['bytes'] += size
+
+    metrics['results'] = UploadResult.query.filter(
+        UploadResult.last_used_at < now - timedelta(days=app.config['UPLOAD_RESULT_TTL'])
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return metrics
+
 @app.route('/schedule/upload', methods=['GET', 'POST'])
 @login_required
 def upload_schedule():
     if request.method == 'POST':
-        manual_text = request.form.get('manual_text')
+        max_bytes = app.config['UPLOAD_MAX_BYTES']
+        request.max_content_length = max_bytes + UPLOAD_FORM_SLACK
+        try:
+            manual_text = request.form.get('manual_text')
+            file = request.files.get('file')
+        except RequestEntityTooLarge:
+            flash(UPLOAD_TOO_LARGE_MESSAGE.format(mb=max_bytes // (1024 * 1024)), "danger")
+            return redirect(request.url)
         text_content = ""
         
         # Case 1: Manual Text Input
         if manual_text and manual_text.strip():
             text_content = manual_text
             
-        # Case 2: File Upload
-        elif 'file' in request.files:
-            file = request.files['file']
-            if file and file.filename != '':
-                filename = secure_filename(file.filename)
-                upload_folder = os.path.join('static', 'uploads')
-                os.makedirs(upload_folder, exist_ok=True)
-                filepath = os.path.join(upload_folder, filename)
-                file.save(filepath)
-                
-                ext = os.path.splitext(filename)[1].lower()
-                
-                try:
-                    # 1. Text Files
-                    if ext == '.txt':
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            text_content = f.read()
-                            
-                    # 2. Word Documents
-                    elif ext in ['.doc', '.docx']:
-                        if not docx:
-                             flash("Word document processing not available.", "danger")
-                             return redirect(request.url)
-                        doc = docx.Document(filepath)
-                        full_text = []
-                        for para in doc.paragraphs:
-                            if para.text.strip():
-                                full_text.append(para.text)
-                        for table in doc.tables:
-                            for row in table.rows:
-                                row_text = [cell.text for cell in row.cells if cell.text.strip()]
-                                if row_text:
-                                    full_text.append(" | ".join(row_text))
-                        text_content = "\n".join(full_text)
-                        
-                    # 3. Excel Files
-                    elif ext in ['.xls', '.xlsx']:
-                        if not openpyxl:
-                             flash("Excel processing not available.", "danger")
-                             return redirect(request.url)
-                        wb = openpyxl.load_workbook(filepath, data_only=True)
-                        full_text = []
-                        for sheet in wb.sheetnames:
-                            ws = wb[sheet]
-                            full_text.append(f"--- Sheet: {sheet} ---")
-                            for row in ws.iter_rows(values_only=True):
-                                row_data = [str(cell) for cell in row if cell is not None]
-                                if row_data:
-                                    full_text.append(" | ".join(row_data))
-                        text_content = "\n".join(full_text)
-                        
-                    # 4. Images (OCR)
-                    elif ext in ['.jpg', '.jpeg', '.png']:
-                        if not pytesseract:
-                             flash("Tesseract OCR not installed.", "danger")
-                             return redirect(request.url)
-                        text_content = pytesseract.image_to_string(Image.open(filepath))
-                    
-                    else:
-                        flash("Unsupported file type.", "warning")
-                        return redirect(request.url)
-                except Exception as e:
-                    flash(f"Processing Error: {str(e)}", 'danger')
-                    return redirect(request.url)
+        # Case 2: File Upload, processed by upload_worker.py
+        elif file and file.filename != '':
+            filename = secure_filename(file.filename)
+            ext = os.path.splitext(filename)[1].lower()
+            if ext not in UPLOAD_EXTENSIONS:
+                flash("Unsupported file type.", "warning")
+                return redirect(request.url)
+            active = UploadJob.query.filter(UploadJob.user_id == current_user.id,
+                                            UploadJob.status.in_(UPLOAD_ACTIVE_STATUSES)).count()
+            if active >= app.config['UPLOAD_MAX_ACTIVE']:
+                flash("You already have uploads being processed. Please wait for them to finish.", "warning")
+                return redirect(request.url)
+
+            try:
+                content_hash, filepath = store_upload(file.stream, ext)
+            except UploadError as e:
+                flash(str(e), "danger")
+                return redirect(request.url)
+
+            job = UploadJob(user_id=current_user.id, filename=filename, path=filepath, content_hash=content_hash)
+            cached = UploadResult.query.filter_by(content_hash=content_hash).first()
+            if cached:
+                # Same file as an earlier upload (often a whole section's routine): no extraction needed
+                job.status, job.text, job.items, job.finished_at = 'done', cached.text, cached.items, datetime.utcnow()
+                cached.last_used_at = job.finished_at
+            db.session.add(job)
+            db.session.commit()
+            return redirect(url_for('upload_job', job_id=job.id))
 
         if not text_content.strip():
             flash("Please upload a file or paste your schedule text.", "warning")
@@ -1611,13 +3510,53 @@ def upload_schedule():
             
     return render_template('upload_schedule.html')
 
+@app.route('/schedule/upload/jobs/<int:job_id>')
+@login_required
+def upload_job(job_id):
+    job = UploadJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    if job.status == 'done':
+        parsed_items = json.loads(job.items or '[]')
+        flash(f"Processing Complete! Found {len(parsed_items)} potential schedule items.", 'success')
+        return render_template('upload_result.html', parsed_items=parsed_items, raw_text=job.text)
+    if job.status == 'failed':
+        flash(job.error or "Processing failed.", 'danger')
+        return redirect(url_for('upload_schedule'))
+    if job.status in ('cancelling', 'cancelled'):
+        flash("Upload cancelled.", 'info')
+        return redirect(url_for('upload_schedule'))
+    return render_template('upload_status.html', job=job)
+
+@app.route('/api/upload/jobs/<int:job_id>')
+@login_required
+def upload_job_status(job_id):
+    job = UploadJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    return jsonify({'success': True, 'id': job.id, 'status': job.status, 'error': job.error})
+
+@app.route('/api/upload/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_upload_job(job_id):
+    job = UploadJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    # Conditional, so a job the worker finishes meanwhile is not overwritten. A
+    # running job keeps its pool process until it ends, and still counts toward
+    # UPLOAD_MAX_ACTIVE until drain_upload_jobs() sees that.
+    if UploadJob.query.filter_by(id=job.id, status='queued') \
+            .update({'status': 'cancelled', 'finished_at': datetime.utcnow()}, synchronize_session=False):
+        status = 'cancelled'
+    elif UploadJob.query.filter_by(id=job.id, status='running').update({'status': 'cancelling'}, synchronize_session=False):
+        status = 'cancelling'
+    else:
+        return jsonify({'success': False, 'error': 'Job already finished'}), 409
+    db.session.commit()
+    return jsonify({'success': True, 'status': status})
+
 def parse_schedule_items(text):
     """
     Advanced parser for schedule tables (SL, Course, Section, Day, Time Range, Room).
+    Takes the text, or an iterable of its lines (e.g. streamed from an upload).
     Returns list of dicts: {'title', 'day', 'start', 'end'}
     """
     items = []
-    lines = text.split('\n')
+    lines = text.split('\n') if isinstance(text, str) else text
     days_list = ['Saturday', 'Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
     
     # Improved time range pattern (e.g. 09:35am – 10:35am or 09:35-10:35)
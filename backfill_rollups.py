@@ -0,0 +1,12 @@
+import sys
+from app import app, backfill_rollups
+
+# Rebuilds the DailyRollup table from the habit, prayer and schedule logs.
+# Run once after deploying the rollup, or any time it needs repairing.
+# Usage: python backfill_rollups.py [user_id]
+
+if __name__ == "__main__":
+    user_id = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    with app.app_context():
+        count = backfill_rollups(user_id)
+        print(f"Wrote {count} rollup row(s).")
@@ -0,0 +1,71 @@
+import argparse
+import os
+import tempfile
+import time
+from datetime import timedelta
+from sqlalchemy import event
+
+# Times /api/analytics_data for a heavy user (20 habits done every day plus
+# prayers, over several years) at increasing ranges, and counts its queries.
+# Usage: python benchmark_analytics.py [--years N] [--habits N] [--repeat N]
+
+
+def timed(fn, repeat):
+    """Best of `repeat` runs: (seconds, last result)."""
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--habits', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    span = 365 * args.years
+
+    # Seeds a throwaway database, never the app's own; set before app creates its engine
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    from app import app, db, User, Habit, HabitLog, PrayerLog, backfill_rollups, get_today
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='benchmark', email='benchmark@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        habits = [Habit(name=f'Habit {i}', user_id=user.id, points=10) for i in range(args.habits)]
+        db.session.add_all(habits)
+        db.session.commit()
+        today = get_today()
+        db.session.execute(db.insert(HabitLog), [
+            {'habit_id': h.id, 'date': today - timedelta(days=d), 'status': True, 'points': 10}
+            for h in habits for d in range(span)
+        ])
+        db.session.execute(db.insert(PrayerLog), [
+            {'user_id': user.id, 'date': today - timedelta(days=d), 'spiritual_score': 500} for d in range(1, span)
+        ])
+        db.session.commit()
+        backfill_rollups()
+    print(f"Seeded {args.habits * span} habit logs over {span} days.")
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'benchmark', 'password': 'password'})
+    client.get('/api/analytics_data?days=7')  # Warms the user loader cache
+    queries = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *a: queries.append(1))
+
+    print(f"{'days':>6} {'queries':>8} {'best ms':>8}")
+    for days in sorted({7, 30, 365, span}):
+        del queries[:]
+        client.get(f'/api/analytics_data?days={days}')
+        count = len(queries)
+        best, rv = timed(lambda: client.get(f'/api/analytics_data?days={days}'), args.repeat)
+        assert rv.status_code == 200, rv.status_code
+        print(f"{days:>6} {count:>8} {best * 1000:>8.1f}")
@@ -0,0 +1,49 @@
+import argparse
+import glob
+import os
+import sys
+from PIL import Image
+from app import app, ocr_image, preprocess_for_ocr, parse_schedule_items, pytesseract
+from benchmark_analytics import timed
+
+# Compares OCR of schedule photos as uploaded (full resolution, default
+# Tesseract settings) with the preprocessing pipeline: OCR time and the
+# number of routine items parse_schedule_items finds in each result.
+# Usage: python benchmark_ocr.py [--repeat N] [image ...]   (default: images in static/uploads)
+
+SAMPLE_PATTERNS = ('*.jpg', '*.jpeg', '*.png')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if not pytesseract:
+        sys.exit("pytesseract is not installed.")
+    try:
+        print(f"Tesseract {pytesseract.get_tesseract_version()}, target {app.config['OCR_TARGET_DPI']} DPI, "
+              f"config '{app.config['OCR_TESSERACT_CONFIG']}'")
+    except pytesseract.TesseractNotFoundError:
+        sys.exit("Tesseract is not installed (apt-get install tesseract-ocr).")
+
+    folder = app.config['UPLOAD_FOLDER']
+    paths = args.images or sorted(p for pattern in SAMPLE_PATTERNS for p in glob.glob(os.path.join(folder, pattern)))
+    if not paths:
+        sys.exit(f"No sample images in {folder}.")
+
+    print(f"{'image':<40} {'pixels':>11} {'before s':>9} {'items':>6} {'prep s':>7} {'after s':>8} {'items':>6}")
+    totals = [0, 0, 0, 0]
+    for path in paths:
+        image = Image.open(path)
+        image.load()
+        before_time, before_text = timed(lambda: ocr_image(image, preprocess=False), args.repeat)
+        prep_time, prepared = timed(lambda: preprocess_for_ocr(image, app.config['OCR_TARGET_DPI']), args.repeat)
+        after_time, after_text = timed(lambda: ocr_image(image, preprocess=True), args.repeat)  # Includes preprocessing
+        before_items = len(parse_schedule_items(before_text))
+        after_items = len(parse_schedule_items(after_text))
+        totals = [totals[0] + before_time, totals[1] + before_items, totals[2] + after_time, totals[3] + after_items]
+        print(f"{os.path.basename(path)[:40]:<40} {f'{image.width}x{image.height}':>11} {before_time:>9.2f} "
+              f"{before_items:>6} {prep_time:>7.2f} {after_time:>8.2f} {after_items:>6}   -> {prepared.width}x{prepared.height}")
+    print(f"{'total':<40} {'':>11} {totals[0]:>9.2f} {totals[1]:>6} {'':>7} {totals[2]:>8.2f} {totals[3]:>6}")
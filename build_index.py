@@ -0,0 +1,12 @@
+import sys
+from app import app, build_significance_index
+
+# Builds the Hijri/Gregorian significance index used by /api/day_details.
+# Scrapes Wikipedia, WikiShia and onthisday.com once (about 750 pages).
+# Usage: python build_index.py [pause_seconds_between_requests]
+
+if __name__ == "__main__":
+    pause = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    with app.app_context():
+        count = build_significance_index(pause=pause)
+        print(f"Indexed {count} days.")
@@ -10,3 +10,68 @@ class Config:
         SQLALCHEMY_DATABASE_URI = 'sqlite:///db.sqlite3'
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Day details lookups (seconds): successful results / failed lookups
+    DAY_DETAILS_CACHE_TTL = int(os.environ.get('DAY_DETAILS_CACHE_TTL', 7 * 24 * 3600))
+    DAY_DETAILS_NEGATIVE_TTL = int(os.environ.get('DAY_DETAILS_NEGATIVE_TTL', 15 * 60))
+    # Overall deadline for /api/day_details and the size of its lookup pool
+    DAY_DETAILS_DEADLINE = float(os.environ.get('DAY_DETAILS_DEADLINE', 4))
+    DAY_DETAILS_MAX_WORKERS = int(os.environ.get('DAY_DETAILS_MAX_WORKERS', 8))
+
+    # Significance index: refresh entries in the background when missing or older than this (seconds)
+    SIGNIFICANCE_BACKGROUND_REFRESH = os.environ.get('SIGNIFICANCE_BACKGROUND_REFRESH', '1') == '1'
+    SIGNIFICANCE_REFRESH_AFTER = int(os.environ.get('SIGNIFICANCE_REFRESH_AFTER', 90 * 24 * 3600))
+
+    # Push outbox (drained by push_worker.py)
+    PUSH_BATCH_SIZE = int(os.environ.get('PUSH_BATCH_SIZE', 200))
+    PUSH_MAX_WORKERS = int(os.environ.get('PUSH_MAX_WORKERS', 16))
+    PUSH_MAX_ATTEMPTS = int(os.environ.get('PUSH_MAX_ATTEMPTS', 5))
+    PUSH_RETRY_BASE = int(os.environ.get('PUSH_RETRY_BASE', 30))  # Seconds, doubled per attempt
+
+    # Reminders (reminder_worker.py), in local time
+    REMINDER_LEAD_MINUTES = int(os.environ.get('REMINDER_LEAD_MINUTES', 10))  # Before a routine starts
+    REMINDER_HABIT_TIME = os.environ.get('REMINDER_HABIT_TIME', '20:00')  # Nudge for unfinished habits
+    REMINDER_BATCH_SIZE = int(os.environ.get('REMINDER_BATCH_SIZE', 500))
+    REMINDER_REPLAN_MINUTES = int(os.environ.get('REMINDER_REPLAN_MINUTES', 30))  # Picks up schedule edits
+
+    # Midnight rollover (rollover_worker.py): users seen within this many days get the new day's rows
+    ROLLOVER_ACTIVE_DAYS = int(os.environ.get('ROLLOVER_ACTIVE_DAYS', 14))
+
+    # Offline sync (/api/sync): oldest queued mutation still applied, in days
+    SYNC_MAX_AGE_DAYS = int(os.environ.get('SYNC_MAX_AGE_DAYS', 7))
+
+    # User loader cache, per worker. Bans/deletes/role changes reach other workers through
+    # the stamp file's mtime (default instance/user_cache.stamp; must be shared by all workers)
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))  # Seconds
+    USER_CACHE_STAMP = os.environ.get('USER_CACHE_STAMP')
+
+    # Device/location telemetry is buffered per worker and written in bulk this often (seconds)
+    TELEMETRY_FLUSH_INTERVAL = int(os.environ.get('TELEMETRY_FLUSH_INTERVAL', 10))
+    TELEMETRY_LOCATION_DECIMALS = int(os.environ.get('TELEMETRY_LOCATION_DECIMALS', 4))  # ~11 m
+
+    # AuditLog spool (default instance/audit_spool): fsync'd locally, bulk-inserted this often (seconds)
+    AUDIT_SPOOL_DIR = os.environ.get('AUDIT_SPOOL_DIR')
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 2))
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 500))
+
+    # Schedule uploads: stored here, then extracted and parsed by upload_worker.py's process pool
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', os.path.join('static', 'uploads'))
+    UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+    UPLOAD_MAX_PIXELS = int(os.environ.get('UPLOAD_MAX_PIXELS', 40_000_000))  # Images larger than this are refused
+    UPLOAD_MAX_ACTIVE = int(os.environ.get('UPLOAD_MAX_ACTIVE', 3))  # Queued or running jobs per user
+    UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', os.cpu_count() or 1))
+    UPLOAD_JOB_TIMEOUT = int(os.environ.get('UPLOAD_JOB_TIMEOUT', 60))  # Seconds of extraction per file
+    UPLOAD_MAX_ROWS = int(os.environ.get('UPLOAD_MAX_ROWS', 5000))  # Extraction stops after this many lines/rows...
+    UPLOAD_MAX_TEXT_BYTES = int(os.environ.get('UPLOAD_MAX_TEXT_BYTES', 1024 * 1024))  # ...or this much text
+    UPLOAD_JOB_RETENTION = int(os.environ.get('UPLOAD_JOB_RETENTION', 24))  # Hours finished jobs stay reviewable
+    # Stored by content hash and swept by upload_worker.py: unused files expire, and the folder is kept under a budget
+    UPLOAD_FILE_RETENTION = int(os.environ.get('UPLOAD_FILE_RETENTION', 7 * 24))  # Hours since the file was last uploaded
+    UPLOAD_FOLDER_MAX_BYTES = int(os.environ.get('UPLOAD_FOLDER_MAX_BYTES', 500 * 1024 * 1024))
+    UPLOAD_RESULT_TTL = int(os.environ.get('UPLOAD_RESULT_TTL', 120))  # Days a cached extraction outlives its last use
+
+    # OCR of schedule photos: Pillow preprocessing (downscale, binarize, deskew, crop to the table)
+    # and a Tesseract page segmentation mode that keeps each table row on one line
+    OCR_PREPROCESS = os.environ.get('OCR_PREPROCESS', '1') == '1'
+    OCR_TARGET_DPI = int(os.environ.get('OCR_TARGET_DPI', 300))  # Photos are downscaled to about this, never upscaled
+    OCR_TESSERACT_CONFIG = os.environ.get('OCR_TESSERACT_CONFIG', '--psm 6 -c preserve_interword_spaces=1')
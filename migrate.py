@@ -0,0 +1,201 @@
+import sys
+from datetime import datetime
+from sqlalchemy import inspect, text
+from app import app, db
+from models import SchemaMigration, ScheduleLog
+
+# Versioned schema changes for existing databases (replaces the old fix_db_v*.py
+# and migrate_schedule_log.py scripts). New databases already get the full
+# schema from db.create_all(), so every step checks before it changes anything.
+# Usage: python migrate.py [--list]
+
+
+def column_exists(conn, table, column):
+    return column in {c['name'] for c in inspect(conn).get_columns(table)}
+
+def add_column(conn, table, column, ddl):
+    if not column_exists(conn, table, column):
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+
+def concurrently(conn):
+    # Postgres builds/drops indexes without blocking writes (needs an autocommit connection)
+    return ' CONCURRENTLY' if conn.dialect.name == 'postgresql' else ''
+
+def drop_index(conn, name):
+    conn.execute(text(f'DROP INDEX{concurrently(conn)} IF EXISTS "{name}"'))
+
+def drop_invalid_index(conn, name):
+    # An interrupted CREATE INDEX CONCURRENTLY leaves an invalid index behind that IF NOT EXISTS would keep
+    if conn.dialect.name == 'postgresql':
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"), {'name': name}).first()
+        if invalid:
+            drop_index(conn, name)
+
+def create_index(conn, table, name, columns, unique=False):
+    """
+    CREATE INDEX IF NOT EXISTS, CONCURRENTLY on Postgres. An invalid leftover
+    from an interrupted concurrent build is dropped and rebuilt.
+    """
+    drop_invalid_index(conn, name)
+    cols = ', '.join(f'"{c}"' for c in columns)
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    conn.execute(text(f'CREATE {kind}{concurrently(conn)} IF NOT EXISTS "{name}" ON "{table}" ({cols})'))
+
+
+def m001_user_role(conn):
+    add_column(conn, 'user', 'role', "VARCHAR(20) DEFAULT 'user'")
+
+def m002_user_location(conn):
+    add_column(conn, 'user', 'latitude', 'FLOAT')
+    add_column(conn, 'user', 'longitude', 'FLOAT')
+    add_column(conn, 'user', 'last_location_update', 'TIMESTAMP')
+
+def m003_local_ip(conn):
+    add_column(conn, 'user', 'local_ip', 'VARCHAR(100)')
+    add_column(conn, 'audit_log', 'local_ip', 'VARCHAR(100)')
+    if conn.dialect.name == 'postgresql':
+        # Columns added as VARCHAR(45) by the old scripts; SQLite doesn't enforce lengths
+        conn.execute(text('ALTER TABLE "user" ALTER COLUMN local_ip TYPE VARCHAR(100)'))
+        conn.execute(text('ALTER TABLE "audit_log" ALTER COLUMN local_ip TYPE VARCHAR(100)'))
+
+def m004_device_fingerprint(conn):
+    add_column(conn, 'user', 'device_fingerprint', 'VARCHAR(255)')
+
+def m005_ipv6(conn):
+    add_column(conn, 'user', 'ipv6_address', 'VARCHAR(45)')
+    add_column(conn, 'audit_log', 'ipv6_address', 'VARCHAR(45)')
+
+def m006_schedule_log_adhoc(conn):
+    add_column(conn, 'schedule_log', 'task', 'VARCHAR(100)')
+    add_column(conn, 'schedule_log', 'time', 'VARCHAR(20)')
+    add_column(conn, 'schedule_log', 'is_routine', 'BOOLEAN DEFAULT false')
+    routine_id = next(c for c in inspect(conn).get_columns('schedule_log') if c['name'] == 'routine_id')
+    if routine_id['nullable']:
+        return
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('ALTER TABLE schedule_log ALTER COLUMN routine_id DROP NOT NULL'))
+    else:
+        # SQLite can't drop NOT NULL; rebuild the table from the model
+        columns = ', '.join(c.name for c in ScheduleLog.__table__.columns)
+        conn.execute(text('ALTER TABLE schedule_log RENAME TO schedule_log_old'))
+        for index in ScheduleLog.__table__.indexes:
+            conn.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+        ScheduleLog.__table__.create(conn)
+        conn.execute(text(f'INSERT INTO schedule_log ({columns}) SELECT {columns} FROM schedule_log_old '
+                          'WHERE routine_id IS NULL OR id IN (SELECT MAX(id) FROM schedule_log_old GROUP BY routine_id, date)'))
+        conn.execute(text('DROP TABLE schedule_log_old'))
+
+HOT_PATH_INDEXES = [
+    ('schedule_log', 'ix_schedule_log_routine_date', ['routine_id', 'date']),
+    ('schedule_log', 'ix_schedule_log_user_date', ['user_id', 'date']),
+    ('habit_log', 'ix_habit_log_day', ['day_id']),
+    ('prayer_log', 'ix_prayer_log_day', ['day_id']),
+    ('schedule_log', 'ix_schedule_log_day', ['day_id']),
+    ('push_subscription', 'ix_push_subscription_endpoint', ['endpoint']),
+    ('audit_log', 'ix_audit_log_timestamp', ['timestamp']),
+    ('habit', 'ix_habit_user_paused', ['user_id', 'is_paused']),
+]
+
+def m007_hot_path_indexes(conn):
+    for table, name, columns in HOT_PATH_INDEXES:
+        create_index(conn, table, name, columns)
+
+def m008_unique_schedule_log(conn):
+    # toggle_routine upserts on (routine_id, date); keep the newest of any duplicates
+    conn.execute(text(
+        "DELETE FROM schedule_log WHERE routine_id IS NOT NULL AND id NOT IN "
+        "(SELECT MAX(id) FROM schedule_log WHERE routine_id IS NOT NULL GROUP BY routine_id, date)"))
+    create_index(conn, 'schedule_log', 'uq_schedule_log_routine_date', ['routine_id', 'date'], unique=True)
+    drop_index(conn, 'ix_schedule_log_routine_date')
+
+def m009_audit_log_record_id(conn):
+    add_column(conn, 'audit_log', 'record_id', 'VARCHAR(36)')
+    create_index(conn, 'audit_log', 'uq_audit_log_record_id', ['record_id'], unique=True)
+
+USER_SEARCH_SQLITE = [
+    # Substring search for the admin user list: trigram FTS5 over the user table, kept in sync by triggers
+    """CREATE VIRTUAL TABLE IF NOT EXISTS user_search
+       USING fts5(username, email, content='user', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_ai AFTER INSERT ON "user" BEGIN
+       INSERT INTO user_search(rowid, username, email) VALUES (new.id, new.username, new.email); END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_ad AFTER DELETE ON "user" BEGIN
+       INSERT INTO user_search(user_search, rowid, username, email) VALUES ('delete', old.id, old.username, old.email); END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_au AFTER UPDATE OF username, email ON "user" BEGIN
+       INSERT INTO user_search(user_search, rowid, username, email) VALUES ('delete', old.id, old.username, old.email);
+       INSERT INTO user_search(rowid, username, email) VALUES (new.id, new.username, new.email); END""",
+    "INSERT INTO user_search(user_search) VALUES ('rebuild')",
+]
+
+def m010_user_search_index(conn):
+    if conn.dialect.name == 'postgresql':
+        # pg_trgm GIN indexes serve ILIKE '%q%' directly
+        conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        for column in ('username', 'email'):
+            name = f'ix_user_{column}_trgm'
+            drop_invalid_index(conn, name)
+            conn.execute(text(f'CREATE INDEX{concurrently(conn)} IF NOT EXISTS "{name}" '
+                              f'ON "user" USING gin ({column} gin_trgm_ops)'))
+    else:
+        for statement in USER_SEARCH_SQLITE:
+            conn.execute(text(statement))
+
+def m011_upload_job_content_hash(conn):
+    add_column(conn, 'upload_job', 'content_hash', 'VARCHAR(64)')
+    create_index(conn, 'upload_job', 'ix_upload_job_hash', ['content_hash'])
+
+# (version, name, step, transactional). Non-transactional steps run on an
+# autocommit connection, as CREATE INDEX CONCURRENTLY requires on Postgres.
+MIGRATIONS = [
+    (1, 'user.role', m001_user_role, True),
+    (2, 'user location columns', m002_user_location, True),
+    (3, 'local_ip on user and audit_log', m003_local_ip, True),
+    (4, 'user.device_fingerprint', m004_device_fingerprint, True),
+    (5, 'ipv6_address on user and audit_log', m005_ipv6, True),
+    (6, 'schedule_log ad-hoc tasks', m006_schedule_log_adhoc, True),
+    (7, 'hot path indexes', m007_hot_path_indexes, False),
+    (8, 'unique schedule_log (routine_id, date)', m008_unique_schedule_log, False),
+    (9, 'audit_log.record_id', m009_audit_log_record_id, False),
+    (10, 'user search index', m010_user_search_index, False),
+    (11, 'upload_job.content_hash', m011_upload_job_content_hash, False),
+]
+
+
+def applied_versions(engine):
+    SchemaMigration.__table__.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(db.select(SchemaMigration.version))}
+
+def run_migrations(engine=None, log=print):
+    """Applies pending migrations in version order. Returns the versions applied."""
+    engine = engine or db.engine
+    done = applied_versions(engine)
+    applied = []
+    for version, name, step, transactional in MIGRATIONS:
+        if version in done:
+            continue
+        log(f"Applying {version:03d} {name}...")
+        record = db.insert(SchemaMigration).values(version=version, name=name, applied_at=datetime.utcnow())
+        if transactional:
+            with engine.begin() as conn:
+                step(conn)
+                conn.execute(record)
+        else:
+            with engine.connect() as conn:
+                conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+                step(conn)
+                conn.execute(record)
+        applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        if '--list' in sys.argv:
+            done = applied_versions(db.engine)
+            for version, name, _, _ in MIGRATIONS:
+                print(f"[{'x' if version in done else ' '}] {version:03d} {name}")
+        else:
+            applied = run_migrations()
+            print(f"Applied {len(applied)} migration(s)." if applied else "Database is up to date.")
@@ -63,13 +63,16 @@ class Habit(db.Model):
     
     logs = db.relationship('HabitLog', backref='habit', lazy=True, cascade="all, delete-orphan")
 
+    __table_args__ = (db.Index('ix_habit_user_paused', 'user_id', 'is_paused'),)
+
 class HabitLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
     status = db.Column(db.Boolean, default=False)
 
-    __table_args__ = (db.UniqueConstraint('habit_id', 'date', name='uq_habit_date'),)
+    __table_args__ = (db.UniqueConstraint('habit_id', 'date', name='uq_habit_date'),
+                      db.Index('ix_habit_log_day', 'day_id'))
     value_done = db.Column(db.Integer, default=0) # renaming value_current conceptually or aliasing
     quality = db.Column(db.Integer, default=2) # 1-3 (Poor, Avg, Good)
     points = db.Column(db.Integer, default=0) # Calculated points for this specific log
@@ -112,13 +115,18 @@ class ScheduleLog(db.Model):
     is_routine = db.Column(db.Boolean, default=False)
     day_id = db.Column(db.Integer, db.ForeignKey('day.id'), nullable=True)
 
+    __table_args__ = (db.Index('uq_schedule_log_routine_date', 'routine_id', 'date', unique=True),  # Ad-hoc rows have no routine_id
+                      db.Index('ix_schedule_log_user_date', 'user_id', 'date'),
+                      db.Index('ix_schedule_log_day', 'day_id'))
+
 class PrayerLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     day_id = db.Column(db.Integer, db.ForeignKey('day.id'), nullable=True)
     date = db.Column(db.Date, nullable=False)
 
-    __table_args__ = (db.UniqueConstraint('user_id', 'date', name='uq_user_prayer_date'),)
+    __table_args__ = (db.UniqueConstraint('user_id', 'date', name='uq_user_prayer_date'),
+                      db.Index('ix_prayer_log_day', 'day_id'))
     fajr = db.Column(db.Boolean, default=False)
     dhuhr = db.Column(db.Boolean, default=False)
     asr = db.Column(db.Boolean, default=False)
@@ -172,17 +180,147 @@ class PushSubscription(db.Model):
     # Check if subscription belongs to user
     user = db.relationship('User', backref='push_subscriptions')
 
+    __table_args__ = (db.Index('ix_push_subscription_endpoint', 'endpoint'),)
+
 # --- Audit Logging Model ---
 class AuditLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     admin_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Admin who performed action
     action = db.Column(db.String(100), nullable=False)  # e.g., 'view_user', 'ban_user', 'delete_user'
     target_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # User affected (if any)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     reason = db.Column(db.Text, nullable=True)  # Optional justification for access
     ip_address = db.Column(db.String(45), nullable=True)  # Store Public IPv4
     ipv6_address = db.Column(db.String(45), nullable=True) # Store Public IPv6
     local_ip = db.Column(db.String(100), nullable=True)   # Store discovered Local IP/Hostname
+    record_id = db.Column(db.String(36), nullable=True)  # Audit spool record id, so a replay inserts once
+
+    __table_args__ = (db.Index('uq_audit_log_record_id', 'record_id', unique=True),)
 
     admin = db.relationship('User', foreign_keys=[admin_id], backref='admin_actions')
     target_user = db.relationship('User', foreign_keys=[target_user_id], backref='targeted_actions')
+
+# --- External Lookup Cache ---
+class ExternalCache(db.Model):
+    """Parsed results of external lookups (Wikipedia, WikiShia, APIs), shared by all workers."""
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(50), nullable=False)  # e.g. 'wiki_month', 'onthisday'
+    key = db.Column(db.String(100), nullable=False)  # e.g. 'Rajab:15' or '3-21'
+    payload = db.Column(db.Text, nullable=True)  # JSON of the parsed result, or the error message
+    is_error = db.Column(db.Boolean, default=False)  # Negative cache entry
+    fetched_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('source', 'key', name='uq_external_cache_source_key'),)
+
+# --- Significance Index ---
+class DaySignificance(db.Model):
+    """Pre-built list of significant events for a Hijri or Gregorian (month, day)."""
+    id = db.Column(db.Integer, primary_key=True)
+    calendar = db.Column(db.String(10), nullable=False)  # 'hijri' or 'gregorian'
+    month = db.Column(db.Integer, nullable=False)  # 1-12
+    day = db.Column(db.Integer, nullable=False)  # 1-30 / 1-31
+    events = db.Column(db.Text, nullable=False, default='[]')  # JSON list of display strings
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('calendar', 'month', 'day', name='uq_significance_calendar_month_day'),)
+
+# --- Push Notification Outbox ---
+class PushOutbox(db.Model):
+    """One queued push per subscription, drained by push_worker.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    subscription_id = db.Column(db.Integer, db.ForeignKey('push_subscription.id'), nullable=True)  # Null once pruned
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON sent to the service worker
+    status = db.Column(db.String(20), default='pending')  # pending, sent, failed, gone
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    user = db.relationship('User', backref=db.backref('push_outbox', lazy=True, cascade="all, delete-orphan"))
+
+# --- Daily Rollup ---
+class DailyRollup(db.Model):
+    """Per user and date totals, kept current by the toggle endpoints (see backfill_rollups.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    habit_points = db.Column(db.Integer, default=0)  # Points of completed habits
+    prayer_points = db.Column(db.Integer, default=0)
+    schedule_points = db.Column(db.Integer, default=0)  # Points of completed routines
+    completed_habits = db.Column(db.Integer, default=0)
+    prayers_done = db.Column(db.Integer, default=0)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'date', name='uq_rollup_user_date'),)
+
+    user = db.relationship('User', backref=db.backref('rollups', lazy=True, cascade="all, delete-orphan"))
+
+# --- Habit Streaks ---
+class HabitStreak(db.Model):
+    """Cached streak state per habit, updated by toggle_habit (see rebuild_habit_streaks)."""
+    id = db.Column(db.Integer, primary_key=True)
+    habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), nullable=False, unique=True)
+    frequency = db.Column(db.String(20), default='Daily')  # Period this state was built for
+    current_streak = db.Column(db.Integer, default=0)  # Run ending at last_period
+    longest_streak = db.Column(db.Integer, default=0)
+    prior_longest = db.Column(db.Integer, default=0)  # Longest run before the current one
+    last_period = db.Column(db.Date, nullable=True)  # Start of the last completed day/week
+    anchor = db.Column(db.Date, nullable=True)  # Period that bit 0 of history refers to
+    history = db.Column(db.Integer, default=0)  # Bit i set = period (anchor - i) completed, last 30 periods
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    habit = db.relationship('Habit', backref=db.backref('streak', uselist=False, lazy=True, cascade="all, delete-orphan"))
+
+# --- Offline Sync ---
+class AppliedMutation(db.Model):
+    """Client mutation IDs already applied by /api/sync, so a replayed queue is applied once."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    mutation_id = db.Column(db.String(64), nullable=False)  # Generated by the client
+    status = db.Column(db.String(20), default='applied')  # applied, rejected
+    result = db.Column(db.Text, nullable=True)  # JSON returned again for duplicates
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'mutation_id', name='uq_applied_mutation_user_id'),)
+
+    user = db.relationship('User', backref=db.backref('applied_mutations', lazy=True, cascade="all, delete-orphan"))
+
+# --- Schedule Upload Jobs ---
+class UploadJob(db.Model):
+    """An uploaded schedule file waiting for (or done with) text extraction by upload_worker.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)  # As uploaded, for display
+    path = db.Column(db.String(500), nullable=False)  # Stored copy, named by content hash
+    content_hash = db.Column(db.String(64), nullable=True)  # SHA-256 of the file (UploadResult key)
+    status = db.Column(db.String(20), default='queued')  # queued, running, cancelling, done, failed, cancelled
+    text = db.Column(db.Text, nullable=True)  # Extracted text, shown on the review page
+    items = db.Column(db.Text, nullable=True)  # JSON from parse_schedule_items
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index('ix_upload_job_status', 'status', 'id'),
+                      db.Index('ix_upload_job_user_status', 'user_id', 'status'),
+                      db.Index('ix_upload_job_hash', 'content_hash'))
+
+    user = db.relationship('User', backref=db.backref('upload_jobs', lazy=True, cascade="all, delete-orphan"))
+
+class UploadResult(db.Model):
+    """Extraction result per file content, so the same routine uploaded again skips OCR/docx/xlsx work."""
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, unique=True)
+    text = db.Column(db.Text, nullable=False)
+    items = db.Column(db.Text, nullable=False)  # JSON from parse_schedule_items
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Swept after UPLOAD_RESULT_TTL days
+
+# --- Schema Migrations ---
+class SchemaMigration(db.Model):
+    """Versions from migrate.py that have been applied to this database."""
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
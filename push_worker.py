@@ -0,0 +1,25 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app import app, db, drain_push_outbox
+
+# Drains the PushOutbox table: sends queued pushes in parallel, retries
+# transient failures with backoff and prunes dead subscriptions.
+# Usage: python push_worker.py
+
+IDLE_SLEEP = 2  # Seconds to wait when nothing is due
+
+if __name__ == "__main__":
+    pool = ThreadPoolExecutor(max_workers=app.config['PUSH_MAX_WORKERS'], thread_name_prefix='push')
+    print("Push worker started.")
+    while True:
+        with app.app_context():
+            try:
+                metrics = drain_push_outbox(pool)
+            except Exception as e:
+                print(f"Push worker error: {e}")
+                db.session.rollback()
+                metrics = {'claimed': 0}
+        if metrics['claimed']:
+            print(f"Push batch: {metrics}")
+        else:
+            time.sleep(IDLE_SLEEP)
@@ -0,0 +1,12 @@
+import sys
+from app import app, rebuild_habit_streaks
+
+# Rebuilds the cached HabitStreak rows from the full habit log history.
+# Run once after deploying streaks, or any time they need repairing.
+# Usage: python rebuild_streaks.py [habit_id ...]
+
+if __name__ == "__main__":
+    habit_ids = [int(arg) for arg in sys.argv[1:]] or None
+    with app.app_context():
+        count = rebuild_habit_streaks(habit_ids)
+        print(f"Rebuilt streaks for {count} habit(s).")
@@ -0,0 +1,18 @@
+import sys
+from app import app, reconcile_day_scores
+
+# Recomputes every Day.total_score from the log tables and reports drift.
+# Usage: python reconcile_scores.py [--dry-run]
+
+if __name__ == "__main__":
+    dry_run = '--dry-run' in sys.argv
+    with app.app_context():
+        drift = reconcile_day_scores(fix=not dry_run)
+        for day_id, stored, expected in drift:
+            print(f"Day {day_id}: stored {stored}, expected {expected}")
+        if not drift:
+            print("All day scores are consistent.")
+        elif dry_run:
+            print(f"{len(drift)} day(s) drifted. Re-run without --dry-run to fix.")
+        else:
+            print(f"Fixed {len(drift)} day(s).")
@@ -0,0 +1,127 @@
+import heapq
+import time
+from datetime import datetime, timedelta
+from app import app, db, get_local_now, enqueue_pushes
+from models import Habit, HabitLog, PushSubscription, RoutineItem, Schedule
+
+# Sends reminders for today's routines (before they start) and an evening
+# nudge for unfinished habits, through the push outbox.
+# Usage: python reminder_worker.py
+
+# Weekly habits aren't nagged about every evening
+DAILY_HABIT = db.or_(Habit.frequency == None, Habit.frequency != 'Weekly')
+
+
+class ReminderEngine:
+    """
+    Precomputes the rest of the day's reminders for every subscribed user into a
+    time-ordered heap and sleeps until the next one is due, instead of polling
+    users. `clock` returns local (GMT+6) naive datetimes and `sleep` waits a
+    number of seconds; both can be swapped for a fake clock in tests.
+    """
+
+    def __init__(self, clock=get_local_now, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.lead = timedelta(minutes=app.config['REMINDER_LEAD_MINUTES'])
+        self.habit_time = datetime.strptime(app.config['REMINDER_HABIT_TIME'], '%H:%M').time()
+        self.batch_size = app.config['REMINDER_BATCH_SIZE']
+        self.replan_every = timedelta(minutes=app.config['REMINDER_REPLAN_MINUTES'])
+        self.heap = []
+        self.sent = set()  # Keys already handed off today
+        self.planned_for = None
+        self.next_plan_at = None
+
+    def plan(self, now):
+        """Rebuilds the heap with today's remaining reminders (two set-based queries)."""
+        today = now.date()
+        if today != self.planned_for:
+            self.sent = set()
+        subscribed = db.session.query(PushSubscription.user_id)
+        heap = []
+
+        routines = db.session.query(RoutineItem.id, RoutineItem.title, RoutineItem.start_time, RoutineItem.location, Schedule.user_id) \
+            .join(Schedule, RoutineItem.schedule_id == Schedule.id) \
+            .filter(Schedule.is_active == True, RoutineItem.day_of_week == today.strftime('%A'),
+                    Schedule.user_id.in_(subscribed)).all()
+        for item_id, title, start_time, location, user_id in routines:
+            starts_at = datetime.combine(today, start_time)
+            key = ('routine', item_id)
+            if starts_at <= now or key in self.sent:
+                continue
+            body = f"{title} starts at {start_time.strftime('%I:%M %p')}"
+            if location:
+                body += f" in {location}"
+            heap.append((max(starts_at - self.lead, now), key, user_id, "Upcoming", body))
+
+        # Whether habits are still open is checked when the nudge fires
+        habit_users = db.session.query(Habit.user_id) \
+            .filter(Habit.is_paused == False, DAILY_HABIT, Habit.user_id.in_(subscribed)) \
+            .distinct().all()
+        nudge_at = max(datetime.combine(today, self.habit_time), now)
+        for (user_id,) in habit_users:
+            key = ('habits', user_id)
+            if key not in self.sent:
+                heap.append((nudge_at, key, user_id, "Habits", None))
+
+        heapq.heapify(heap)
+        self.heap = heap
+        self.planned_for = today
+        next_midnight = datetime.combine(today + timedelta(days=1), datetime.min.time())
+        self.next_plan_at = min(now + self.replan_every, next_midnight)
+        db.session.rollback()  # End the read transaction so the next plan sees fresh data
+
+    def run_pending(self, now):
+        """Hands every reminder due by `now` to the push outbox in batches. Returns the number queued."""
+        queued = 0
+        while self.heap and self.heap[0][0] <= now:
+            batch = []
+            while self.heap and self.heap[0][0] <= now and len(batch) < self.batch_size:
+                batch.append(heapq.heappop(self.heap))
+            queued += self._dispatch(batch, now.date())
+        return queued
+
+    def _dispatch(self, batch, today):
+        habit_users = [user_id for _, (kind, _), user_id, _, _ in batch if kind == 'habits']
+        open_habits = {}
+        if habit_users:
+            open_habits = dict(db.session.query(Habit.user_id, db.func.count(Habit.id))
+                               .outerjoin(HabitLog, db.and_(HabitLog.habit_id == Habit.id, HabitLog.date == today, HabitLog.status == True))
+                               .filter(Habit.user_id.in_(habit_users), Habit.is_paused == False, DAILY_HABIT, HabitLog.id == None)
+                               .group_by(Habit.user_id).all())
+
+        messages = []
+        for _, key, user_id, title, body in batch:
+            self.sent.add(key)
+            if key[0] == 'habits':
+                remaining = open_habits.get(user_id, 0)
+                if not remaining:
+                    continue
+                body = f"{remaining} habit{'s' if remaining > 1 else ''} still open today. Keep your streak going!"
+            messages.append((user_id, title, body))
+        return enqueue_pushes(messages) if messages else 0
+
+    def seconds_until_next(self, now):
+        wake_at = self.next_plan_at
+        if self.heap:
+            wake_at = min(wake_at, self.heap[0][0])
+        return max(0, (wake_at - now).total_seconds())
+
+    def run(self, until=None):
+        """Plans, dispatches and sleeps until the next due reminder (or replan), forever or until `until`."""
+        while True:
+            now = self.clock()
+            if until and now >= until:
+                return
+            if self.planned_for != now.date() or now >= self.next_plan_at:
+                self.plan(now)
+            queued = self.run_pending(now)
+            if queued:
+                print(f"Queued {queued} reminder pushes.")
+            self.sleep(self.seconds_until_next(self.clock()))
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        print("Reminder worker started.")
+        ReminderEngine().run()
@@ -0,0 +1,38 @@
+import sys
+import time
+from datetime import datetime, timedelta
+from app import app, db, get_local_now, rollover_day, prune_applied_mutations
+
+# Pre-creates each new local day's Day and PrayerLog rows for recently active
+# users just after midnight (GMT+6), so the morning rush only reads them, and
+# forgets /api/sync mutation ids too old to be replayed.
+# Usage: python rollover_worker.py            (runs for today, then every midnight)
+#        python rollover_worker.py --once [YYYY-MM-DD]
+
+DELAY_AFTER_MIDNIGHT = 5  # Seconds, so the local date has surely changed
+
+
+def seconds_until_next_midnight(now):
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return (midnight - now).total_seconds() + DELAY_AFTER_MIDNIGHT
+
+def run_once(target_date):
+    with app.app_context():
+        try:
+            created = rollover_day(target_date)
+            print(f"Rollover for {target_date}: {created}")
+            print(f"Pruned {prune_applied_mutations()} synced mutation id(s)")
+        except Exception as e:
+            print(f"Rollover error for {target_date}: {e}")
+            db.session.rollback()
+
+
+if __name__ == "__main__":
+    if '--once' in sys.argv:
+        args = [a for a in sys.argv[1:] if a != '--once']
+        run_once(datetime.strptime(args[0], '%Y-%m-%d').date() if args else get_local_now().date())
+    else:
+        print("Rollover worker started.")
+        while True:
+            run_once(get_local_now().date())
+            time.sleep(seconds_until_next_midnight(get_local_now()))
@@ -1,7 +1,23 @@
 #!/bin/bash
 # Initialize DB
 echo "Initializing database..."
-python -c "from app import app, db; with app.app_context(): db.create_all()"
+python migrate.py
+
+# Start the push notification worker
+echo "Starting push worker..."
+python push_worker.py &
+
+# Pre-create each new day's rows just after midnight
+echo "Starting rollover worker..."
+python rollover_worker.py &
+
+# Start the reminder scheduler (queues pushes for the worker above)
+echo "Starting reminder worker..."
+python reminder_worker.py &
+
+# Extract uploaded schedules (OCR, Word, Excel) off the web workers
+echo "Starting upload worker..."
+python upload_worker.py &
 
 # Start Gunicorn
 echo "Starting Gunicorn..."
@@ -93,106 +93,191 @@ function showToast(message, type = 'success') {
     }, 3000);
 }
 
-// Global functions for inline onclick handlers
-window.toggleHabit = async function (id, btn) {
-    const originalContent = btn.innerHTML;
-    const isPrimary = btn.classList.contains('btn-primary');
+// Mutation batching: taps within BATCH_WINDOW_MS are sent to /api/sync
+// together, in order, and each caller gets its own op's result back. Every
+// mutation gets a client-generated id; the service worker keeps them in
+// IndexedDB while offline and replays them, and the server applies each id once.
+const BATCH_WINDOW_MS = 300;
+const BATCH_MAX_OPS = 100;
+let pendingOps = [];
+let batchTimer = null;
+
+function newMutationId() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+}
 
-    // Loading State
-    btn.disabled = true;
-    btn.innerHTML = `<span style="opacity:0.75">⏳</span>`;
+function queueMutation(op) {
+    return new Promise((resolve, reject) => {
+        pendingOps.push({ id: newMutationId(), at: Date.now(), op, resolve, reject });
+        if (pendingOps.length >= BATCH_MAX_OPS) {
+            flushMutations();
+        } else if (!batchTimer) {
+            batchTimer = setTimeout(flushMutations, BATCH_WINDOW_MS);
+        }
+    });
+}
+
+async function flushMutations() {
+    clearTimeout(batchTimer);
+    batchTimer = null;
+    const batch = pendingOps;
+    pendingOps = [];
+    if (!batch.length) return;
 
     try {
-        const res = await fetch(`/habit/toggle/${id}`, { method: 'POST' });
+        const res = await fetch('/api/sync', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ mutations: batch.map(({ id, at, op }) => ({ id, at, op })) }),
+            keepalive: true // Still delivered if the page is being closed
+        });
         const data = await res.json();
+        batch.forEach((entry, i) => {
+            const r = data.success ? data.results[i] : null;
+            if (!r) {
+                entry.resolve({ success: false, error: data.error });
+            } else if (r.status === 'queued') {
+                entry.resolve({ success: true, queued: true }); // Saved by the service worker
+            } else {
+                entry.resolve(r.result);
+            }
+        });
+    } catch (e) {
+        batch.forEach(entry => entry.reject(e));
+    }
+}
 
-        if (data.success) {
-            const isMultistep = data.target_value > 1;
+// Don't lose queued taps when the tab is hidden or closed
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') flushMutations();
+});
 
-            if (isMultistep) {
-                // Update counter if it exists
-                const counter = btn.parentElement.querySelector('span');
-                if (counter) {
-                    counter.textContent = `${data.value_done} / ${data.target_value}`;
-                }
+function requestReplay() {
+    if ('serviceWorker' in navigator && navigator.serviceWorker.controller) {
+        navigator.serviceWorker.controller.postMessage({ type: 'replay-mutations' });
+    }
+}
+
+if ('serviceWorker' in navigator) {
+    navigator.serviceWorker.addEventListener('message', (event) => {
+        if (event.data && event.data.type === 'mutations-synced') {
+            showToast(`Synced ${event.data.count} offline change(s).`, 'success');
+        }
+    });
+}
+window.addEventListener('online', requestReplay);
+window.addEventListener('load', requestReplay);
+
+function showQueuedToast() {
+    showToast("Saved offline. It will sync when you're back online.", 'success');
+}
+
+// Remembers how a button looks so an optimistic update can be undone
+function snapshotButton(btn) {
+    const counter = btn.parentElement.querySelector('span');
+    const saved = { html: btn.innerHTML, className: btn.className, style: btn.style.cssText, counter: counter && counter.textContent };
+    return () => {
+        btn.innerHTML = saved.html;
+        btn.className = saved.className;
+        btn.style.cssText = saved.style;
+        if (counter) counter.textContent = saved.counter;
+    };
+}
+
+function renderHabit(btn, state) {
+    if (state.target_value > 1) {
+        // Update counter if it exists
+        const counter = btn.parentElement.querySelector('span');
+        if (counter) {
+            counter.textContent = `${state.value_done} / ${state.target_value}`;
+        }
+        btn.textContent = state.new_status ? 'Target Hitted (Reset)' : '+1 Track';
+    } else {
+        btn.textContent = state.new_status ? 'Undo' : 'Mark Done';
+    }
+    btn.classList.toggle('btn-primary', !state.new_status);
+    btn.style.backgroundColor = state.new_status ? 'var(--secondary)' : '';
+}
+
+// What a tap will do, read from the current button and counter
+function predictHabitTap(btn) {
+    const counter = btn.parentElement.querySelector('span');
+    const match = counter && counter.textContent.match(/(\d+)\s*\/\s*(\d+)/);
+    if (match) {
+        const done = parseInt(match[1]), target = parseInt(match[2]);
+        const value = done >= target ? 0 : done + 1;
+        return { target_value: target, value_done: value, new_status: value >= target };
+    }
+    const isDone = !btn.classList.contains('btn-primary');
+    return { target_value: 1, value_done: isDone ? 0 : 1, new_status: !isDone };
+}
+
+// Global functions for inline onclick handlers
+window.toggleHabit = async function (id, btn) {
+    const revert = snapshotButton(btn);
 
+    // Optimistic UI update; the server's answer replaces it
+    renderHabit(btn, predictHabitTap(btn));
+
+    try {
+        const data = await queueMutation({ type: 'habit', id });
+
+        if (data.queued) {
+            showQueuedToast();
+        } else if (data.success) {
+            renderHabit(btn, data);
+            if (data.target_value > 1) {
                 if (data.new_status) {
-                    btn.classList.remove('btn-primary');
-                    btn.style.backgroundColor = 'var(--secondary)';
-                    btn.textContent = 'Target Hitted (Reset)';
                     showToast('Goal reached! Amazing work!', 'success');
+                } else if (data.value_done === 0) {
+                    showToast('Habit reset.', 'success');
                 } else {
-                    btn.classList.add('btn-primary');
-                    btn.style.backgroundColor = '';
-                    btn.textContent = '+1 Track';
-                    if (data.value_done === 0) {
-                        showToast('Habit reset.', 'success');
-                    } else {
-                        showToast(`Progress: ${data.value_done}/${data.target_value}`, 'success');
-                    }
+                    showToast(`Progress: ${data.value_done}/${data.target_value}`, 'success');
                 }
             } else {
-                // Simple Toggle
-                if (data.new_status) {
-                    btn.classList.remove('btn-primary');
-                    btn.style.backgroundColor = 'var(--secondary)';
-                    btn.textContent = 'Undo';
-                    showToast('Habit completed!', 'success');
-                } else {
-                    btn.classList.add('btn-primary');
-                    btn.style.backgroundColor = '';
-                    btn.textContent = 'Mark Done';
-                    showToast('Habit status reset.', 'success');
-                }
+                showToast(data.new_status ? 'Habit completed!' : 'Habit status reset.', 'success');
             }
         } else {
             showToast(data.error || 'Failed to update habit', 'error');
-            btn.innerHTML = originalContent;
+            revert();
         }
     } catch (e) {
         console.error(e);
         showToast('Network error occured', 'error');
-        btn.innerHTML = originalContent;
-    } finally {
-        btn.disabled = false;
+        revert();
     }
 };
 
+function renderRoutine(btn, done) {
+    btn.classList.toggle('btn-outline', !done);
+    btn.style.backgroundColor = done ? 'var(--secondary)' : '';
+    btn.style.color = done ? '#fff' : '';
+    btn.textContent = done ? '✅ Done' : 'Mark Done';
+}
+
 window.toggleRoutine = async function (id, btn) {
-    const originalContent = btn.innerHTML;
-    btn.disabled = true;
-    btn.innerHTML = `⏳`;
+    const revert = snapshotButton(btn);
+
+    // Optimistic UI update
+    renderRoutine(btn, btn.classList.contains('btn-outline'));
 
     try {
-        const res = await fetch(`/schedule/toggle/${id}`, { method: 'POST' });
-        const data = await res.json();
+        const data = await queueMutation({ type: 'routine', id });
 
-        if (data.success) {
-            if (data.new_status) {
-                // Done
-                btn.classList.remove('btn-outline');
-                btn.style.backgroundColor = 'var(--secondary)';
-                btn.style.color = '#fff';
-                btn.textContent = '✅ Done';
-                showToast('Routine marked as done.', 'success');
-            } else {
-                // Not Done
-                btn.classList.add('btn-outline');
-                btn.style.backgroundColor = '';
-                btn.style.color = '';
-                btn.textContent = 'Mark Done';
-                showToast('Routine status reset.', 'success');
-            }
+        if (data.queued) {
+            showQueuedToast();
+        } else if (data.success) {
+            renderRoutine(btn, data.new_status);
+            showToast(data.new_status ? 'Routine marked as done.' : 'Routine status reset.', 'success');
         } else {
             showToast(data.error || 'Error', 'error');
-            btn.innerHTML = originalContent;
+            revert();
         }
     } catch (e) {
         console.error(e);
         showToast('Network error', 'error');
-        btn.innerHTML = originalContent;
-    } finally {
-        btn.disabled = false;
+        revert();
     }
 };
 
@@ -204,14 +289,11 @@ window.togglePrayer = async function (prayerName, element) {
     element.classList.toggle('completed');
 
     try {
-        const res = await fetch('/prayers', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ prayer: prayerName, status: newStatus })
-        });
-        const data = await res.json();
+        const data = await queueMutation({ type: 'prayer', prayer: prayerName, status: newStatus });
 
-        if (data.success) {
+        if (data.queued) {
+            showQueuedToast();
+        } else if (data.success) {
             // Update score
             const scoreEl = document.getElementById('spiritual-score-display');
             if (scoreEl && data.score !== undefined) {
@@ -256,16 +338,11 @@ window.updateDayField = async function (field, value) {
     }
 
     try {
-        const res = await fetch('/api/day/update', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ [field]: value })
-        });
-        const data = await res.json();
+        const data = await queueMutation({ type: 'day', [field]: value });
 
         if (data.success) {
             if (statusEl) {
-                statusEl.textContent = 'Saved';
+                statusEl.textContent = data.queued ? 'Saved offline' : 'Saved';
                 statusEl.style.color = 'var(--success)';
                 setTimeout(() => {
                     statusEl.style.opacity = '0';
@@ -1,4 +1,4 @@
-const CACHE_NAME = 'habit-tracker-v1';
+const CACHE_NAME = 'habit-tracker-v3';
 const ASSETS = [
     '/',
     '/static/css/style.css',
@@ -33,8 +33,138 @@ self.addEventListener('activate', (event) => {
     self.clients.claim();
 });
 
+// Offline Mutation Queue: every /api/sync request is stored in IndexedDB first,
+// then the whole queue is replayed in order. Mutations carry client-generated ids,
+// so the server applies each one once however often it is replayed.
+const QUEUE_DB = 'habit-tracker-sync';
+const QUEUE_STORE = 'mutations';
+const SYNC_TAG = 'replay-mutations';
+const REPLAY_CHUNK = 100; // The server's per-request limit
+
+function openQueue() {
+    return new Promise((resolve, reject) => {
+        const req = indexedDB.open(QUEUE_DB, 1);
+        req.onupgradeneeded = () => req.result.createObjectStore(QUEUE_STORE, { keyPath: 'seq', autoIncrement: true });
+        req.onsuccess = () => resolve(req.result);
+        req.onerror = () => reject(req.error);
+    });
+}
+
+// Runs fn(store) in one transaction and resolves once it has committed
+async function withQueue(mode, fn) {
+    const db = await openQueue();
+    return new Promise((resolve, reject) => {
+        const tx = db.transaction(QUEUE_STORE, mode);
+        const result = fn(tx.objectStore(QUEUE_STORE));
+        tx.oncomplete = () => resolve(result && 'result' in result ? result.result : undefined);
+        tx.onerror = () => reject(tx.error);
+    });
+}
+
+function enqueueMutations(mutations) {
+    return withQueue('readwrite', (store) => mutations.forEach((m) => store.add(m)));
+}
+
+function readQueue() {
+    return withQueue('readonly', (store) => store.getAll()); // Ordered by seq
+}
+
+function dropFromQueue(entries) {
+    return withQueue('readwrite', (store) => entries.forEach((e) => store.delete(e.seq)));
+}
+
+// Sends the queue oldest first. Resolves to { results: {id: result}, score } once it
+// is empty, or null if the server can't be reached (the queue is kept for later).
+let replaying = Promise.resolve();
+function replayQueue() {
+    const run = replaying.then(async () => {
+        const results = {};
+        let score;
+        for (;;) {
+            const chunk = (await readQueue()).slice(0, REPLAY_CHUNK);
+            if (!chunk.length) return { results, score };
+            let res, data;
+            try {
+                res = await fetch('/api/sync', {
+                    method: 'POST',
+                    credentials: 'same-origin',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ mutations: chunk.map(({ seq, ...m }) => m) })
+                });
+                data = await res.json(); // A login page instead of JSON means: try again later
+            } catch (e) {
+                return null;
+            }
+            if (res.status === 400) {
+                await dropFromQueue(chunk); // Malformed; retrying would never succeed
+                continue;
+            }
+            if (!data.success) return null; // e.g. a conflict; replay again later
+            data.results.forEach((r) => { results[r.id] = r; });
+            score = data.score;
+            await dropFromQueue(chunk);
+        }
+    });
+    replaying = run.catch(() => null);
+    return run;
+}
+
+async function notifyClients(message) {
+    const windowClients = await clients.matchAll({ type: 'window' });
+    windowClients.forEach((client) => client.postMessage(message));
+}
+
+async function replayInBackground() {
+    const pending = (await readQueue()).length;
+    if (!pending) return;
+    const flushed = await replayQueue();
+    if (!flushed) throw new Error('Mutation replay failed'); // Lets Background Sync retry
+    await notifyClients({ type: 'mutations-synced', count: pending, score: flushed.score });
+}
+
+async function syncThroughQueue(request) {
+    const body = await request.json();
+    const mutations = Array.isArray(body.mutations) ? body.mutations : [];
+    await enqueueMutations(mutations);
+    const flushed = await replayQueue();
+    if (!flushed) {
+        if (self.registration.sync) {
+            self.registration.sync.register(SYNC_TAG).catch(() => {});
+        }
+        return Response.json({
+            success: true,
+            queued: true,
+            results: mutations.map((m) => ({ id: m.id, status: 'queued' }))
+        }, { status: 202 });
+    }
+    return Response.json({
+        success: true,
+        results: mutations.map((m) => flushed.results[m.id] || { id: m.id, status: 'queued' }),
+        score: flushed.score
+    });
+}
+
+self.addEventListener('sync', (event) => {
+    if (event.tag === SYNC_TAG) {
+        event.waitUntil(replayInBackground());
+    }
+});
+
+// Pages ask for a replay when they load or come back online (for browsers without Background Sync)
+self.addEventListener('message', (event) => {
+    if (event.data && event.data.type === 'replay-mutations') {
+        event.waitUntil(replayInBackground().catch(() => {}));
+    }
+});
+
 // Fetch Event: Stale-While-Revalidate Strategy
 self.addEventListener('fetch', (event) => {
+    const url = new URL(event.request.url);
+    if (event.request.method === 'POST' && url.origin === self.location.origin && url.pathname === '/api/sync') {
+        event.respondWith(syncThroughQueue(event.request));
+        return;
+    }
+
     // Skip non-GET requests or external API calls (e.g., ipify, aladhan)
     if (event.request.method !== 'GET' || !event.request.url.startsWith(self.location.origin)) {
         return;
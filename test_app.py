@@ -1,12 +1,50 @@
+import os
+import tempfile
 import unittest
-from app import app, db, User, Habit, Schedule, RoutineItem
+# Before app is imported: its engine is created from DATABASE_URL at import time
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.sqlite3')
+from app import (app, db, User, Habit, HabitLog, Schedule, RoutineItem, ScheduleLog, PrayerLog, Day, ExternalCache, DaySignificance,
+                 PushSubscription, PushOutbox, DailyRollup, HabitStreak, get_today, reconcile_day_scores, build_significance_index,
+                 drain_push_outbox, send_push_notification, backfill_rollups, drain_upload_jobs, UploadJob,
+                 preprocess_for_ocr, deskew_angle, UploadResult, sweep_uploads, iter_upload_lines, run_upload_job, upload_limits,
+                 rebuild_habit_streaks, streak_summary, ensure_day, get_or_insert, rollover_day,
+                 user_cache, bump_user_cache_stamp, telemetry, audit_spool, AuditLog, IslamicEvent, record_audit)
+from pywebpush import WebPushException
+from reminder_worker import ReminderEngine
+from migrate import run_migrations
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from datetime import date, time
+from sqlalchemy import event
+from flask import g
+from flask_login import login_user
+from sqlalchemy.exc import IntegrityError
+from PIL import Image, ImageChops, ImageDraw
+from unittest import mock
+import io
+import json
+import re
+import threading
+import zipfile
+import openpyxl
+import time as _time
+import requests
+
+Query = namedtuple('Query', 'statement parameters executemany')
 
 class HabitTrackerTestCase(unittest.TestCase):
     def setUp(self):
         app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
         app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        app.config['SIGNIFICANCE_BACKGROUND_REFRESH'] = False  # No live scraping in tests
+        app.config['USER_CACHE_STAMP'] = os.path.join(tempfile.gettempdir(), 'habit-test-user-cache.stamp')
+        user_cache.clear()  # Ids are reused from test to test
+        app.config['TELEMETRY_FLUSH_INTERVAL'] = 3600  # Tests flush explicitly
+        app.config['AUDIT_FLUSH_INTERVAL'] = 3600
+        app.config['AUDIT_SPOOL_DIR'] = tempfile.mkdtemp()
+        app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
         self.app = app.test_client()
         self.app_context = app.app_context()
         self.app_context.push()
@@ -25,6 +63,8 @@ class HabitTrackerTestCase(unittest.TestCase):
         db.session.commit()
 
     def tearDown(self):
+        telemetry.flush()
+        audit_spool.flush()
         db.session.remove()
         db.drop_all()
         self.app_context.pop()
@@ -136,5 +176,1114 @@ class HabitTrackerTestCase(unittest.TestCase):
         
         # Toggle Routine
 
+    @contextmanager
+    def captured_queries(self):
+        """Yields a list that collects every statement run on the engine inside the block, as Query tuples."""
+        queries = []
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            queries.append(Query(statement, parameters, executemany))
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield queries
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    def add_habits_with_logs(self, count, day_id=None):
+        today = get_today()
+        for i in range(count):
+            habit = Habit(name=f'Habit {i}', user_id=self.user.id)
+            db.session.add(habit)
+            db.session.flush()
+            db.session.add(HabitLog(habit_id=habit.id, date=today, status=True, points=10, day_id=day_id))
+        db.session.commit()
+
+    def test_dashboard_query_count_is_constant(self):
+        self.login('testuser', 'password')
+        self.app.get('/dashboard')  # first visit creates today's Day and PrayerLog rows
+
+        self.add_habits_with_logs(2)
+        self.app.get('/dashboard')  # links the new logs to today's Day
+        with self.captured_queries() as few:
+            self.app.get('/dashboard')
+
+        self.add_habits_with_logs(15)
+        self.app.get('/dashboard')
+        with self.captured_queries() as many:
+            self.app.get('/dashboard')
+        self.assertEqual(len(few), len(many))
+
+    def test_dashboard_links_orphan_logs_in_bulk(self):
+        self.login('testuser', 'password')
+        self.app.get('/dashboard')
+        self.add_habits_with_logs(3)
+        with self.captured_queries() as small:
+            self.app.get('/dashboard')
+        self.add_habits_with_logs(12)
+        with self.captured_queries() as large:
+            self.app.get('/dashboard')
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(HabitLog.query.filter(HabitLog.day_id == None).count(), 0)
+
+    def test_day_score_follows_toggles(self):
+        self.login('testuser', 'password')
+        habit = Habit(name='Read', user_id=self.user.id, points=30)
+        multi = Habit(name='Pushups', user_id=self.user.id, points=30, target_value=3)
+        schedule = Schedule(name='Term', user_id=self.user.id)
+        db.session.add_all([habit, multi, schedule])
+        db.session.commit()
+        item = RoutineItem(schedule_id=schedule.id, title='Math', day_of_week='Monday',
+                           start_time=time(10, 0), end_time=time(11, 0))
+        db.session.add(item)
+        db.session.commit()
+
+        def score():
+            return Day.query.filter_by(user_id=self.user.id, date=get_today()).first().total_score
+
+        self.app.post(f'/habit/toggle/{habit.id}')
+        self.assertEqual(score(), 30)
+        self.app.post(f'/habit/toggle/{multi.id}')
+        self.app.post(f'/habit/toggle/{multi.id}')
+        self.assertEqual(score(), 50)
+        self.app.post(f'/schedule/toggle/{item.id}')
+        self.assertEqual(score(), 60)
+        self.app.post('/prayers', json={'prayer': 'fajr', 'status': True})
+        self.assertEqual(score(), 160)
+        self.app.post(f'/habit/toggle/{habit.id}')
+        self.app.post(f'/schedule/toggle/{item.id}')
+        self.app.post('/prayers', json={'prayer': 'fajr', 'status': False})
+        self.assertEqual(score(), 20)
+        self.assertEqual(reconcile_day_scores(), [])
+
+    def test_reconcile_day_scores_fixes_drift(self):
+        self.login('testuser', 'password')
+        habit = Habit(name='Read', user_id=self.user.id, points=30)
+        db.session.add(habit)
+        db.session.commit()
+        self.app.post(f'/habit/toggle/{habit.id}')
+        day = Day.query.filter_by(user_id=self.user.id).first()
+        day.total_score = 999
+        db.session.commit()
+
+        self.assertEqual(reconcile_day_scores(fix=False), [(day.id, 999, 30)])
+        self.assertEqual(reconcile_day_scores(), [(day.id, 999, 30)])
+        db.session.refresh(day)
+        self.assertEqual(day.total_score, 30)
+        self.assertEqual(reconcile_day_scores(), [])
+
+    # Saved pages for the day-details sources, keyed by a URL fragment
+    PAGE_FIXTURES = {
+        'onthisday.com/day/january/4': '<ul><li class="event">1969 Moon landing</li></ul>',
+        'wikipedia.org/wiki/Rajab': '<div id="mw-content-text"><ul><li>15 Rajab - Change of the Qibla</li></ul></div>',
+    }
+
+    def fixture_soup(self, url):
+        from bs4 import BeautifulSoup
+        for fragment, html in self.PAGE_FIXTURES.items():
+            if url.endswith(fragment):
+                return BeautifulSoup(html, 'html.parser')
+        raise requests.HTTPError('404')
+
+    def fake_get(self, url, **kwargs):
+        response = mock.Mock(status_code=200, ok=True)
+        if 'alquran' in url:
+            response.json.return_value = {'data': [
+                {'text': 'Arabic', 'surah': {'englishName': 'Al-Fatiha'}, 'numberInSurah': 1},
+                {'text': 'English'}
+            ]}
+        elif 'hadith' in url:
+            response.json.return_value = {'data': {'hadiths': [{'english': 'Deeds are by intentions', 'hadithNumber': 1}]}}
+        else:
+            response.content = self.fixture_soup(url).encode()
+        return response
+
+    def test_significance_index_serves_day_details(self):
+        self.login('testuser', 'password')
+        # Every Hijri day, plus the one Gregorian day that has a saved page
+        self.assertEqual(build_significance_index(get_soup=self.fixture_soup), 12 * 30 + 1)
+        rajab_15 = json.loads(DaySignificance.query.filter_by(calendar='hijri', month=7, day=15).first().events)
+        self.assertIn('📜 15 Rajab - Change of the Qibla', rajab_15)
+        self.assertIn('🕌 Change of the Qibla from Jerusalem to Mecca (2 AH)', rajab_15)
+
+        with mock.patch('app.requests.get', side_effect=self.fake_get) as get:
+            rv = self.app.get('/api/day_details?date=2026-01-04')  # 15 Rajab 1447
+            significance = rv.get_json()['significance']
+            self.assertIn('1969 Moon landing', significance)
+            self.assertIn('📜 15 Rajab - Change of the Qibla', significance)
+            self.assertEqual(rv.get_json()['sources']['hijri_index'], 'ok')
+            # Only the reflection APIs are live
+            called = [c.args[0] for c in get.call_args_list]
+            self.assertFalse([url for url in called if 'wiki' in url or 'onthisday' in url])
+
+    def test_significance_missing_entry_refreshed_in_background(self):
+        self.login('testuser', 'password')
+        app.config['SIGNIFICANCE_BACKGROUND_REFRESH'] = True
+        try:
+            with mock.patch('app.requests.get', side_effect=self.fake_get):
+                rv = self.app.get('/api/day_details?date=2026-01-04')
+                self.assertEqual(rv.get_json()['sources']['gregorian_index'], 'missing')
+                for _ in range(50):
+                    if DaySignificance.query.count() == 2:
+                        break
+                    _time.sleep(0.05)
+                rv = self.app.get('/api/day_details?date=2026-01-04')
+                self.assertEqual(rv.get_json()['sources']['gregorian_index'], 'ok')
+                self.assertIn('1969 Moon landing', rv.get_json()['significance'])
+        finally:
+            app.config['SIGNIFICANCE_BACKGROUND_REFRESH'] = False
+
+    def test_recurring_event_changes_update_the_index(self):
+        admin = User(username='admin', email='admin@example.com', role='admin')
+        admin.set_password('password')
+        db.session.add(admin)
+        db.session.commit()
+        self.login('admin', 'password')
+        build_significance_index(get_soup=self.fixture_soup)
+
+        def rajab_15():
+            return json.loads(DaySignificance.query.filter_by(calendar='hijri', month=7, day=15).one().events)
+
+        self.app.post('/admin/content/events/add', data={
+            'title': 'Founders Day', 'date': '2026-01-04', 'color': '#10b981', 'is_recurring_hijri': '1'})
+        events = rajab_15()
+        self.assertIn('🕌 Founders Day', events)
+        self.assertIn('📜 15 Rajab - Change of the Qibla', events)  # Fetched events are kept
+
+        with mock.patch('app.requests.get', side_effect=self.fake_get):
+            significance = self.app.get('/api/day_details?date=2026-01-04').get_json()['significance']
+        self.assertIn('🕌 Founders Day', significance)
+
+        event = IslamicEvent.query.filter_by(title='Founders Day').one()
+        self.app.post(f'/admin/content/events/delete/{event.id}')
+        events = rajab_15()
+        self.assertNotIn('🕌 Founders Day', events)
+        self.assertIn('📜 15 Rajab - Change of the Qibla', events)
+
+    def test_day_details_cached_across_requests(self):
+        self.login('testuser', 'password')
+        with mock.patch('app.requests.get', side_effect=self.fake_get) as get:
+            rv = self.app.get('/api/day_details?date=2026-01-04')
+            self.assertEqual(rv.status_code, 200)
+            cold_calls = get.call_count
+            self.assertGreater(cold_calls, 0)
+
+            rv = self.app.get('/api/day_details?date=2026-01-04')
+            self.assertEqual(rv.status_code, 200)
+            self.assertEqual(rv.get_json()['reflection']['reference'], 'Quran Al-Fatiha:1')
+            self.assertEqual(rv.get_json()['sources']['quran'], 'cached')
+            self.assertEqual(get.call_count, cold_calls)
+
+    def test_day_details_failures_are_negatively_cached(self):
+        self.login('testuser', 'password')
+        with mock.patch('app.requests.get', side_effect=requests.ConnectionError('offline')) as get:
+            rv = self.app.get('/api/day_details?date=2026-01-04')
+            self.assertEqual(rv.status_code, 200)
+            self.assertEqual(rv.get_json()['sources']['quran'], 'error')
+            cold_calls = get.call_count
+
+            self.app.get('/api/day_details?date=2026-01-04')
+            self.assertEqual(get.call_count, cold_calls)
+
+    def test_day_details_returns_partial_results_at_deadline(self):
+        self.login('testuser', 'password')
+        release = threading.Event()
+
+        def slow_get(url, **kwargs):
+            if 'alquran' in url:
+                release.wait(5)
+            else:
+                _time.sleep(0.2)
+            return self.fake_get(url, **kwargs)
+
+        default_deadline = app.config['DAY_DETAILS_DEADLINE']
+        app.config['DAY_DETAILS_DEADLINE'] = 0.6
+        try:
+            with mock.patch('app.requests.get', side_effect=slow_get):
+                started = _time.monotonic()
+                rv = self.app.get('/api/day_details?date=2026-01-04')
+                elapsed = _time.monotonic() - started
+                release.set()
+
+                # The stuck lookup was cut off, the other one still answered
+                self.assertLess(elapsed, 1.5)
+                sources = rv.get_json()['sources']
+                self.assertEqual(sources['quran'], 'timeout')
+                self.assertEqual(sources['hadith'], 'ok')
+
+                # The late answer still lands in the cache for the next click
+                for _ in range(50):
+                    if ExternalCache.query.filter_by(source='quran_ayah').count():
+                        break
+                    _time.sleep(0.05)
+                self.assertEqual(ExternalCache.query.filter_by(source='quran_ayah').count(), 1)
+        finally:
+            app.config['DAY_DETAILS_DEADLINE'] = default_deadline
+
+    def test_test_push_only_enqueues(self):
+        self.login('testuser', 'password')
+        db.session.add_all([PushSubscription(user_id=self.user.id, endpoint=f'https://push.example/{i}', p256dh='k', auth='a')
+                            for i in range(2)])
+        db.session.commit()
+        with mock.patch('app.webpush') as webpush:
+            rv = self.app.post('/test_push')
+            self.assertEqual(rv.get_json(), {'status': 'queued', 'queued': 2})
+            webpush.assert_not_called()
+        self.assertEqual(PushOutbox.query.filter_by(status='pending').count(), 2)
+
+    def test_drain_push_outbox_retries_and_prunes(self):
+        endpoints = ['https://push.example/ok', 'https://push.example/gone', 'https://push.example/busy']
+        db.session.add_all([PushSubscription(user_id=self.user.id, endpoint=e, p256dh='k', auth='a') for e in endpoints])
+        db.session.commit()
+        send_push_notification(self.user.id, 'Time to read')
+
+        def fake_webpush(subscription_info, **kwargs):
+            endpoint = subscription_info['endpoint']
+            if endpoint.endswith('gone'):
+                raise WebPushException('Gone', response=mock.Mock(status_code=410))
+            if endpoint.endswith('busy'):
+                raise WebPushException('Busy', response=mock.Mock(status_code=503))
+
+        pool = ThreadPoolExecutor(max_workers=4)
+        now = datetime.utcnow()
+        with mock.patch('app.webpush', side_effect=fake_webpush):
+            metrics = drain_push_outbox(pool, now=now)
+            self.assertEqual((metrics['sent'], metrics['retried'], metrics['pruned']), (1, 1, 1))
+            self.assertEqual(PushSubscription.query.count(), 2)
+
+            # The retry waits for its backoff
+            self.assertEqual(drain_push_outbox(pool, now=now)['claimed'], 0)
+            metrics = drain_push_outbox(pool, now=now + timedelta(hours=1))
+            self.assertEqual(metrics['claimed'], 1)
+        busy = PushOutbox.query.filter_by(status='pending').one()
+        self.assertEqual(busy.attempts, 2)
+        self.assertEqual(PushOutbox.query.filter_by(status='sent').count(), 1)
+        self.assertEqual(PushOutbox.query.filter_by(status='gone').count(), 1)
+        pool.shutdown()
+
+    def test_reminder_engine_wakes_only_when_due(self):
+        db.session.add(PushSubscription(user_id=self.user.id, endpoint='https://push.example/1', p256dh='k', auth='a'))
+        schedule = Schedule(name='Term', user_id=self.user.id)
+        db.session.add_all([schedule, Habit(name='Read', user_id=self.user.id)])
+        db.session.commit()
+        db.session.add(RoutineItem(schedule_id=schedule.id, title='Math 101', day_of_week='Monday',
+                                   start_time=time(10, 0), end_time=time(11, 0), location='Room 101'))
+        db.session.commit()
+
+        clock = {'now': datetime(2026, 1, 5, 8, 0)}  # A Monday, local time
+        waits = []
+        def fake_sleep(seconds):
+            waits.append(seconds)
+            clock['now'] += timedelta(seconds=seconds)
+
+        engine = ReminderEngine(clock=lambda: clock['now'], sleep=fake_sleep)
+        engine.run(until=datetime(2026, 1, 5, 9, 55))
+        # Woke for replans and for the 09:50 reminder, never minute by minute
+        self.assertLessEqual(len(waits), 5)
+        payloads = [json.loads(p.payload) for p in PushOutbox.query.all()]
+        self.assertEqual([p['body'] for p in payloads], ['Math 101 starts at 10:00 AM in Room 101'])
+
+        engine.run(until=datetime(2026, 1, 5, 20, 1))
+        self.assertEqual(PushOutbox.query.count(), 2)
+
+        pool = ThreadPoolExecutor(max_workers=2)
+        with mock.patch('app.webpush') as webpush:
+            drain_push_outbox(pool)
+            self.assertEqual(webpush.call_count, 2)
+            bodies = [json.loads(c.kwargs['data'])['body'] for c in webpush.call_args_list]
+            self.assertIn('1 habit still open today. Keep your streak going!', bodies)
+        pool.shutdown()
+
+    def test_reminder_engine_skips_finished_habits(self):
+        db.session.add(PushSubscription(user_id=self.user.id, endpoint='https://push.example/1', p256dh='k', auth='a'))
+        habit = Habit(name='Read', user_id=self.user.id)
+        db.session.add(habit)
+        db.session.commit()
+        db.session.add(HabitLog(habit_id=habit.id, date=date(2026, 1, 5), status=True))
+        db.session.commit()
+
+        clock = {'now': datetime(2026, 1, 5, 19, 0)}
+        def fake_sleep(seconds):
+            clock['now'] += timedelta(seconds=seconds)
+        ReminderEngine(clock=lambda: clock['now'], sleep=fake_sleep).run(until=datetime(2026, 1, 5, 21, 0))
+        self.assertEqual(PushOutbox.query.count(), 0)
+
+    def test_analytics_data_matches_logs(self):
+        self.login('testuser', 'password')
+        today = get_today()
+        habit = Habit(name='Read', user_id=self.user.id, points=25)
+        db.session.add(habit)
+        db.session.commit()
+        db.session.add_all([
+            HabitLog(habit_id=habit.id, date=today, status=True, points=25),
+            HabitLog(habit_id=habit.id, date=today - timedelta(days=2), status=False),
+            PrayerLog(user_id=self.user.id, date=today - timedelta(days=1), spiritual_score=300),
+            ScheduleLog(user_id=self.user.id, date=today, status=True, points=10),
+        ])
+        db.session.commit()
+        backfill_rollups()
+
+        data = self.app.get('/api/analytics_data?days=3').get_json()
+        self.assertEqual(data['habit_scores'], [0, 0, 25])
+        self.assertEqual(data['prayer_scores'], [0, 300, 0])
+        self.assertEqual(data['total_scores'], [0, 300, 35])
+        self.assertEqual(data['labels'][-1], today.strftime('%b %d'))
+
+    def test_analytics_data_queries_are_constant_over_years(self):
+        # Seed two years of a heavy user: 20 habits done every day plus prayers
+        self.login('testuser', 'password')
+        today = get_today()
+        habits = [Habit(name=f'Habit {i}', user_id=self.user.id, points=10) for i in range(20)]
+        db.session.add_all(habits)
+        db.session.commit()
+        span = 730
+        PrayerLog.query.delete()  # Drop the one the dashboard created at login
+        db.session.execute(db.insert(HabitLog), [
+            {'habit_id': h.id, 'date': today - timedelta(days=d), 'status': True, 'points': 10}
+            for h in habits for d in range(span)
+        ])
+        db.session.execute(db.insert(PrayerLog), [
+            {'user_id': self.user.id, 'date': today - timedelta(days=d), 'spiritual_score': 500} for d in range(span)
+        ])
+        db.session.commit()
+        backfill_rollups()
+
+        self.app.get('/api/analytics_data?days=7')
+        with self.captured_queries() as short:
+            self.app.get('/api/analytics_data?days=30')
+        with self.captured_queries() as long:
+            rv = self.app.get(f'/api/analytics_data?days={span}')
+
+        # Timings are in benchmark_analytics.py
+        data = rv.get_json()
+        self.assertEqual(len(data['total_scores']), span)
+        self.assertEqual(data['summary']['total_all_time'], span * (20 * 10 + 500))
+        self.assertEqual(len(short), len(long))
+
+    def test_rollup_follows_toggles_and_matches_backfill(self):
+        self.login('testuser', 'password')
+        today = get_today()
+        habit = Habit(name='Read', user_id=self.user.id, points=30)
+        multi = Habit(name='Pushups', user_id=self.user.id, points=30, target_value=3)
+        schedule = Schedule(name='Term', user_id=self.user.id)
+        db.session.add_all([habit, multi, schedule])
+        db.session.commit()
+        item = RoutineItem(schedule_id=schedule.id, title='Math', day_of_week='Monday',
+                           start_time=time(10, 0), end_time=time(11, 0))
+        db.session.add(item)
+        db.session.commit()
+
+        self.app.post(f'/habit/toggle/{habit.id}')
+        for _ in range(3):
+            self.app.post(f'/habit/toggle/{multi.id}')
+        self.app.post(f'/schedule/toggle/{item.id}')
+        self.app.post('/prayers', json={'prayer': 'fajr', 'status': True})
+        self.app.post('/prayers', json={'prayer': 'isha', 'status': True})
+        self.app.post('/prayers', json={'prayer': 'isha', 'status': False})
+        self.app.post(f'/habit/toggle/{habit.id}')
+
+        def snapshot():
+            r = DailyRollup.query.filter_by(user_id=self.user.id, date=today).one()
+            return (r.habit_points, r.prayer_points, r.schedule_points, r.completed_habits, r.prayers_done)
+
+        live = snapshot()
+        self.assertEqual(live, (30, 100, 10, 1, 1))
+        backfill_rollups()
+        db.session.expire_all()
+        self.assertEqual(snapshot(), live)
+
+    def test_streak_reads_rollup(self):
+        self.login('testuser', 'password')
+        today = get_today()
+        db.session.add_all([DailyRollup(user_id=self.user.id, date=today - timedelta(days=d), completed_habits=1)
+                            for d in (1, 2, 3, 5)])
+        db.session.commit()
+        summary = self.app.get('/api/analytics_data?days=7').get_json()['summary']
+        self.assertEqual(summary['current_streak'], 3)  # Today isn't over yet
+
+    def streak_fields(self, habit_id):
+        s = HabitStreak.query.filter_by(habit_id=habit_id).one()
+        return (s.current_streak, s.longest_streak, s.last_period, s.anchor, s.history)
+
+    def test_streaks_follow_toggles_and_match_rebuild(self):
+        self.login('testuser', 'password')
+        habit = Habit(name='Read', user_id=self.user.id, created_at=datetime(2026, 1, 1))
+        db.session.add(habit)
+        db.session.commit()
+        start = date(2026, 1, 5)
+
+        def toggle_on(day):
+            with mock.patch('app.get_today', return_value=day):
+                self.app.post(f'/habit/toggle/{habit.id}')
+
+        for d in range(3):
+            toggle_on(start + timedelta(days=d))
+        toggle_on(start + timedelta(days=2))  # Undo today
+        db.session.expire_all()
+        summary = streak_summary(HabitStreak.query.filter_by(habit_id=habit.id).one(), habit, start + timedelta(days=2))
+        self.assertEqual((summary['current_streak'], summary['longest_streak']), (2, 2))
+        toggle_on(start + timedelta(days=2))
+        toggle_on(start + timedelta(days=4))  # Missed day 3
+        db.session.expire_all()
+        live = self.streak_fields(habit.id)
+        self.assertEqual(live[:2], (1, 3))
+
+        rebuild_habit_streaks()
+        db.session.expire_all()
+        self.assertEqual(self.streak_fields(habit.id), live)
+        summary = streak_summary(HabitStreak.query.filter_by(habit_id=habit.id).one(), habit, start + timedelta(days=6))
+        self.assertEqual(summary['current_streak'], 0)  # A full day missed since
+        self.assertEqual(summary['rate_7'], round(4 / 7, 2))
+
+        habit.is_paused = True
+        db.session.commit()
+        summary = streak_summary(HabitStreak.query.filter_by(habit_id=habit.id).one(), habit, start + timedelta(days=6))
+        self.assertEqual(summary['current_streak'], 1)  # Frozen while paused
+
+    def test_weekly_streak_counts_weeks(self):
+        self.login('testuser', 'password')
+        habit = Habit(name='Long run', user_id=self.user.id, frequency='Weekly', created_at=datetime(2026, 1, 1))
+        db.session.add(habit)
+        db.session.commit()
+        monday = date(2026, 1, 5)
+        for day in (monday, monday + timedelta(days=2), monday + timedelta(days=9), monday + timedelta(days=2)):
+            with mock.patch('app.get_today', return_value=day):
+                self.app.post(f'/habit/toggle/{habit.id}')
+        db.session.expire_all()
+        # Undoing Wednesday of week one leaves Monday, so both weeks still count
+        state = HabitStreak.query.filter_by(habit_id=habit.id).one()
+        self.assertEqual((state.current_streak, state.longest_streak), (2, 2))
+        data = self.app.get('/api/analytics_data?days=7').get_json()
+        self.assertEqual(data['habits'][0]['longest_streak'], 2)
+
+    def test_hot_queries_use_indexes(self):
+        run_migrations(log=lambda message: None)  # Indexes for a database created before them
+        self.login('testuser', 'password')
+        today = get_today()
+        habit = Habit(name='Read', user_id=self.user.id)
+        schedule = Schedule(name='Term', user_id=self.user.id)
+        db.session.add_all([habit, schedule])
+        db.session.commit()
+        item = RoutineItem(schedule_id=schedule.id, title='Math', day_of_week=today.strftime('%A'),
+                           start_time=time(10, 0), end_time=time(11, 0))
+        db.session.add(item)
+        db.session.commit()
+
+        with self.captured_queries() as queries:
+            self.app.get('/dashboard')
+            self.app.post(f'/habit/toggle/{habit.id}')
+            self.app.post(f'/schedule/toggle/{item.id}')
+            self.app.get('/api/analytics_data?days=30')
+
+        hot_tables = {'habit', 'habit_log', 'schedule_log', 'prayer_log', 'day', 'daily_rollup', 'habit_streak'}
+        with db.engine.connect() as conn:
+            for statement, parameters, executemany in queries:
+                if executemany or not statement.lstrip().upper().startswith(('SELECT', 'UPDATE')):
+                    continue
+                for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters):
+                    detail = row[-1].split()
+                    if detail[0] == 'SCAN':
+                        self.assertNotIn(detail[1], hot_tables, f"{row[-1]} in: {statement}")
+
+    def test_upserts_survive_concurrent_creation(self):
+        habit = Habit(name='Read', user_id=self.user.id)
+        db.session.add(habit)
+        db.session.commit()
+        user_id, habit_id, day = self.user.id, habit.id, date(2026, 3, 1)
+        threads, start = 16, threading.Barrier(16)
+
+        def create_rows(_):
+            with app.app_context():
+                try:
+                    start.wait()
+                    day_row = ensure_day(user_id, day)
+                    prayer = get_or_insert(PrayerLog, {'user_id': user_id, 'date': day}, {'day_id': day_row.id})
+                    log = get_or_insert(HabitLog, {'habit_id': habit_id, 'date': day}, {'day_id': day_row.id})
+                    return day_row.id, prayer.id, log.id
+                finally:
+                    db.session.remove()
+
+        with ThreadPoolExecutor(threads) as pool:
+            results = set(pool.map(create_rows, range(threads)))
+        self.assertEqual(len(results), 1)  # Every thread got the same rows, none failed
+        self.assertEqual(Day.query.filter_by(user_id=user_id, date=day).count(), 1)
+        self.assertEqual(PrayerLog.query.filter_by(user_id=user_id, date=day).count(), 1)
+        self.assertEqual(HabitLog.query.filter_by(habit_id=habit_id, date=day).count(), 1)
+        # Once the row exists, fetching it is a single SELECT
+        with self.captured_queries() as queries:
+            ensure_day(user_id, day)
+        self.assertEqual(len(queries), 1)
+
+    def test_rollover_makes_morning_dashboard_read_only(self):
+        self.login('testuser', 'password')  # Creates today's Day, so the user counts as active
+        habit = Habit(name='Read', user_id=self.user.id)
+        db.session.add(habit)
+        db.session.commit()
+        tomorrow = get_today() + timedelta(days=1)
+
+        created = rollover_day(tomorrow)
+        self.assertEqual(created, {'days': 1, 'prayer_logs': 1, 'streaks': 1})
+        self.assertEqual(rollover_day(tomorrow), {'days': 0, 'prayer_logs': 0, 'streaks': 0})
+        day = Day.query.filter_by(user_id=self.user.id, date=tomorrow).one()
+        self.assertEqual(PrayerLog.query.filter_by(user_id=self.user.id, date=tomorrow).one().day_id, day.id)
+        self.assertIsNone(Day.query.filter_by(user_id=self.other_user.id, date=tomorrow).first())
+
+        with self.captured_queries() as queries, mock.patch('app.get_today', return_value=tomorrow):
+            self.assertEqual(self.app.get('/dashboard').status_code, 200)
+        self.assertEqual([q.statement for q in queries if not q.statement.lstrip().upper().startswith('SELECT')], [])
+
+    def test_habit_delta_and_set(self):
+        self.login('testuser', 'password')
+        habit = Habit(name='Water', user_id=self.user.id, points=40, target_value=8)
+        db.session.add(habit)
+        db.session.commit()
+        data = self.app.post(f'/habit/toggle/{habit.id}', json={'delta': 3}).get_json()
+        self.assertEqual((data['value_done'], data['new_status']), (3, False))
+        data = self.app.post(f'/habit/toggle/{habit.id}', json={'delta': 20}).get_json()
+        self.assertEqual((data['value_done'], data['new_status']), (8, True))  # Clamped at the target
+        data = self.app.post(f'/habit/toggle/{habit.id}', data={'set': '5'}).get_json()
+        self.assertEqual(data['value_done'], 5)
+        self.assertEqual(HabitLog.query.filter_by(habit_id=habit.id).one().points, 25)
+        self.assertEqual(self.app.post(f'/habit/toggle/{habit.id}', json={'delta': 'two'}).status_code, 400)
+        self.assertEqual(reconcile_day_scores(fix=False), [])
+
+    def test_parallel_habit_increments_are_not_lost(self):
+        habit = Habit(name='Pushups', user_id=self.user.id, points=100, target_value=50)
+        db.session.add(habit)
+        db.session.commit()
+        habit_id, taps = habit.id, 20
+        clients = []
+        for _ in range(taps):
+            client = app.test_client()
+            client.post('/login', data={'username': 'testuser', 'password': 'password'})
+            clients.append(client)
+        start = threading.Barrier(taps)
+
+        def tap(client):
+            start.wait()
+            payload = {'delta': 1} if clients.index(client) % 2 else None
+            return client.post(f'/habit/toggle/{habit_id}', json=payload).status_code
+
+        with ThreadPoolExecutor(taps) as pool:
+            statuses = list(pool.map(tap, clients))
+        self.assertEqual(statuses, [200] * taps)
+        db.session.expire_all()
+        log = HabitLog.query.filter_by(habit_id=habit_id, date=get_today()).one()
+        self.assertEqual((log.value_done, log.points), (taps, 100 * taps // 50))
+        self.assertEqual(Day.query.filter_by(user_id=self.user.id, date=get_today()).one().total_score, log.points)
+
+    def test_batch_applies_ops_in_one_transaction(self):
+        self.login('testuser', 'password')
+        habit = Habit(name='Pushups', user_id=self.user.id, points=30, target_value=3)
+        schedule = Schedule(name='Term', user_id=self.user.id)
+        db.session.add_all([habit, schedule])
+        db.session.commit()
+        item = RoutineItem(schedule_id=schedule.id, title='Math', day_of_week='Monday',
+                           start_time=time(10, 0), end_time=time(11, 0))
+        db.session.add(item)
+        db.session.commit()
+        ops = [{'type': 'habit', 'id': habit.id}, {'type': 'habit', 'id': habit.id}, {'type': 'habit', 'id': habit.id},
+               {'type': 'routine', 'id': item.id},
+               {'type': 'prayer', 'prayer': 'fajr', 'status': True},
+               {'type': 'day', 'mood': 5}]
+
+        with self.captured_queries() as queries:
+            data = self.app.post('/api/batch', json={'ops': ops}).get_json()
+
+        self.assertTrue(data['success'])
+        self.assertEqual([r.get('value_done') for r in data['results'][:3]], [1, 2, 3])
+        self.assertTrue(data['results'][3]['new_status'])
+        self.assertEqual(data['results'][4]['score'], 100)
+        self.assertEqual(data['score'], 30 + 10 + 100)
+        self.assertEqual(len([q for q in queries if q.statement.startswith('UPDATE day SET total_score')]), 1)
+        day = Day.query.filter_by(user_id=self.user.id, date=get_today()).one()
+        self.assertEqual(day.mood, 5)
+        self.assertEqual(reconcile_day_scores(fix=False), [])
+
+    def test_batch_rejects_invalid_ops_atomically(self):
+        self.login('testuser', 'password')
+        mine = Habit(name='Read', user_id=self.user.id)
+        theirs = Habit(name='Run', user_id=self.other_user.id)
+        db.session.add_all([mine, theirs])
+        db.session.commit()
+        rv = self.app.post('/api/batch', json={'ops': [{'type': 'habit', 'id': mine.id}, {'type': 'habit', 'id': theirs.id}]})
+        self.assertEqual(rv.status_code, 403)
+        self.assertEqual(rv.get_json()['index'], 1)
+        self.assertEqual(HabitLog.query.count(), 0)
+        self.assertEqual(self.app.post('/api/batch', json={'ops': [{'type': 'nap'}]}).status_code, 400)
+        for bad_id in ([mine.id], {'a': 1}, True, str(mine.id)):
+            rv = self.app.post('/api/batch', json={'ops': [{'type': 'habit', 'id': bad_id}, {'type': 'routine', 'id': bad_id}]})
+            self.assertEqual(rv.status_code, 403)
+            self.assertEqual(rv.get_json()['error'], 'Unknown habit')
+        self.assertEqual(HabitLog.query.count(), 0)
+
+    def test_sync_replayed_mutations_apply_once(self):
+        self.login('testuser', 'password')
+        habit = Habit(name='Read', user_id=self.user.id, points=10)
+        db.session.add(habit)
+        db.session.commit()
+        queue = {'mutations': [{'id': 'm1', 'op': {'type': 'habit', 'id': habit.id}},
+                               {'id': 'm2', 'op': {'type': 'prayer', 'prayer': 'fajr', 'status': True}}]}
+        first = self.app.post('/api/sync', json=queue).get_json()
+        self.assertEqual([r['status'] for r in first['results']], ['applied', 'applied'])
+        self.assertTrue(first['results'][0]['result']['new_status'])
+
+        # The response was lost, so the service worker replays the whole queue
+        again = self.app.post('/api/sync', json=queue).get_json()
+        self.assertEqual([r['status'] for r in again['results']], ['duplicate', 'duplicate'])
+        self.assertEqual(again['results'][0]['result'], first['results'][0]['result'])
+        self.assertEqual(again['score'], first['score'])
+        self.assertTrue(HabitLog.query.filter_by(habit_id=habit.id).one().status)  # Not toggled back
+
+    def test_sync_rejects_malformed_ops_without_blocking_the_queue(self):
+        self.login('testuser', 'password')
+        habit = Habit(name='Read', user_id=self.user.id, points=10)
+        db.session.add(habit)
+        db.session.commit()
+        rv = self.app.post('/api/sync', json={'mutations': [
+            {'id': 'm1', 'op': {'type': 'habit', 'id': {'a': 1}}},
+            {'id': 'm2', 'op': {'type': 'routine', 'id': [1]}},
+            {'id': 'm3', 'op': {'type': 'habit', 'id': habit.id}},
+        ]})
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual([r['status'] for r in rv.get_json()['results']], ['rejected', 'rejected', 'applied'])
+        self.assertTrue(HabitLog.query.filter_by(habit_id=habit.id).one().status)
+
+    def test_sync_dedups_within_a_request_and_dates_ops(self):
+        self.login('testuser', 'password')
+        habit = Habit(name='Water', user_id=self.user.id, target_value=5, points=10)
+        db.session.add(habit)
+        db.session.commit()
+        today = get_today()
+        yesterday_ms = int((datetime.combine(today - timedelta(days=1), time(12)) - timedelta(hours=6)).replace(tzinfo=timezone.utc).timestamp() * 1000)
+        too_old_ms = yesterday_ms - 30 * 24 * 3600 * 1000
+        tap = {'type': 'habit', 'id': habit.id}
+        rv = self.app.post('/api/sync', json={'mutations': [
+            {'id': 'a', 'op': tap}, {'id': 'a', 'op': tap}, {'id': 'b', 'op': tap},
+            {'id': 'c', 'op': tap, 'at': yesterday_ms},  # Queued offline before midnight
+            {'id': 'd', 'op': tap, 'at': too_old_ms},
+            {'id': 'e', 'op': {'type': 'habit', 'id': 999}},
+        ]})
+        self.assertEqual(rv.status_code, 200)
+        statuses = [r['status'] for r in rv.get_json()['results']]
+        self.assertEqual(statuses, ['applied', 'duplicate', 'applied', 'applied', 'rejected', 'rejected'])
+        self.assertEqual(HabitLog.query.filter_by(habit_id=habit.id, date=today).one().value_done, 2)
+        self.assertEqual(HabitLog.query.filter_by(habit_id=habit.id, date=today - timedelta(days=1)).one().value_done, 1)
+        self.assertEqual(HabitLog.query.count(), 2)
+
+        # Rejections are remembered too, so replaying them stays a no-op
+        rv = self.app.post('/api/sync', json={'mutations': [{'id': 'e', 'op': tap}]})
+        self.assertEqual(rv.get_json()['results'][0]['status'], 'duplicate')
+        self.assertFalse(rv.get_json()['results'][0]['result']['success'])
+        self.assertEqual(self.app.post('/api/sync', json={'mutations': [{'op': tap}]}).status_code, 400)
+
+    def fresh_post(self, client, url, **kwargs):
+        # Requests share the test's app context; start each one like a new context
+        db.session.remove()
+        g.pop('_login_user', None)
+        return client.post(url, **kwargs)
+
+    def test_telemetry_is_written_behind_and_skips_unchanged(self):
+        user_id = self.user.id
+        self.login('testuser', 'password')
+        identity = {'local_ip': '192.168.1.20', 'ipv6': '2001:db8::1', 'fingerprint': 'fp'}
+        post = lambda url, body: self.fresh_post(self.app, url, json=body)
+        updates = lambda: [q for q in queries if q.statement.startswith('UPDATE user')]
+        with self.captured_queries() as queries:
+            post('/api/user/sync_local_ip', identity)
+            post('/api/user/location', {'latitude': 23.810331, 'longitude': 90.412521})
+            post('/api/user/sync_local_ip', dict(identity, local_ip='192.168.1.21'))
+            self.assertEqual(updates(), [])
+            self.assertEqual(telemetry.flush(), 1)
+            self.assertEqual(len(updates()), 1)  # Both endpoints' columns in one UPDATE
+
+        user = db.session.get(User, user_id)
+        self.assertEqual((user.local_ip, user.ipv6_address, user.device_fingerprint), ('192.168.1.21', '2001:db8::1', 'fp'))
+        self.assertEqual((user.latitude, user.longitude), (23.8103, 90.4125))
+        synced_at = user.last_location_update
+        self.assertIsNotNone(synced_at)
+
+        # Same values, and GPS jitter below the stored precision, queue nothing
+        post('/api/user/sync_local_ip', dict(identity, local_ip='192.168.1.21'))
+        post('/api/user/location', {'latitude': 23.810349, 'longitude': 90.412488})
+        self.assertEqual(telemetry.flush(), 0)
+        self.assertEqual(db.session.get(User, user_id).last_location_update, synced_at)
+
+    def test_user_loader_is_cached_until_invalidated(self):
+        user_id = self.user.id
+        admin = User(username='admin', email='admin@example.com', role='admin')
+        admin.set_password('password')
+        db.session.add(admin)
+        db.session.commit()
+        other = app.test_client()
+        other.post('/login', data={'username': 'admin', 'password': 'password'})
+        self.login('testuser', 'password')
+
+        sync = lambda: self.fresh_post(self.app, '/api/user/sync_local_ip', json={})
+        self.assertEqual(sync().status_code, 200)
+        with self.captured_queries() as queries:
+            sync()
+        self.assertEqual(queries, [])
+
+        # A ban through the ORM logs the user out at once
+        self.fresh_post(other, f'/admin/user/{user_id}/ban')
+        self.assertEqual(sync().status_code, 302)
+        self.fresh_post(other, f'/admin/user/{user_id}/ban')  # Unban
+        self.assertEqual(sync().status_code, 200)
+
+        # Another worker's change only shows up here once the stamp moves
+        User.query.filter_by(id=user_id).update({'is_banned': True})
+        db.session.commit()
+        self.assertEqual(sync().status_code, 200)
+        bump_user_cache_stamp()
+        self.assertEqual(sync().status_code, 302)
+
+    def test_audit_log_is_spooled_and_replayed_once(self):
+        admin = User(username='admin', email='admin@example.com', role='admin')
+        admin.set_password('password')
+        db.session.add(admin)
+        db.session.commit()
+        admin_id, user_id = admin.id, self.user.id
+        self.login('admin', 'password')
+        spool = app.config['AUDIT_SPOOL_DIR']
+
+        self.assertEqual(self.app.get(f'/admin/user/{user_id}').status_code, 200)
+        self.app.post('/admin/log_action', json={'action': 'export_data', 'target_user_id': user_id})
+        self.assertEqual(AuditLog.query.count(), 0)  # Only fsync'd to the spool so far
+        [live] = os.listdir(spool)
+        with open(os.path.join(spool, live)) as f:
+            spooled = [json.loads(line) for line in f]
+        self.assertEqual([r['action'] for r in spooled], ['view_user', 'export_data'])
+        self.assertEqual(audit_spool.flush(), 2)
+        self.assertEqual(os.listdir(spool), [])
+
+        # A crash left a sealed file whose rows were already inserted, and a dead
+        # worker's live file ending in a torn write
+        late = dict(spooled[0], record_id='late-record', action='ban_user')
+        with open(os.path.join(spool, 'audit-1-dead.sealed'), 'w') as f:
+            f.writelines(json.dumps(r) + '\n' for r in spooled)
+        with open(os.path.join(spool, 'audit-2-dead.jsonl'), 'w') as f:
+            f.write(json.dumps(late) + '\n' + '{"record_id": "torn')
+        audit_spool.flush(recover=True)
+        self.assertEqual(sorted(a.action for a in AuditLog.query), ['ban_user', 'export_data', 'view_user'])
+        self.assertEqual(os.listdir(spool), [])
+
+        # Deleting a user keeps the record; the missing row only clears target_user_id
+        self.app.post(f'/admin/user/{user_id}/delete')
+        audit_spool.flush()
+        deleted = AuditLog.query.filter_by(action='delete_user').one()
+        self.assertEqual((deleted.admin_id, deleted.target_user_id), (admin_id, None))
+        self.assertIn('testuser', deleted.reason)
+
+    def test_audit_record_is_spooled_only_after_commit(self):
+        admin = User(username='admin', email='admin@example.com', role='admin')
+        admin.set_password('password')
+        db.session.add(admin)
+        db.session.commit()
+        spool = app.config['AUDIT_SPOOL_DIR']
+        with app.test_request_context():
+            login_user(admin)
+            record_audit('add_dua', reason='Never added')
+            db.session.add(User(username='testuser', email='duplicate@example.com'))
+            with self.assertRaises(IntegrityError):
+                db.session.commit()
+            db.session.rollback()
+            self.assertEqual(os.listdir(spool), [])
+
+            record_audit('add_dua', reason='Added')
+            db.session.commit()
+        self.assertEqual(audit_spool.flush(), 1)
+        self.assertEqual([a.reason for a in AuditLog.query], ['Added'])
+
+    def test_journal_access_audit_keeps_its_target(self):
+        admin = User(username='admin', email='admin@example.com', role='admin')
+        admin.set_password('password')
+        db.session.add(admin)
+        db.session.commit()
+        user_id = self.user.id
+        self.login('admin', 'password')
+        # As admin_user_detail.html sends it: the id read from data-user-id
+        rv = self.app.post('/admin/log_action', json={
+            'action': 'view_reflections', 'target_user_id': str(user_id), 'reason': 'Safeguarding review'})
+        self.assertEqual(rv.status_code, 200)
+        for bad in ('2x', [user_id], True):
+            rv = self.app.post('/admin/log_action', json={'action': 'view_reflections', 'target_user_id': bad})
+            self.assertEqual(rv.status_code, 400)
+        self.assertEqual(audit_spool.flush(), 1)
+        self.assertEqual(AuditLog.query.one().target_user_id, user_id)
+
+    def test_admin_user_search_and_keyset_pages(self):
+        run_migrations(log=lambda message: None)  # FTS5 user search table
+        admin = User(username='admin', email='admin@example.com', role='admin')
+        admin.set_password('password')
+        db.session.add(admin)
+        db.session.add_all(User(username=f'member{i}', email=f'm{i}@example.org', password_hash='x') for i in range(120))
+        db.session.commit()
+        self.login('admin', 'password')
+        ids = lambda rv: [int(i) for i in re.findall(r'#ID (\d+)', rv.get_data(as_text=True))]
+
+        # Newest first, 50 per page; walking forward visits every user once
+        seen, after = [], None
+        while True:
+            rv = self.app.get('/admin/users' + (f'?after={after}' if after else ''))
+            page = ids(rv)
+            seen.extend(page)
+            if 'Next →' not in rv.get_data(as_text=True):
+                break
+            after = page[-1]
+        total = User.query.count()
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(seen), total)
+        self.assertIn(f'{total} users', self.app.get('/admin/users').get_data(as_text=True))
+        self.assertEqual(ids(self.app.get(f'/admin/users?before={seen[100]}')), seen[50:100])
+
+        # Substring search through the trigram index, exact paths for ids and emails
+        with self.captured_queries() as queries:
+            rv = self.app.get('/admin/users?q=MEMBER11&sort=username&dir=asc')
+        self.assertTrue(any('MATCH' in q.statement for q in queries))
+        names = re.findall(r'font-weight: 600;">(member\d+)<', rv.get_data(as_text=True))
+        self.assertEqual(names, sorted(['member11'] + [f'member11{i}' for i in range(10)]))
+        member = User.query.filter_by(username='member7').one()
+        self.assertEqual(ids(self.app.get(f'/admin/users?q={member.id}')), [member.id])
+        self.assertEqual(ids(self.app.get('/admin/users?q=M7@example.org')), [member.id])
+        self.assertEqual(len(ids(self.app.get('/admin/users?q=r7'))), 11)  # Too short for trigrams: LIKE
+        member.username = 'zeta'
+        db.session.commit()
+        self.assertEqual(ids(self.app.get('/admin/users?q=zeta')), [member.id])  # Kept current by triggers
+
+    def test_admin_user_history_is_paged_by_date_and_id(self):
+        admin = User(username='admin', email='admin@example.com', role='admin')
+        admin.set_password('password')
+        db.session.add(admin)
+        habit = Habit(name='Read', user_id=self.user.id)
+        db.session.add(habit)
+        db.session.flush()
+        start = date(2024, 1, 1)
+        for i in range(120):
+            day = Day(user_id=self.user.id, date=start + timedelta(days=i), reflection=f'note {i}')
+            db.session.add(day)
+            db.session.flush()
+            db.session.add(HabitLog(habit_id=habit.id, date=day.date, day_id=day.id, status=i % 2 == 0))
+            db.session.add(PrayerLog(user_id=self.user.id, date=day.date, day_id=day.id, fajr=True))
+            db.session.add_all(ScheduleLog(user_id=self.user.id, date=day.date, day_id=day.id, task=f'task {n}', status=n == 0)
+                               for n in range(2))
+        db.session.commit()
+        self.login('admin', 'password')
+
+        rv = self.app.get(f'/admin/user/{self.user.id}')
+        self.assertIn('Journal (120)', rv.get_data(as_text=True))
+        self.assertNotIn('note 119', rv.get_data(as_text=True))  # Reflections only come from the API
+
+        def walk(kind):
+            seen, after = [], None
+            while True:
+                data = self.app.get(f'/admin/api/user/{self.user.id}/{kind}' + (f'?after={after}' if after else '')).get_json()
+                self.assertLessEqual(len(data['items']), 50)
+                seen.extend(data['items'])
+                after = data['next']
+                if after is None:
+                    return seen
+        keys = lambda items: [(i['date'], i['id']) for i in items]
+        for kind, total in (('prayers', 120), ('schedule_logs', 240), ('days', 120)):
+            items = walk(kind)
+            self.assertEqual(len(items), total)
+            self.assertEqual(keys(items), sorted(keys(items), reverse=True))
+            self.assertEqual(len(set(keys(items))), total)
+
+        newest = self.app.get(f'/admin/api/user/{self.user.id}/days').get_json()['items'][0]
+        self.assertEqual(newest['reflection'], 'note 119')
+        self.assertEqual(newest['habits'], [0, 1])
+        self.assertEqual(newest['schedule'], [1, 2])
+        self.assertTrue(newest['prayers']['fajr'])
+        self.assertFalse(newest['prayers']['isha'])
+
+        # A page is a fixed number of statements, however many days it shows
+        with self.captured_queries() as queries:
+            self.app.get(f'/admin/api/user/{self.user.id}/days')
+        self.assertLessEqual(len(queries), 3)
+        self.assertEqual(self.app.get(f'/admin/api/user/{self.user.id}/days?after=bogus').status_code, 400)
+
+    def test_upload_is_queued_and_processed_by_the_worker(self):
+        self.login('testuser', 'password')
+        routine = b"1 CSC 197 Saturday 09:35am - 10:35am\n2 STA 240 Monday 11:00am - 12:30pm\n"
+        upload = lambda body, name: self.app.post('/schedule/upload', data={'file': (io.BytesIO(body), name)},
+                                                 content_type='multipart/form-data')
+
+        rv = upload(routine, 'routine.txt')
+        job = UploadJob.query.one()
+        self.assertTrue(rv.location.endswith(f'/schedule/upload/jobs/{job.id}'))
+        self.assertEqual(job.status, 'queued')
+        self.assertIn('Waiting in queue', self.app.get(rv.location).get_data(as_text=True))
+        self.assertEqual(self.app.get(f'/api/upload/jobs/{job.id}').get_json()['status'], 'queued')
+
+        # A different file under the same name is stored separately, then cancelled before the worker gets to it
+        second = db.session.get(UploadJob, int(upload(routine + b'\n', 'routine.txt').location.rsplit('/', 1)[1]))
+        self.assertNotEqual(second.path, job.path)
+        self.assertTrue(self.app.post(f'/api/upload/jobs/{second.id}/cancel').get_json()['success'])
+        self.assertEqual(self.app.post(f'/api/upload/jobs/{second.id}/cancel').status_code, 409)
+
+        inflight = {}
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            self.assertEqual(drain_upload_jobs(pool, inflight)['started'], 1)
+            wait(inflight)
+            self.assertEqual(drain_upload_jobs(pool, inflight)['finished'], 1)
+        db.session.expire_all()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(second.status, 'cancelled')
+        rv = self.app.get(f'/schedule/upload/jobs/{job.id}')
+        self.assertIn('Found 2 potential schedule items', rv.get_data(as_text=True))
+        self.assertIn('STA 240', rv.get_data(as_text=True))
+
+        # Other users cannot see the job; limits are enforced before anything is stored
+        self.app.get('/logout')
+        self.login('other', 'password')
+        self.assertEqual(self.app.get(f'/api/upload/jobs/{job.id}').status_code, 404)
+        self.app.get('/logout')
+        self.login('testuser', 'password')
+        upload(b'x', 'routine.exe')
+        self.assertEqual(UploadJob.query.count(), 2)
+        app.config['UPLOAD_MAX_BYTES'], limit = 1024, app.config['UPLOAD_MAX_BYTES']
+        try:
+            upload(b'x' * 200 * 1024, 'big.txt')
+        finally:
+            app.config['UPLOAD_MAX_BYTES'] = limit
+        self.assertIn('too large', self.app.get('/schedule/upload').get_data(as_text=True))
+        self.assertEqual(UploadJob.query.count(), 2)
+
+    def test_cancelled_running_upload_holds_its_slot(self):
+        self.login('testuser', 'password')
+        upload = lambda body: self.app.post('/schedule/upload', data={'file': (io.BytesIO(body), 'routine.txt')},
+                                            content_type='multipart/form-data')
+        upload(b"1 CSC 197 Saturday 09:35am - 10:35am\n")
+        job = UploadJob.query.one()
+        release = threading.Event()
+
+        def slow_job(path, limits):
+            release.wait()
+            return {'status': 'done', 'text': 'CSC 197', 'items': []}
+
+        inflight = {}
+        with ThreadPoolExecutor(max_workers=1) as pool, mock.patch('app.run_upload_job', side_effect=slow_job):
+            drain_upload_jobs(pool, inflight)
+            self.assertEqual(self.app.post(f'/api/upload/jobs/{job.id}/cancel').get_json()['status'], 'cancelling')
+            self.assertIn('Upload cancelled', self.app.get(f'/schedule/upload/jobs/{job.id}', follow_redirects=True).get_data(as_text=True))
+
+            # Until its pool process is free, the job still counts toward UPLOAD_MAX_ACTIVE
+            app.config['UPLOAD_MAX_ACTIVE'], limit = 1, app.config['UPLOAD_MAX_ACTIVE']
+            try:
+                upload(b"2 STA 240 Monday 11:00am - 12:30pm\n")
+                self.assertEqual(UploadJob.query.count(), 1)
+            finally:
+                app.config['UPLOAD_MAX_ACTIVE'] = limit
+
+            release.set()
+            wait(inflight)
+            self.assertEqual(drain_upload_jobs(pool, inflight)['cancelled'], 1)
+        db.session.expire_all()
+        self.assertEqual(job.status, 'cancelled')
+        self.assertIsNone(job.text)
+        self.assertEqual(UploadResult.query.count(), 0)  # A cancelled job's output is not cached
+
+    def test_upload_results_are_cached_by_content_and_swept(self):
+        self.login('testuser', 'password')
+        routine = b"1 CSC 197 Saturday 09:35am - 10:35am\n2 STA 240 Monday 11:00am - 12:30pm\n"
+        upload = lambda name: self.app.post('/schedule/upload', data={'file': (io.BytesIO(routine), name)},
+                                            content_type='multipart/form-data')
+        job_of = lambda rv: db.session.get(UploadJob, int(rv.location.rsplit('/', 1)[1]))
+        first, second = job_of(upload('mine.txt')), job_of(upload('friends copy.txt'))
+        self.assertEqual(first.path, second.path)
+        self.assertEqual(len(os.listdir(app.config['UPLOAD_FOLDER'])), 1)
+
+        # Only one extraction runs; the duplicate is completed from its result
+        inflight = {}
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            self.assertEqual(drain_upload_jobs(pool, inflight)['started'], 1)
+            wait(inflight)
+            metrics = drain_upload_jobs(pool, inflight)
+        self.assertEqual((metrics['finished'], metrics['cached'], metrics['started']), (1, 1, 0))
+        db.session.expire_all()
+        self.assertEqual((first.status, second.status), ('done', 'done'))
+        self.assertEqual(second.items, first.items)
+
+        # Later uploads of the same file skip the worker entirely
+        rv = self.app.get(upload('again.txt').location)
+        self.assertIn('Found 2 potential schedule items', rv.get_data(as_text=True))
+        self.assertEqual(UploadResult.query.count(), 1)
+
+        # The sweeper only deletes stale files it stored (and abandoned partial writes)
+        folder = app.config['UPLOAD_FOLDER']
+        stale = _time.time() - 8 * 24 * 3600
+        for name in ('a' * 64 + '.png', 'upload.part', 'legacy.txt'):
+            with open(os.path.join(folder, name), 'wb') as f:
+                f.write(b'x' * 10)
+            os.utime(os.path.join(folder, name), (stale, stale))
+        self.assertEqual(sweep_uploads()['files'], 2)
+        self.assertEqual(sorted(os.listdir(folder)), sorted(['legacy.txt', os.path.basename(first.path)]))
+        app.config['UPLOAD_FOLDER_MAX_BYTES'], budget = 0, app.config['UPLOAD_FOLDER_MAX_BYTES']
+        try:
+            self.assertEqual(sweep_uploads()['files'], 1)  # Over budget: recent files go too
+        finally:
+            app.config['UPLOAD_FOLDER_MAX_BYTES'] = budget
+        self.assertEqual(os.listdir(folder), ['legacy.txt'])
+        self.assertEqual(sweep_uploads(now=datetime.utcnow() + timedelta(days=121))['results'], 1)
+
+    def test_upload_extraction_streams_within_budget(self):
+        folder = app.config['UPLOAD_FOLDER']
+        limits = dict(upload_limits(), timeout=0)
+        w = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+        cell = lambda *paras: '<w:tc>' + ''.join(f'<w:p><w:r><w:t>{p}</w:t></w:r></w:p>' for p in paras) + '</w:tc>'
+        document = (f'<w:document {w}><w:body><w:p><w:r><w:t>Class </w:t></w:r><w:r><w:t>Routine</w:t></w:r></w:p>'
+                    f'<w:tbl><w:tr>{cell("CSC 197", "Section A")}{cell("Saturday")}{cell("09:35am - 10:35am")}</w:tr>'
+                    f'<w:tr>{cell("STA 240")}{cell("")}{cell("Monday 11:00am - 12:30pm")}</w:tr></w:tbl></w:body></w:document>')
+        docx_path = os.path.join(folder, 'routine.docx')
+        with zipfile.ZipFile(docx_path, 'w') as archive:
+            archive.writestr('word/document.xml', document)
+        self.assertEqual(list(iter_upload_lines(docx_path)), [
+            'Class Routine', 'CSC 197 Section A | Saturday | 09:35am - 10:35am', 'STA 240 | Monday 11:00am - 12:30pm'])
+        self.assertEqual([i['title'] for i in run_upload_job(docx_path, limits)['items']], ['CSC 197', 'STA 240'])
+
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet('Routine')
+        for n in range(500):
+            ws.append([n, 'CSC 197', None, 'Saturday', '09:35am - 10:35am'])
+        xlsx_path = os.path.join(folder, 'routine.xlsx')
+        wb.save(xlsx_path)
+        result = run_upload_job(xlsx_path, dict(limits, max_rows=101))
+        self.assertEqual(len(result['items']), 100)  # The sheet header line, then 100 rows
+        self.assertTrue(result['text'].endswith('[Stopped reading after 101 rows]'))
+        self.assertIn('0 | CSC 197 | Saturday', result['text'])
+        result = run_upload_job(xlsx_path, dict(limits, max_text_bytes=1000))
+        self.assertLess(len(result['text']), 1100)
+        self.assertEqual(run_upload_job(os.path.join(folder, 'missing.doc'), limits)['status'], 'failed')
+
+    def test_ocr_preprocessing_straightens_and_crops_a_photo(self):
+        # A "photo": a tilted page of table rows on a dark desk, under uneven light
+        page = Image.new('L', (1400, 1000), 235)
+        draw = ImageDraw.Draw(page)
+        for row in range(16):
+            y = 120 + row * 48
+            draw.line((100, y - 12, 1300, y - 12), fill=120, width=2)
+            for x in range(120, 1260, 140):
+                draw.rectangle((x, y, x + 90, y + 14), fill=30)
+        photo = Image.new('L', (2600, 2000), 40)
+        photo.paste(page.rotate(3, expand=True, fillcolor=40), (500, 400))
+        photo = ImageChops.multiply(photo, Image.linear_gradient('L').rotate(90).resize(photo.size).point(lambda v: 140 + v // 2))
+
+        self.assertAlmostEqual(deskew_angle(photo.point(lambda v: 255 if v > 100 else 0)), -3, delta=0.5)
+        out = preprocess_for_ocr(photo, target_dpi=150)
+        self.assertEqual(out.mode, 'L')
+        self.assertEqual({v for _, v in out.getcolors()}, {0, 255})
+        self.assertEqual(deskew_angle(out), 0)
+        # Downscaled to 150 DPI (1755 px long side), then cropped to the table: the desk is gone
+        scale = 150 * 11.7 / 2600
+        self.assertLess(out.width, 1400 * scale)
+        self.assertLess(out.height, 1000 * scale)
+        self.assertGreater(out.width, 1100 * scale)
+
+    def test_analytics_days_is_clamped(self):
+        self.login('testuser', 'password')
+        data = self.app.get('/api/analytics_data?days=100000').get_json()
+        self.assertEqual(len(data['labels']), 5 * 366)
+        data = self.app.get('/api/analytics_data?days=0').get_json()
+        self.assertEqual(len(data['labels']), 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,52 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from app import app, db, drain_upload_jobs, expire_upload_jobs, sweep_uploads
+
+# Processes queued schedule uploads: OCR and docx/xlsx extraction run on a
+# process pool (one process per core by default, see UPLOAD_WORKERS) so a slow
+# photo never holds a web worker. Results are cached by file content, and
+# the uploads folder is swept to stay within its retention and size budget.
+# Usage: python upload_worker.py
+
+IDLE_SLEEP = 1  # Seconds to wait for a queued job or a finished one
+EXPIRE_EVERY = 60  # Seconds between sweeps for dead and old jobs and stored files
+
+
+def new_pool():
+    return ProcessPoolExecutor(max_workers=app.config['UPLOAD_WORKERS'])
+
+
+if __name__ == "__main__":
+    pool = new_pool()
+    inflight = {}
+    next_expire = 0
+    print("Upload worker started.")
+    while True:
+        with app.app_context():
+            try:
+                if time.monotonic() >= next_expire:
+                    failed, deleted = expire_upload_jobs()
+                    if failed or deleted:
+                        print(f"Upload jobs: {failed} interrupted, {deleted} deleted")
+                    swept = sweep_uploads()
+                    if swept['files'] or swept['results']:
+                        print(f"Upload sweep: {swept}")
+                    next_expire = time.monotonic() + EXPIRE_EVERY
+                metrics = drain_upload_jobs(pool, inflight)
+            except BrokenProcessPool as e:
+                # A pool process died; its futures fail on the next drain
+                print(f"Upload pool broken, restarting: {e}")
+                db.session.rollback()
+                pool = new_pool()
+                metrics = {}
+            except Exception as e:
+                print(f"Upload worker error: {e}")
+                db.session.rollback()
+                metrics = {}
+        if any(metrics.values()):
+            print(f"Upload batch: {metrics}")
+        if inflight:
+            wait(inflight, timeout=IDLE_SLEEP, return_when=FIRST_COMPLETED)
+        else:
+            time.sleep(IDLE_SLEEP)